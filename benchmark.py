@@ -0,0 +1,154 @@
+"""
+LogisticsEnv throughput benchmark.
+
+Builds networks of several sizes with fixed seeds, runs the simulator on each
+and writes machine-readable JSON so runs can be compared across commits:
+
+    python benchmark.py --stations 25 250 --packets 1000 10000 --out bench.json
+    python benchmark.py --out new.json --compare bench.json
+    python benchmark.py --stations 250 --packets 10000 --profile   # per-phase step() timings
+
+Every scenario runs in a fresh process so its peak RSS is its own.
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing as mp
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+STATIONS = [25, 250, 2500]
+PACKETS = [10**3, 10**4, 10**5, 10**6]
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def scenario_name(cfg):
+    return f"s{cfg['station_num']}-c{cfg['center_num']}-p{cfg['packet_num']}"
+
+
+def run_scenario(cfg, seed, max_steps, max_seconds, profile=False):
+    import main
+    main.VERBOSE = False
+    random.seed(seed)
+    np.random.seed(seed)
+
+    phases = {}
+    t0 = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        topology, _ = main.make_network(dict(cfg, packet_num=0))
+    phases["generate"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    packets = main.generate_packet_arrays(cfg["packet_num"], cfg["station_num"], seed=seed)
+    phases["packets"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    env = main.LogisticsEnv(topology, packets)
+    phases["build"] = time.perf_counter() - t0
+    env.enable_profiling(profile)
+
+    steps = 0
+    t0 = time.perf_counter()
+    while not env.done and steps < max_steps and time.perf_counter() - t0 < max_seconds:
+        env.step()
+        steps += 1
+    run_time = time.perf_counter() - t0
+    phases["run"] = run_time
+
+    delivered = sum(1 for p in env.packages.values() if p.done)
+    return {
+        "scenario": scenario_name(cfg),
+        "config": cfg,
+        "seed": seed,
+        "nodes": len(env.nodes),
+        "routes": len(env.routes),
+        "steps": steps,
+        "sim_time": env.TimeTick,
+        "finished": bool(env.done),
+        "delivered": delivered,
+        "steps_per_sec": steps / run_time if run_time else None,
+        "packages_per_sec": delivered / run_time if run_time else None,
+        "phases": phases,
+        "peak_rss_mb": peak_rss_mb(),
+        "step_phases": env.stats(),  # None unless --profile
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {r["scenario"]: r for r in json.load(f)["results"]}
+    print(f"{'scenario':<24}{'steps/s':>12}{'baseline':>12}{'ratio':>8}")
+    for r in results:
+        old = baseline.get(r["scenario"])
+        if old is None or not old.get("steps_per_sec") or not r.get("steps_per_sec"):
+            continue
+        ratio = r["steps_per_sec"] / old["steps_per_sec"]
+        print(f"{r['scenario']:<24}{r['steps_per_sec']:>12.1f}{old['steps_per_sec']:>12.1f}{ratio:>8.2f}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="LogisticsEnv throughput benchmark")
+    parser.add_argument("--stations", type=int, nargs="+", default=STATIONS)
+    parser.add_argument("--packets", type=int, nargs="+", default=PACKETS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-steps", type=int, default=10**6)
+    parser.add_argument("--max-seconds", type=float, default=600.0, help="stepping budget per scenario")
+    parser.add_argument("--out", default="bench_output.json")
+    parser.add_argument("--compare", help="earlier JSON output to compare steps/s against")
+    parser.add_argument("--profile", action="store_true", help="record per-phase step() timings (adds some overhead)")
+    args = parser.parse_args()
+
+    results = []
+    for station_num in args.stations:
+        for packet_num in args.packets:
+            cfg = {"station_num": station_num, "center_num": max(1, station_num // 5), "packet_num": packet_num}
+            with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as pool:
+                r = pool.submit(run_scenario, cfg, args.seed, args.max_steps, args.max_seconds,
+                                args.profile).result()
+            print(f"{r['scenario']}: {r['steps']} steps, {r['steps_per_sec']:.1f} steps/s, "
+                  f"{r['packages_per_sec']:.1f} pkg/s, peak {r['peak_rss_mb']} MB")
+            if r["step_phases"]:
+                for phase, p in r["step_phases"]["phases"].items():
+                    print(f"    {phase:<16}{p['seconds']:>10.3f}s{p['share']:>8.1%}{p['items']:>12}")
+            results.append(r)
+            # rewrite after every scenario so an interrupted sweep keeps what it measured
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump({
+                    "commit": git_commit(),
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "results": results,
+                }, f, indent=2)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main_cli()
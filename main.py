@@ -1,37 +1,188 @@
 import random
 import numpy as np
-import matplotlib.pyplot as plt
 import uuid
-from sklearn.cluster import KMeans
+import heapq
+import copy
+import gzip
+import itertools
+import json
+import os
+import pickle
+from collections import deque
+from time import perf_counter
 parameters = {
     "station_num": 25,
     "center_num": 5,
     "packet_num": 10,
 }
-def data_gen():
+# Per-package event trace of the simulator; benchmarks and workers switch it off
+VERBOSE = True
+# From this many stations data_gen() builds a large network: bulk generation, sparse cost matrices
+LARGE_STATION_NUM = 5000
+class PacketArrays:
+    """Columnar packets sorted by create time: create_time (float64), src and dst
+    (station numbers) and category (int8, 1 for Express) arrays.
+
+    It is also a sequence of (create_time, src, dst, category) tuples, made on access,
+    so LogisticsEnv and PacketStream take it as is and a load test with 10^7 packets
+    never holds them as tuples. A slice is a PacketArrays of views, tuples() gives
+    the plain list.
+    """
+    chunk = 1 << 16  # tuples made at a time while iterating
+
+    def __init__(self, create_time, src, dst, category):
+        self.create_time = create_time
+        self.src = src
+        self.dst = dst
+        self.category = category
+
+    def __len__(self):
+        return len(self.create_time)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return PacketArrays(self.create_time[k], self.src[k], self.dst[k], self.category[k])
+        return (float(self.create_time[k]), f"s{self.src[k]}", f"s{self.dst[k]}", int(self.category[k]))
+
+    def __iter__(self):
+        for start in range(0, len(self), self.chunk):
+            part = slice(start, start + self.chunk)
+            yield from zip(self.create_time[part].tolist(),
+                           [f"s{k}" for k in self.src[part].tolist()],
+                           [f"s{k}" for k in self.dst[part].tolist()],
+                           self.category[part].tolist())
+
+    def tuples(self):
+        return list(self)
+
+
+def generate_packet_arrays(packet_num, station_num, seed=None):
+    # generate_packets() as PacketArrays, every draw is made for all packets at once.
+    # A seed gives every environment of a VecLogisticsEnv its own reproducible demand.
+    rng = np.random.RandomState(seed) if seed is not None else np.random
+    src_prob = rng.random_sample(station_num)
+    src_prob = src_prob / np.sum(src_prob)
+    dst_prob = rng.random_sample(station_num)
+    dst_prob = dst_prob / np.sum(dst_prob)
+    # Package categories are defined here: 0 for Regular, 1 for Express
+    speed_prob = [0.7, 0.3]
+    src = rng.choice(station_num, size=packet_num, p=src_prob)
+    dst = rng.choice(station_num, size=packet_num, p=dst_prob)
+    # Draw the destinations equal to their source again, until none is left
+    clash = np.flatnonzero(dst == src)
+    while len(clash):
+        dst[clash] = rng.choice(station_num, size=len(clash), p=dst_prob)
+        clash = clash[dst[clash] == src[clash]]
+    category = rng.choice(2, size=packet_num, p=speed_prob).astype(np.int8)
+    # Create time of the package, during 12 time ticks(hours). Of course you can change it.
+    create_time = rng.random_sample(packet_num) * 12
+    order = np.argsort(create_time)
+    return PacketArrays(create_time[order], src[order].astype(np.int32), dst[order].astype(np.int32), category[order])
+
+def generate_packets(packet_num, station_num, seed=None):
+    # Packets are (create_time, src, dst, category) tuples sorted by create time.
+    # A seed gives every environment of a VecLogisticsEnv its own reproducible demand.
+    return generate_packet_arrays(packet_num, station_num, seed).tuples()
+
+def demand_stream(station_num, rate, seed=None, until=None):
+    # Endless synthetic demand: Poisson arrivals of `rate` packets per hour, with the
+    # same src/dst/category model as generate_packets(). Stops at `until` if given.
+    rng = np.random.RandomState(seed)
+    src_prob = rng.random_sample(station_num)
+    src_prob = src_prob / np.sum(src_prob)
+    dst_prob = rng.random_sample(station_num)
+    dst_prob = dst_prob / np.sum(dst_prob)
+    create_time = 0.0
+    while True:
+        create_time += rng.exponential(1.0 / rate)
+        if until is not None and create_time > until:
+            return
+        src = rng.choice(station_num, p=src_prob)
+        dst = rng.choice(station_num, p=dst_prob)
+        while dst == src:
+            dst = rng.choice(station_num, p=dst_prob)
+        yield (create_time, f"s{src}", f"s{dst}", rng.choice(2, p=[0.7, 0.3]))
+
+def route_arrays(center_pos, station_pos, station_labels, road_radius=30):
+    # Every route as arrays (src, dst, time_cost, money_cost) over node positions, centers
+    # first (c{i} -> i) then stations (s{j} -> center_num + j), both directions of a pair
+    # next to each other. Distances are computed once: broadcast between centers and to
+    # the stations of each cluster, and roads (stations closer than road_radius) come
+    # from a k-d tree radius query, so no pass over all station pairs is made.
+    from scipy.spatial import cKDTree
+    centers = np.asarray(center_pos, dtype=float).reshape(-1, 2)
+    stations = np.asarray(station_pos, dtype=float).reshape(-1, 2)
+    labels = np.asarray(station_labels, dtype=np.int64)
+    center_num = len(centers)
+    # Airlines, c{i} <-> c{j} for i < j
+    a, b = np.triu_indices(center_num, 1)
+    airline = np.sqrt(((centers[:, None] - centers[None]) ** 2).sum(-1))[a, b]
+    # Highways, c{label} <-> its stations, by center then station
+    members = np.argsort(labels, kind="stable")
+    highway = np.sqrt(((centers[labels[members]] - stations[members]) ** 2).sum(-1))
+    # Roads, s{i} <-> s{j} for i > j, by i then j
+    pairs = cKDTree(stations).query_pairs(road_radius, output_type="ndarray") if len(stations) else np.empty((0, 2), int)
+    i, j = pairs.max(axis=1), pairs.min(axis=1)
+    road = np.sqrt(((stations[i] - stations[j]) ** 2).sum(-1))
+    keep = road < road_radius
+    order = np.lexsort((j[keep], i[keep]))
+    i, j, road = i[keep][order], j[keep][order], road[keep][order]
+
+    u = np.concatenate([a, labels[members], center_num + i])
+    v = np.concatenate([b, center_num + members, center_num + j])
+    dist = np.concatenate([airline, highway, road])
+    # time_cost and money_cost per distance of airlines, highways and roads
+    time_rate = np.repeat([0.25, 0.6, 0.8], [len(a), len(members), len(i)])
+    money_rate = np.repeat([0.2, 0.12, 0.07], [len(a), len(members), len(i)])
+    src = np.stack([u, v], axis=1).ravel()
+    dst = np.stack([v, u], axis=1).ravel()
+    return src, dst, np.repeat(time_rate * dist, 2), np.repeat(money_rate * dist, 2)
+
+def data_gen(params=None):
+    # sklearn is only needed to generate a network, keep it out of module import
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+    if params is None:
+        params = parameters
+    # Large networks (station_num >= LARGE_STATION_NUM, or params["large"]) are generated
+    # in bulk on a map grown to keep the station density of 25 per 100*100, with
+    # MiniBatchKMeans and sparse cost matrices, and only a summary is printed
+    large = params.get("large", params["station_num"] >= LARGE_STATION_NUM)
     # Generate Stations
     station_pos = []
     # properties are defined here: throughput/tick, time_delay, money_cost
     station_prop_candidates = [
         (10, 2, 0.5), (15, 2, 0.6), (20, 1, 0.8), (25, 1, 0.9)]
     station_prop = []
-    for i in range(parameters["station_num"]):
-        # Map size is defined here, which is 100*100
-        station_pos.append((random.randint(0, 100), random.randint(0, 100)))
-        station_prop.append(
-            station_prop_candidates[random.randint(0, len(station_prop_candidates)-1)])
-    # Output Stations
-    print("Stations:")
-    for i in range(len(station_pos)):
-        print(f"s{i}", station_pos[i], station_prop[i])
+    if large:
+        map_size = params.get("map_size", int(round(100 * np.sqrt(max(params["station_num"], 25) / 25))))
+        points = np.random.randint(0, map_size + 1, size=(params["station_num"], 2))
+        kinds = np.random.randint(0, len(station_prop_candidates), size=params["station_num"])
+        station_pos = list(map(tuple, points.tolist()))
+        station_prop = [station_prop_candidates[k] for k in kinds.tolist()]
+        print(f"Stations: {len(station_pos)} on a {map_size}*{map_size} map")
+    else:
+        for i in range(params["station_num"]):
+            # Map size is defined here, which is 100*100
+            station_pos.append((random.randint(0, 100), random.randint(0, 100)))
+            station_prop.append(
+                station_prop_candidates[random.randint(0, len(station_prop_candidates)-1)])
+        points = station_pos
+        # Output Stations
+        print("Stations:")
+        for i in range(len(station_pos)):
+            print(f"s{i}", station_pos[i], station_prop[i])
 
     # Generate Centers by clustering
-    kmeans = KMeans(n_clusters=parameters["center_num"])
-    kmeans.fit(station_pos)
-    station_labels = kmeans.predict(station_pos)
+    if large:
+        kmeans = MiniBatchKMeans(n_clusters=params["center_num"], batch_size=4096, n_init=3)
+    else:
+        kmeans = KMeans(n_clusters=params["center_num"])
+    kmeans.fit(points)
+    station_labels = kmeans.predict(points)
     center_pos = [(int(x[0]), int(x[1])) for x in kmeans.cluster_centers_]
+    occupied = set(station_pos)
     for i in range(len(center_pos)):
-        while center_pos[i] in station_pos:
+        while center_pos[i] in occupied:
             # move slightly if center is overlapped with station
             # you can also use other methods to avoid this situation
             print("Warning: Center moved")
@@ -40,138 +191,66 @@ def data_gen():
     center_prop_candidates = [
         (100, 2, 0.5), (150, 2, 0.5), (125, 1, 0.5), (175, 1, 0.5)]
     center_prop = []
-    for i in range(parameters["center_num"]):
+    for i in range(params["center_num"]):
         center_prop.append(
             center_prop_candidates[random.randint(0, len(center_prop_candidates)-1)])
     # Output Centers
-    print("Centers:")
-    for i in range(parameters["center_num"]):
+    print(f"Centers: {params['center_num']}" if large else "Centers:")
+    for i in range(0 if large else params["center_num"]):
         print(f"c{i}", center_pos[i], center_prop[i])
 
-    # Draw Stations and Centers
+    # Draw Stations and Centers (import matplotlib.pyplot as plt here to enable)
 #    plt.scatter([x[0] for x in station_pos], [x[1]
 #                for x in station_pos], c=station_labels, s=50, cmap='viridis')
 #    plt.scatter([x[0] for x in center_pos], [x[1]
 #                for x in center_pos], c='black', s=200, alpha=0.5)
 
-    # Generate Edges
-    edges = []
-    print("Edges (center to center):")      # Airlines
-    for i in range(parameters["center_num"]):
-        for j in range(parameters["center_num"]):
-            if j > i:
-                dist = np.linalg.norm(
-                    np.array(center_pos[i]) - np.array(center_pos[j]))
-                # src, dst, time_cost, money_cost
-                # time_cost and money_cost are defined here
-                edges.append((f"c{i}", f"c{j}", 0.25 * dist, 0.2 * dist))
-                edges.append((f"c{j}", f"c{i}", 0.25 * dist, 0.2 * dist))
-#                plt.plot([center_pos[i][0], center_pos[j][0]], [
-#                         center_pos[i][1], center_pos[j][1]], 'r--')
-                print(edges[-2])
-                print(edges[-1])
-    print("Edges (center to station):")     # Highways
-    for i in range(parameters["center_num"]):
-        for j in range(parameters["station_num"]):
-            if station_labels[j] == i:
-                dist = np.linalg.norm(
-                    np.array(center_pos[i]) - np.array(station_pos[j]))
-                # time_cost and money_cost are defined here
-                edges.append((f"c{i}", f"s{j}", 0.6 * dist, 0.12 * dist))
-                edges.append((f"s{j}", f"c{i}", 0.6 * dist, 0.12 * dist))
-#                plt.plot([center_pos[i][0], station_pos[j][0]], [
-#                         center_pos[i][1], station_pos[j][1]], 'b--')
-                print(edges[-2])
-                print(edges[-1])
-    print("Edges (station to station):")    # Roads
-    for i in range(parameters["station_num"]):
-        for j in range(parameters["station_num"]):
-            if i > j and (np.linalg.norm(np.array(station_pos[i]) - np.array(station_pos[j])) < 30):
-                dist = np.linalg.norm(
-                    np.array(station_pos[i]) - np.array(station_pos[j]))
-                # time_cost and money_cost are defined here
-                edges.append((f"s{i}", f"s{j}", 0.8 * dist, 0.07*dist))
-                edges.append((f"s{j}", f"s{i}", 0.8 * dist, 0.07*dist))
-#                plt.plot([station_pos[i][0], station_pos[j][0]], [
-#                         station_pos[i][1], station_pos[j][1]], 'g--')
-                print(edges[-2])
-                print(edges[-1])
-    #plt.show()
-
-    # Generate Packets
-    packets = []
-    src_prob = np.random.random(parameters["station_num"])
-    src_prob = src_prob / np.sum(src_prob)
-    dst_prob = np.random.random(parameters["station_num"])
-    dst_prob = dst_prob / np.sum(dst_prob)
-    # Package categories are defined here: 0 for Regular, 1 for Express
-    speed_prob = [0.7, 0.3]
-    print("Packets:")
-    for i in range(parameters["packet_num"]):      # Number of packets
-        src = np.random.choice(parameters["station_num"], p=src_prob)
-        dst = np.random.choice(parameters["station_num"], p=dst_prob)
-        while dst == src:
-            dst = np.random.choice(parameters["station_num"], p=dst_prob)
-        category = np.random.choice(2, p=speed_prob)
-        # Create time of the package, during 12 time ticks(hours). Of course you can change it.
-        create_time = np.random.random() * 12
-        packets.append((create_time, f"s{src}", f"s{dst}", category))
-    # Sort packets by create time
-    packets.sort(key=lambda x: x[0])
+    # Generate Edges: airlines (center to center), highways (center to station), roads (station to station)
+    src_idx, dst_idx, time_cost, money_cost = route_arrays(center_pos, station_pos, station_labels)
+    names = [f"c{i}" for i in range(params["center_num"])] + [f"s{j}" for j in range(params["station_num"])]
+    # src, dst, time_cost, money_cost
+    edges = [(names[u], names[v], t, m)
+             for u, v, t, m in zip(src_idx.tolist(), dst_idx.tolist(), time_cost.tolist(), money_cost.tolist())]
+    is_station = src_idx >= params["center_num"]
+    for title, kind in (("center to center", ~is_station & (dst_idx < params["center_num"])),
+                        ("center to station", is_station != (dst_idx >= params["center_num"])),
+                        ("station to station", is_station & (dst_idx >= params["center_num"]))):
+        if large:
+            print(f"Edges ({title}): {np.count_nonzero(kind)}")
+            continue
+        print(f"Edges ({title}):")
+        for k in np.flatnonzero(kind):
+            print(edges[k])
+
+    # Generate Packets, kept as PacketArrays for large networks
+    packets = generate_packet_arrays(params["packet_num"], params["station_num"])
     # Output Packets
-    for packet in packets:
-        print(uuid.uuid4(), packet)
-
-    M=np.zeros((2*(parameters["center_num"]+parameters["station_num"]),2*(parameters["center_num"]+parameters["station_num"])))
-    for i in range(2*(parameters["center_num"]+parameters["station_num"])):
-        for j in range(2*(parameters["center_num"]+parameters["station_num"])):
-            M[i][j]=np.Infinity
-    for i in range(parameters["center_num"]+parameters["station_num"]):
-        M[2*i][2*i+1]=0.01
-    for i in range(parameters["center_num"]):               #要处理的还有M[2*i][2*i+1]
-        for j in range(parameters["center_num"]):
-            if j > i:
-                M[2*i+1][2*j] = 0.25*np.linalg.norm(
-                    np.array(center_pos[i]) - np.array(center_pos[j]))
-                M[2*j+1][2*i] = M[2*i+1][2*j]
-    for i in range(parameters["center_num"]):
-        for j in range(parameters["station_num"]):
-            if station_labels[j] == i:
-                M[2*i+1][2*j+2*parameters["center_num"]] = 0.6*np.linalg.norm(
-                    np.array(center_pos[i]) - np.array(station_pos[j]))
-                M[2*j+2*parameters["center_num"]+1][2*i] = M[2*i+1][2*j+2*parameters["center_num"]]
-    for i in range(parameters["station_num"]):
-        for j in range(parameters["station_num"]):
-            if i > j and (np.linalg.norm(np.array(station_pos[i]) - np.array(station_pos[j])) < 30):
-                M[2*i+2*parameters["center_num"]+1][2*j+2*parameters["center_num"]] = 0.8*np.linalg.norm(
-                    np.array(station_pos[i]) - np.array(station_pos[j]))
-                M[2*j+2*parameters["center_num"]+1][2*i+2*parameters["center_num"]]=M[2*i+2*parameters["center_num"]+1][2*j+2*parameters["center_num"]]
-    N=np.zeros((2*(parameters["center_num"]+parameters["station_num"]),2*(parameters["center_num"]+parameters["station_num"])))
-    for i in range(2*(parameters["center_num"]+parameters["station_num"])):
-        for j in range(2*(parameters["center_num"]+parameters["station_num"])):
-            N[i][j]=np.Infinity
-    for i in range(parameters["center_num"]):               #要处理的还有M[2*i][2*i+1]
-        for j in range(parameters["center_num"]):
-            if j > i:
-                N[2*i+1][2*j] = 0.2*np.linalg.norm(
-                    np.array(center_pos[i]) - np.array(center_pos[j]))
-                N[2*j+1][2*i] = N[2*i+1][2*j]
-    for i in range(parameters["center_num"]):
-        for j in range(parameters["station_num"]):
-            if station_labels[j] == i:
-                N[2*i+1][2*j+2*parameters["center_num"]] = 0.12*np.linalg.norm(
-                    np.array(center_pos[i]) - np.array(station_pos[j]))
-                N[2*j+2*parameters["center_num"]+1][2*i] = N[2*i+1][2*j+2*parameters["center_num"]]
-    for i in range(parameters["station_num"]):
-        for j in range(parameters["station_num"]):
-            if i > j and (np.linalg.norm(np.array(station_pos[i]) - np.array(station_pos[j])) < 30):
-                N[2*i+2*parameters["center_num"]+1][2*j+2*parameters["center_num"]] = 0.07*np.linalg.norm(
-                    np.array(station_pos[i]) - np.array(station_pos[j]))
-                N[2*j+2*parameters["center_num"]+1][2*i+2*parameters["center_num"]]=N[2*i+2*parameters["center_num"]+1][2*j+2*parameters["center_num"]]
-    for i in range(parameters["center_num"]):
-        N[2*i][2*i+1]=center_prop[i][2]
-    for i in range(parameters["station_num"]):
-        N[2*i+2*parameters["center_num"]][2*i+2*parameters["center_num"]+1]=station_prop[i][2]
+    if large:
+        print(f"Packets: {len(packets)}")
+    else:
+        packets = packets.tuples()
+        print("Packets:")
+        for packet in packets:
+            print(uuid.uuid4(), packet)
+
+    # Cost matrices, node k owns 2k (in) and 2k+1 (out), see Topology
+    size = 2 * (params["center_num"] + params["station_num"])
+    node_cost = np.array([prop[2] for prop in center_prop] + [prop[2] for prop in station_prop], dtype=float)
+    k = np.arange(size // 2)
+    if large:
+        # scipy.sparse CSR, a cell that is not stored has no route (inf in the dense matrices)
+        from scipy.sparse import csr_matrix
+        rows = np.concatenate([2 * k, 2 * src_idx + 1])
+        cols = np.concatenate([2 * k + 1, 2 * dst_idx])
+        M = csr_matrix((np.concatenate([np.full(len(k), 0.01), time_cost]), (rows, cols)), shape=(size, size))
+        N = csr_matrix((np.concatenate([node_cost, money_cost]), (rows, cols)), shape=(size, size))
+    else:
+        M = np.full((size, size), np.inf)
+        N = np.full((size, size), np.inf)
+        M[2 * k, 2 * k + 1] = 0.01
+        N[2 * k, 2 * k + 1] = node_cost
+        M[2 * src_idx + 1, 2 * dst_idx] = time_cost
+        N[2 * src_idx + 1, 2 * dst_idx] = money_cost
 
     return {
         "station_pos": station_pos,
@@ -180,24 +259,141 @@ def data_gen():
         "center_prop": center_prop,
         "edges": edges,
         "packets": packets,
-        "money cost":M,
-        "time cost":N,
+        "time cost":M,
+        "money cost":N,
     }
 
-import heapq
-#generate stations, centers, packages.
-data = data_gen()
-station_pos = data['station_pos']
-station_prop = data['station_prop']
-center_pos = data['center_pos']
-center_prop = data['center_prop']
-edges = data['edges']
-packets = data['packets']
-moneycost_initial = data["money cost"]
-timecost_initial = data["time cost"]
-moneycost = data["money cost"]
-timecost = data["time cost"]
-time_global = 0.0
+class Topology:
+    """Static network shared by every LogisticsEnv built on it (never mutated by the simulator).
+
+    Matrix layout: node k owns indices 2k (in) and 2k+1 (out), centers first
+    (c{i} -> 2i) then stations (s{j} -> 2*center_num + 2j); M[2k][2k+1] is
+    the processing cost of node k and M[2u+1][2v] the cost of route u->v.
+    Large networks use scipy.sparse matrices where a cell that is not stored is inf.
+    """
+    def __init__(self, station_pos, station_prop, center_pos, center_prop, edges, timecost, moneycost):
+        self.station_pos = station_pos
+        self.station_prop = station_prop
+        self.center_pos = center_pos
+        self.center_prop = center_prop
+        self.edges = edges
+        self.timecost = timecost
+        self.moneycost = moneycost
+        self.station_num = len(station_pos)
+        self.center_num = len(center_pos)
+        self.node_ids = [f"c{i}" for i in range(self.center_num)] + [f"s{j}" for j in range(self.station_num)]
+        self.node_index = {node_id: 2 * k for k, node_id in enumerate(self.node_ids)}
+
+    @classmethod
+    def from_data(cls, data):
+        return cls(data['station_pos'], data['station_prop'], data['center_pos'], data['center_prop'],
+                   data['edges'], data['time cost'], data['money cost'])
+
+    def index(self, node_id):
+        # Matrix index ("in" side) of a node id such as 's3' or 'c0'
+        return self.node_index[node_id]
+
+    def node_id(self, index):
+        return self.node_ids[index // 2]
+
+
+def make_network(params=None):
+    # Topology factory: generate a network, returns (topology, packets)
+    data = data_gen(params)
+    return Topology.from_data(data), data['packets']
+
+
+class RoutingTable:
+    """Next hop towards every destination for one cost matrix (time for Express, money for Standard).
+
+    A column, the next hop of every node towards one destination, is computed on first
+    use by a single Dijkstra from the destination on the reversed graph and is shared by
+    every package going there. update() drops the columns a change of route costs
+    touches, invalidate() drops them all.
+    """
+    def __init__(self, topology):
+        self.topology = topology
+        self.columns = {}  # dst -> np.int32 [node position] of next-hop position, -1 if none
+        self.dists = {}  # dst -> float [node position] of cost from the node's "in" vertex to dst
+        self.edges = None  # (rows, cols) of the matrix cells that are routes, fixed for a topology
+        self.graph = None
+
+    def invalidate(self):
+        self.columns = {}
+        self.dists = {}
+        self.graph = None
+
+    def update(self, cells, matrix):
+        # The costs of these route cells ((out of u, in of v), see Route.cells) changed in
+        # matrix. A column stays a shortest-path tree unless one of the routes is in it or
+        # now gives u a shorter path, only those columns are dropped.
+        self.graph = None  # rebuilt with the new costs by the next column()
+        if not self.columns:
+            return
+        rows = np.array([i for i, _ in cells])
+        cols = np.array([j for _, j in cells])
+        u, v = rows // 2, cols // 2
+        cost = np.asarray(matrix[rows, cols], dtype=float).ravel()
+        through = np.asarray(matrix[2 * u, 2 * u + 1], dtype=float).ravel()  # u's own processing cost
+        for dst in list(self.columns):
+            dist = self.dists[dst]
+            # same additions as the Dijkstra, so a tie does not count as shorter
+            if ((self.columns[dst][u] == v) | (through + (cost + dist[v]) < dist[u])).any():
+                del self.columns[dst], self.dists[dst]
+
+    def copy(self):
+        # Columns are never modified in place, a copy can share them
+        table = copy.copy(self)
+        table.columns = dict(self.columns)
+        table.dists = dict(self.dists)
+        return table
+
+    def column(self, dst, matrix):
+        column = self.columns.get(dst)
+        if column is None:
+            # scipy comes with scikit-learn, like KMeans it is only imported when needed
+            from scipy.sparse import csr_matrix
+            from scipy.sparse.csgraph import dijkstra
+            if self.graph is None:
+                if not is_sparse(matrix):
+                    matrix = np.asarray(matrix)
+                if self.edges is None:
+                    self.edges = matrix.nonzero() if is_sparse(matrix) else np.nonzero(np.isfinite(matrix) & (matrix != 0))
+                rows, cols = self.edges
+                # reversed graph: searching from dst gives the next vertex towards it
+                costs = np.asarray(matrix[rows, cols]).ravel()
+                self.graph = csr_matrix((costs, (cols, rows)), shape=matrix.shape)
+            dist, pred = dijkstra(self.graph, indices=self.topology.index(dst), return_predecessors=True)
+            out = pred[0::2]  # "in" vertex of node k -> its "out" vertex
+            nxt = np.where(out >= 0, pred[np.maximum(out, 0)], -1)
+            column = np.where((out >= 0) & (nxt >= 0), nxt // 2, -1).astype(np.int32)
+            self.columns[dst] = column
+            self.dists[dst] = dist[0::2]
+        return column
+
+    def next_hop(self, node_id, dst, matrix):
+        k = self.column(dst, matrix)[self.topology.index(node_id) // 2]
+        if k < 0:
+            raise ValueError(f"{dst} cannot be reached from {node_id}")
+        return self.topology.node_ids[k]
+
+class ChangeSet:
+    # Ids of the nodes, routes and packages touched since the last take(), see LogisticsEnv.diff_since()
+    def __init__(self):
+        self.take()
+
+    def take(self):
+        out = (getattr(self, 'nodes', None), getattr(self, 'routes', None),
+               getattr(self, 'packages', None), getattr(self, 'removed', None))
+        self.nodes = set()
+        self.routes = set()
+        self.packages = set()
+        self.removed = set()
+        return out
+
+    def __bool__(self):
+        return bool(self.nodes or self.routes or self.packages or self.removed)
+
 
 class Package:
     def __init__(self, id, time_created, src, dst, category):
@@ -208,89 +404,253 @@ class Package:
         self.dst = dst
         self.category = category  # 1 for 'Express' and 0 for 'Standard'
         self.history = []
-        self.path = []  # List of nodes on the expected path
+        self.detour = None  # {node: next node} set by change_route(), else the routing tables decide
+        self.hops = 0
+        self.location = src  # id of the node or route holding the package
         self.delay = float('inf')  # Remaining delay before processing
         self.done = False
         self.reward = 0.0  # Current Reward/cost for this package
+
+    def record(self):
+        # JSON-ready dict of the package, as spilled to a HistoryStore
+        return {
+            'id': str(self.id),
+            'src': self.src,
+            'dst': self.dst,
+            'category': int(self.category),
+            'time_created': float(self.time_created),
+            'time_arrived': float(self.time_arrived),
+            'hops': self.hops,
+            'history': [[float(t), location, event] for t, location, event in self.history],
+        }
+
     def __str__(self):
         #return f"Package({self.id}, TimeCreated: {self.time_created}, Src: {self.src}, Dst: {self.dst}, Category: {self.category})"
-        return f"Package({self.id}, Path: {self.path})"
+        return f"Package({self.id}, {self.src}->{self.dst})"
+
+def new_history(limit=None):
+    # Event log of a package/node/route: unbounded, or only the last `limit` entries
+    return [] if limit is None else deque(maxlen=limit)
+
+
+class HistoryStore:
+    """Append-only JSON-lines file of the packages a LogisticsEnv let go of.
+
+    One line per package (see Package.record()). Lines are only ever appended, so a
+    run restored from a snapshot may write a package twice; get() returns the latest.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+
+    def append(self, package):
+        self.file.write(json.dumps(package.record()) + "\n")
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __getstate__(self):
+        # Saved with a checkpoint by path, reopened for appending when loaded
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def query(self, package_id=None, src=None, dst=None, since=None, until=None):
+        # Records matching every given filter; since/until bound the arrival time
+        if not self.file.closed:
+            self.file.flush()
+        if package_id is not None:
+            package_id = str(package_id)
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                r = json.loads(line)
+                if package_id is not None and r['id'] != package_id:
+                    continue
+                if src is not None and r['src'] != src:
+                    continue
+                if dst is not None and r['dst'] != dst:
+                    continue
+                if since is not None and r['time_arrived'] < since:
+                    continue
+                if until is not None and r['time_arrived'] > until:
+                    continue
+                yield r
+
+    def get(self, package_id):
+        r = None
+        for r in self.query(package_id):
+            pass
+        return r
+
+
+class RetentionPolicy:
+    """How much history a LogisticsEnv keeps in memory.
+
+    history_limit: keep only the last N events of every package, node and route
+    summarize: on delivery, replace a package's history by a one-line summary
+    evict_after: drop delivered packages from env.packages and Node.dones this many
+                 sim-hours after their arrival
+    store: HistoryStore receiving the full record of summarized/evicted packages,
+           without one that data is discarded
+    The default keeps everything, as before.
+    """
+    def __init__(self, history_limit=None, summarize=False, evict_after=None, store=None):
+        self.history_limit = history_limit
+        self.summarize = summarize
+        self.evict_after = evict_after
+        self.store = store
+
+
+# Queue disciplines for the waiting buffer of a Node. A discipline holds the packages
+# waiting for a processing slot; push/pop are O(1) (TwoClassQueue) or O(log n) (EDFQueue).
+# remap(packages) returns a copy of the same kind whose entries are packages[p.id],
+# which is what fork_state() needs to clone a queue onto copied packages.
+SLA_HOURS = {0: 72.0, 1: 24.0}  # due time after creation: Standard, Express
+
+
+class TwoClassQueue:
+    # Express packages always go first, FIFO within each class
+    def __init__(self):
+        self.express = deque()
+        self.standard = deque()
+
+    def push(self, package):
+        (self.express if package.category else self.standard).append(package)
+
+    def pop(self):
+        return self.express.popleft() if self.express else self.standard.popleft()
+
+    def __len__(self):
+        return len(self.express) + len(self.standard)
+
+    def __iter__(self):
+        yield from self.express
+        yield from self.standard
+
+    def remap(self, packages):
+        q = TwoClassQueue()
+        q.express.extend(packages[p.id] for p in self.express)
+        q.standard.extend(packages[p.id] for p in self.standard)
+        return q
+
+
+class EDFQueue:
+    # Earliest deadline first, the deadline being time_created + sla[category]; FIFO on ties
+    def __init__(self, sla=None):
+        self.sla = SLA_HOURS if sla is None else sla
+        self.heap = []
+        self.order = 0
+
+    def push(self, package):
+        self.order += 1
+        due = package.time_created + self.sla[int(package.category)]
+        heapq.heappush(self.heap, (due, self.order, package))
+
+    def pop(self):
+        return heapq.heappop(self.heap)[2]
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __iter__(self):
+        return (package for _, _, package in self.heap)
+
+    def remap(self, packages):
+        q = EDFQueue(self.sla)
+        q.heap = [(due, order, packages[p.id]) for due, order, p in self.heap]  # same order, still a heap
+        q.order = self.order
+        return q
+
 
 class Node:
-    def __init__(self, id, pos, throughput, delay, cost, is_station=False):
+    def __init__(self, id, pos, throughput, delay, cost, is_station=False, discipline=TwoClassQueue,
+                 history_limit=None):
         self.id = id
         self.pos = pos
         self.throughput = throughput
         self.delay = delay
         self.cost = cost
         self.is_station = is_station
-        self.buffer = []
+        self.discipline = discipline  # factory of the waiting queue, see TwoClassQueue/EDFQueue
+        self.history_limit = history_limit
+        self.buffer = discipline()
         self.packages = []
-        self.dones = []
-        self.history = []
+        self.dones = deque()  # delivered here, in arrival order
+        self.history = new_history(history_limit)
         self.package_order = 0
         heapq.heapify(self.packages)  # Convert the list to a heap
-        heapq.heapify(self.buffer)
+        # Observation slots (buffer count, processing count), bound by LogisticsEnv
+        self.obs = None
+        self.obs_slot = 0
+        self.changes = None  # ChangeSet while the env tracks changes
 
     def reset(self):
-        self.buffer = []
+        self.buffer = self.discipline()
         self.packages = []
-        self.dones = []
-        self.history = []
+        self.dones = deque()
+        self.history = new_history(self.history_limit)
         self.package_order = 0
         heapq.heapify(self.packages)  # Convert the list to a heap
-        heapq.heapify(self.buffer)
+        self.sync_load()
+
+    def sync_load(self):
+        # Write the current queue lengths into the shared observation buffer
+        if self.obs is not None:
+            self.obs[self.obs_slot] = len(self.buffer)
+            self.obs[self.obs_slot + 1] = len(self.packages)
+        if self.changes is not None:
+            self.changes.nodes.add(self.id)
 
-    def add_package(self, package):
+    def add_package(self, package, now=0.0):
         self.history.append(package.id)
+        package.location = self.id
+        if self.changes is not None:
+            self.changes.nodes.add(self.id)
+            self.changes.packages.add(package.id)
         # 如果是包裹的终点，加入done，而不是buffer
         if package.dst == self.id:
             self.dones.append(package)
             package.done = True
             package.delay = float('inf')
         else:
-            # 计数器
-            self.package_order += 1
-            # 检查buffer堆是否为空
-            if not self.buffer:
-                heapq.heappush(self.buffer, (self.package_order ,package))
-                package.delay = float('inf')  # Update package delay
+            # 排队顺序由队列规则决定 (express 优先 / 最早截止时间优先)
+            self.buffer.push(package)
+            package.delay = float('inf')  # Update package delay
+            if VERBOSE:
                 print(f"Pack added to Node: {self.id};")
-                self.process_packages()
-            else: # 如果buffer有包裹，获取堆顶的包裹
-                index, top_package = self.buffer[0]
-                if top_package.category or package.category == 0: #如果堆顶是express包裹，不做特殊处理；如果堆顶是standard,插入也是standard,不做特殊处理
-                    heapq.heappush(self.buffer, (self.package_order ,package))
-                    package.delay = float('inf')  # Update package delay
-                    print(f"Pack added to Node: {self.id};")
-                else: #如果堆顶是standard包裹,插入是express
-                    heapq.heappush(self.buffer, (index-1 ,package))
-                    package.delay = float('inf')  # Update package delay
-                    print(f"Pack added to Node: {self.id};")
-
-                self.process_packages()
+            self.process_packages(now)
     
-    def process_packages(self):
-        while self.buffer and len(self.buffer) < self.throughput:
-            index, package = heapq.heappop(self.buffer)  # Get the package with the highest priority (oldest)
+    def process_packages(self, now=0.0):
+        # At most `throughput` packages are processed at the same time
+        while self.buffer and len(self.packages) < self.throughput:
+            package = self.buffer.pop()
             if package.done == False:
-                heapq.heappush(self.packages, (index, package))
+                self.package_order += 1
+                heapq.heappush(self.packages, (self.package_order, package))
                 package.delay = self.delay
-                package.history.append((time_global, self.id, f"PROCESSING: In Node: {self.id}"))
+                package.history.append((now, self.id, f"PROCESSING: In Node: {self.id}"))
+                if self.changes is not None:
+                    self.changes.packages.add(package.id)
             else:
                 self.dones.append(package)
+        self.sync_load()
 
-    def remove_package(self):
+    def remove_package(self, now=0.0):
         if self.packages and self.packages[0][1].delay <= 0:
             _, package = heapq.heappop(self.packages)  # Remove the package with the least priority (oldest)
-            print(f"package: {package.id} removed from Node: {self.id}.")
-            self.process_packages()
+            if VERBOSE:
+                print(f"package: {package.id} removed from Node: {self.id}.")
+            self.process_packages(now)  # also refreshes the observation slots
             return package
         elif self.packages[0][1].delay > 0:
             print(f"Error! Removing Package: {package.id} not done from Node: {self.id}!")
 
 class Route:
-    def __init__(self, src, dst, time, cost):
+    def __init__(self, src, dst, time, cost, history_limit=None):
         self.src = src
         self.dst = dst
         self.id = f"{self.src}->{self.dst}"
@@ -298,27 +658,68 @@ class Route:
         self.cost = cost
         self.package_order = 0
         self.packages = []  # Use a list for packages on the route
-        self.history = []
+        self.history_limit = history_limit
+        self.history = new_history(history_limit)
         heapq.heapify(self.packages)  # Convert the list to a heap
-    
+        # Observation slot (packages on the route), bound by LogisticsEnv
+        self.obs = None
+        self.obs_slot = 0
+        self.changes = None  # ChangeSet while the env tracks changes
+        # Congestion tracking, bound by LogisticsEnv.add_route: cells is the (out, in)
+        # matrix cell of this route, dirty collects routes whose congestion flag flipped
+        self.cells = None
+        self.congestion_limit = float('inf')
+        self.congested = False
+        self.dirty = None
+        self.fleet = None  # vehicles of a VehicleRoute
+
     def reset(self):
         self.package_order = 0
         self.packages = []  # Use a list for packages on the route
-        self.history = []
+        self.history = new_history(self.history_limit)
         heapq.heapify(self.packages)  # Convert the list to a heap
+        self.congested = False
+        self.sync_load()
+
+    def load(self):
+        # Packages on the route
+        return len(self.packages)
+
+    def sync_load(self):
+        if self.obs is not None:
+            self.obs[self.obs_slot] = self.load()
+        if self.changes is not None:
+            self.changes.routes.add(self.id)
 
-    def add_package(self, package):
+    def check_congestion(self):
+        # Only a threshold crossing marks the route dirty
+        congested = self.load() > self.congestion_limit
+        if congested != self.congested:
+            self.congested = congested
+            if self.dirty is not None:
+                self.dirty[(self.src, self.dst)] = self
+
+    def add_package(self, package, now=0.0):
         self.history.append(package.id)
+        package.location = self.id
+        if self.changes is not None:
+            self.changes.packages.add(package.id)
         self.package_order += 1
         # Packages are added to the route.packages in the order they arrive
         heapq.heappush(self.packages, (self.package_order ,package))
         package.delay = self.time  # Update package delay
-        print(f"Pack added to Route: {self.src}->{self.dst};")
+        self.sync_load()
+        self.check_congestion()
+        if VERBOSE:
+            print(f"Pack added to Route: {self.src}->{self.dst};")
 
     def remove_package(self):
         if self.packages and self.packages[0][1].delay <= 0:
             _, package = heapq.heappop(self.packages)  # Remove the package with the least priority (oldest)            
-            print(f"package: {package.id} removed from Route: {self.id}.")
+            self.sync_load()
+            self.check_congestion()
+            if VERBOSE:
+                print(f"package: {package.id} removed from Route: {self.id}.")
             return package
         elif self.packages[0][1].delay > 0:
             print(f"Error! Removing Package: {package.id} not done from Route: {self.id}!")
@@ -327,6 +728,115 @@ class Route:
     def __str__(self):
         return f"Route({self.src}->{self.dst}, Time: {self.time}, Cost: {self.cost})"
 
+class Fleet:
+    # Dynamic state of a VehicleRoute: packages waiting at the dock and vehicles on the way.
+    # remap(packages) copies it onto the packages of a forked state, like the queue disciplines.
+    def __init__(self, next_departure=None):
+        self.dock = deque()  # (tick loaded, package)
+        self.vehicles = []  # heap of (arrival tick, trip, [packages])
+        self.in_transit = 0
+        self.trips = 0
+        self.next_departure = next_departure  # tick of the next scheduled departure
+
+    def remap(self, packages):
+        fleet = Fleet(self.next_departure)
+        fleet.dock.extend((tick, packages[p.id]) for tick, p in self.dock)
+        fleet.vehicles = [(tick, trip, [packages[p.id] for p in batch]) for tick, trip, batch in self.vehicles]
+        fleet.in_transit = self.in_transit
+        fleet.trips = self.trips
+        return fleet
+
+
+class VehicleRoute(Route):
+    """A route served by vehicles instead of moving every package on its own.
+
+    Packages wait at the dock until a vehicle leaves with up to `capacity` of them,
+    the whole batch arrives route.time later as a single event. A vehicle leaves
+      - every `headway` hours from `offset` (one vehicle per slot, skipped if the dock is empty)
+      - as soon as `fill` packages are waiting
+      - once the first package waiting has waited `max_wait` hours
+    whichever comes first. headway or max_wait is required so no package waits forever.
+    """
+    def __init__(self, src, dst, time, cost, capacity, headway=None, fill=None, max_wait=None,
+                 offset=0.0, history_limit=None):
+        super().__init__(src, dst, time, cost, history_limit)
+        if capacity < 1:
+            raise ValueError("a vehicle needs a capacity of at least one package")
+        if headway is None and max_wait is None:
+            raise ValueError(f"route {self.id}: set a headway or a max_wait, or packages could wait forever")
+        self.capacity = capacity
+        self.headway = None if headway is None else max(1, tick_index(headway))  # in ticks
+        self.fill = fill
+        self.max_wait = None if max_wait is None else tick_index(max_wait)
+        self.offset = tick_index(offset)
+        self.ticks = travel_ticks(time)
+        self.outbox = None  # set by a shard when the route leads into another shard
+        self.fleet = Fleet(self.offset)
+
+    def reset(self):
+        super().reset()
+        self.fleet = Fleet(self.offset)
+
+    def load(self):
+        # Waiting, travelling and arrived packages
+        return len(self.fleet.dock) + self.fleet.in_transit + len(self.packages)
+
+    def add_package(self, package, now=0.0):
+        self.history.append(package.id)
+        package.location = self.id
+        if self.changes is not None:
+            self.changes.packages.add(package.id)
+        package.delay = float('inf')  # moves with its vehicle, see advance()
+        self.fleet.dock.append((tick_index(now), package))
+        self.sync_load()
+        self.check_congestion()
+        if VERBOSE:
+            print(f"Pack docked at Route: {self.src}->{self.dst};")
+
+    def depart(self, tick):
+        fleet = self.fleet
+        batch = [fleet.dock.popleft()[1] for _ in range(min(self.capacity, len(fleet.dock)))]
+        fleet.trips += 1
+        vehicle = (tick + self.ticks, fleet.trips, batch)
+        if self.outbox is not None:
+            self.outbox.append(vehicle)
+            self.sync_load()
+            self.check_congestion()
+        else:
+            heapq.heappush(fleet.vehicles, vehicle)
+            fleet.in_transit += len(batch)
+
+    def receive(self, vehicle):
+        # A vehicle that left from another shard
+        heapq.heappush(self.fleet.vehicles, vehicle)
+        self.fleet.in_transit += len(vehicle[2])
+        self.sync_load()
+        self.check_congestion()
+
+    def advance(self, tick):
+        # Departures due at `tick`, then arrivals: the packages of an arrived vehicle
+        # become ready (delay 0) for the arrival phase of LogisticsEnv.step()
+        fleet = self.fleet
+        if self.fill is not None:
+            while len(fleet.dock) >= self.fill:
+                self.depart(tick)
+        if self.headway is not None and tick >= fleet.next_departure:
+            if fleet.dock:
+                self.depart(tick)
+            while fleet.next_departure <= tick:
+                fleet.next_departure += self.headway
+        if self.max_wait is not None:
+            while fleet.dock and tick - fleet.dock[0][0] >= self.max_wait:
+                self.depart(tick)
+        while fleet.vehicles and fleet.vehicles[0][0] <= tick:
+            _, _, batch = heapq.heappop(fleet.vehicles)
+            fleet.in_transit -= len(batch)
+            for package in batch:
+                package.delay = 0.0
+                self.package_order += 1
+                heapq.heappush(self.packages, (self.package_order, package))
+
+
 def get_top_package(node_or_route):
     # 检查堆是否为空
     if not node_or_route.packages:
@@ -335,61 +845,356 @@ def get_top_package(node_or_route):
     _, package = node_or_route.packages[0]
     return package
 
-def get_next_node(package_path_list, curr_node):
-    if(len(package_path_list)==0):
-        print("Error! package_path_list is empty!")
-        return None
-    else:
-        for i in range(len(package_path_list) - 1):
-            if package_path_list[i] == curr_node:
-                return package_path_list[i + 1]
-        print("Error! curr_node not found in path!")
-        return None
 
+def fork_state(state):
+    # Copy the dynamic part of a simulator state (see LogisticsEnv.capture_state):
+    # packages are copied once and every queue is remapped onto the copies, so the
+    # result shares nothing mutable with the input. Static topology is not part of it.
+    packages = {}
+    new = Package.__new__
+    for pid, package in state['packages'].items():
+        p = new(Package)
+        p.__dict__.update(package.__dict__)
+        p.history = package.history.copy()
+        packages[pid] = p
+    nodes = {}
+    for node_id, (buffer, processing, dones, history, order) in state['nodes'].items():
+        nodes[node_id] = (
+            buffer.remap(packages),
+            [(i, packages[p.id]) for i, p in processing],
+            deque(packages[p.id] for p in dones),
+            history.copy(),
+            order,
+        )
+    routes = {}
+    for route_id, (on_route, history, order, fleet) in state['routes'].items():
+        routes[route_id] = ([(i, packages[p.id]) for i, p in on_route], history.copy(), order,
+                            None if fleet is None else fleet.remap(packages))
+    return {
+        'TimeTick': state['TimeTick'],
+        'done': state['done'],
+        'moneycost': state['moneycost'].copy(),
+        'timecost': state['timecost'].copy(),
+        'stream': state['stream'].fork(),
+        'packages': packages,
+        'delivered': deque(packages[p.id] for p in state['delivered']),
+        'nodes': nodes,
+        'routes': routes,
+    }
 
 
+class PacketStream:
+    """Time-ordered source of (create_time, src, dst, category) packets.
+
+    source can be a sequence (replayed by rewind()), a callable returning a fresh
+    iterator (called again by rewind()), or any one-shot iterator such as a file
+    reader, a generator or a DB cursor, which cannot be rewound.
+    """
+    def __init__(self, source):
+        self.source = source
+        self.it = None
+        self.rewind()
+
+    def rewind(self):
+        if callable(self.source):
+            self.it = iter(self.source())
+        elif iter(self.source) is not self.source:
+            self.it = iter(self.source)
+        elif self.it is not None:
+            raise ValueError("a one-shot packet iterator cannot be replayed, pass a list or a factory")
+        else:
+            self.it = self.source
+        self.released = 0
+        self.last_time = float('-inf')
+        self.head = next(self.it, None)
+
+    @property
+    def exhausted(self):
+        return self.head is None
+
+    def release(self, now):
+        # Pop every packet created at or before `now`
+        out = []
+        while self.head is not None and self.head[0] <= now:
+            if self.head[0] < self.last_time:
+                raise ValueError(f"packets must be sorted by create time: {self.head[0]} after {self.last_time}")
+            self.last_time = self.head[0]
+            out.append(self.head)
+            self.head = next(self.it, None)
+        self.released += len(out)
+        return out
+
+    def __getstate__(self):
+        # Saved as its source plus a position, so a list or a picklable factory
+        # (e.g. functools.partial(demand_stream, ...)) is required
+        if not callable(self.source) and iter(self.source) is self.source:
+            raise TypeError("a one-shot packet iterator cannot be saved, pass a list or a factory")
+        return {'source': self.source, **self.position()}
+
+    def position(self):
+        # Where the stream is, without its source; resume() continues from it
+        return {'released': self.released, 'last_time': self.last_time}
+
+    @classmethod
+    def resume(cls, source, position):
+        # Stream over source continuing at a position() of a stream over the same source
+        stream = cls.__new__(cls)
+        stream.__setstate__({'source': source, **position})
+        return stream
+
+    def __setstate__(self, state):
+        self.source = state['source']
+        self.it = None
+        self.rewind()
+        if state['released']:
+            # head is the first packet, skip it and the other released ones
+            self.it = itertools.islice(self.it, state['released'] - 1, None)
+            self.head = next(self.it, None)
+        self.released = state['released']
+        self.last_time = state['last_time']
+
+    def fork(self):
+        # Both streams continue independently from the current position
+        # (built without copy.copy(), which would go through the pickle hooks)
+        self.it, other = itertools.tee(self.it)
+        stream = PacketStream.__new__(PacketStream)
+        stream.__dict__.update(self.__dict__)
+        stream.it = other
+        return stream
+
+
+class StepStats:
+    """Wall time and item counts of every phase of LogisticsEnv.step().
+
+    Items are what the phase went through: flagged routes (actions), packages
+    (delays, reward), packets released, packages moved (departures, arrivals),
+    packages evicted, routes whose costs changed (update_distance).
+    """
+    PHASES = ('actions', 'delays', 'release', 'departures', 'arrivals', 'evict', 'update_distance', 'reward')
 
-class LogisticsEnv:
     def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.steps = 0
+        self.seconds = dict.fromkeys(self.PHASES, 0.0)
+        self.items = dict.fromkeys(self.PHASES, 0)
+
+    def add(self, phase, since, items):
+        # Charge the time elapsed since `since` to phase, returns the current time
+        now = perf_counter()
+        self.seconds[phase] += now - since
+        self.items[phase] += items
+        return now
+
+    def as_dict(self):
+        total = sum(self.seconds.values())
+        return {
+            'steps': self.steps,
+            'seconds': total,
+            'phases': {phase: {'seconds': self.seconds[phase],
+                               'share': self.seconds[phase] / total if total else 0.0,
+                               'items': self.items[phase]}
+                       for phase in self.PHASES},
+        }
+
+
+def is_sparse(matrix):
+    # scipy.sparse cost matrix of a large network, see data_gen()
+    return hasattr(matrix, "tocsr")
+
+
+def write_pickle(obj, path):
+    # Pickle obj to path (gzip-compressed if it ends in .gz); a crash while writing
+    # leaves the previous file intact
+    opener = gzip.open if path.endswith(".gz") else open
+    tmp = path + ".tmp"
+    try:
+        with opener(tmp, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+
+
+def read_pickle(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        return pickle.load(f)
+
+
+def tick_index(time):
+    # Number of 0.1 h steps to reach `time`; TimeTick accumulates rounding error, ticks do not
+    return int(round(time * 10))
+
+
+def travel_ticks(time):
+    # Steps a package spends on a route of this travel time, counted the way step() does
+    delay, k = time, 0
+    while delay > 0:
+        delay -= 0.1
+        k += 1
+    return k
+
+
+class Checkpointer:
+    """Periodic checkpoints of a LogisticsEnv, see LogisticsEnv.enable_checkpoints().
+
+    The directory holds static.pkl, the topology and the packet source written once,
+    ckpt-<tick>.pkl files with the dynamic state, written every `every` sim-hours, and
+    actions.jsonl, the routes flagged at every step, so LogisticsEnv.seek() can replay
+    forward from a checkpoint exactly as the run went. keep bounds the number of
+    checkpoint files (oldest removed first).
+    """
+    def __init__(self, directory, every=1.0, keep=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.every = max(1, tick_index(every))  # in ticks
+        self.keep = keep
+        self.next_tick = None
+        self.saved = []
+        self.static = None
+        self.actions = open(os.path.join(directory, "actions.jsonl"), "a", encoding="utf-8")
+
+    def record_actions(self, env, routes):
+        if routes:
+            self.actions.write(json.dumps({'tick': tick_index(env.TimeTick),
+                                           'routes': [route.index for route in routes]}) + "\n")
+
+    def after_step(self, env):
+        tick = tick_index(env.TimeTick)
+        if self.next_tick is not None and tick < self.next_tick:
+            return
+        self.actions.flush()  # a checkpoint never gets ahead of the actions needed to replay from it
+        if self.static is None:
+            self.static = os.path.join(self.directory, "static.pkl")
+            env.save_static(self.static)
+        path = os.path.join(self.directory, f"ckpt-{tick:08d}.pkl")
+        env.save(path, static=self.static)
+        self.saved.append(path)
+        if self.keep is not None:
+            while len(self.saved) > self.keep:
+                os.remove(self.saved.pop(0))
+        self.next_tick = tick + self.every
+
+    def close(self):
+        self.actions.close()
+
+    @staticmethod
+    def checkpoints(directory):
+        # [(tick, path)] of the checkpoint files in directory, oldest first
+        found = []
+        for name in os.listdir(directory):
+            if name.startswith("ckpt-") and name.endswith(".pkl"):
+                found.append((int(name[5:-4]), os.path.join(directory, name)))
+        return sorted(found)
+
+    @staticmethod
+    def read_actions(directory):
+        # {tick: [route index]}; a resumed run may log a tick again, the last entry wins
+        actions = {}
+        path = os.path.join(directory, "actions.jsonl")
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    r = json.loads(line)
+                    actions[r['tick']] = r['routes']
+        return actions
+
+
+class LogisticsEnv:
+    def __init__(self, topology, packets=(), congestion_limit=30, queue_discipline=TwoClassQueue,
+                 retention=None, vehicles=None):
+        # topology: a Topology, packets: (create_time, src, dst, category) sorted by
+        # create time, as a list, an iterator or a PacketStream. A package enters the
+        # network when the clock reaches its create time, so only packages created so far
+        # are held. Nothing is read from module globals, so environments on different
+        # networks can live side by side in one process.
+        self.topology = topology
+        self.stream = packets if isinstance(packets, PacketStream) else PacketStream(packets)
+        # A route above congestion_limit packages costs twice as much time and money
+        self.congestion_limit = congestion_limit
+        # Waiting queue of every node, e.g. TwoClassQueue or partial(EDFQueue, sla={...})
+        self.queue_discipline = queue_discipline
+        # What happens to the history of long runs, see RetentionPolicy
+        self.retention = retention if retention is not None else RetentionPolicy()
+        # Routes served by vehicles: {(src, dst): VehicleRoute kwargs}, or a function
+        # (src, dst) -> kwargs or None, e.g. capacity/headway for the center->center airlines
+        self.vehicles = vehicles
+        self.vehicle_specs = {}  # resolved kwargs of every VehicleRoute, saved with checkpoints
+        self.vehicle_routes = []
+        self.dirty_routes = {}
+        self.cost_listeners = []  # callables notified with the routes whose costs changed
+        self.checkpointer = None
+        self.profiler = None  # StepStats while profiling is on, see enable_profiling()
+        # Change tracking for diff_since(), off until the first call
+        self.version = 0
+        self.changes = None
+        self.change_log = None
+        # Express packages follow the shortest total time, Standard the lowest total cost
+        self.forwarding = {True: RoutingTable(topology), False: RoutingTable(topology)}
+        # Package ids are derived from run_id and the release order, so a run replayed
+        # from a checkpoint gives its packages the same ids as the original run
+        self.run_id = uuid.uuid4()
         self.nodes = {}  # Dictionary of nodes
         self.routes = {}  # Dictionary of routes
         self.packages = {}  # Dictionary of packages
+        self.delivered = deque()  # delivered packages awaiting eviction, in arrival order
         self.TimeTick = 0.0  # Current time tick
         self.done = False
-        self.moneycost=moneycost
-        self.timecost=timecost
+        # update_distance() patches the matrices in place, keep pristine copies
+        self.moneycost_initial=topology.moneycost.copy()
+        self.timecost_initial=topology.timecost.copy()
+        self.moneycost=self.moneycost_initial.copy()
+        self.timecost=self.timecost_initial.copy()
         # Add stations as nodes
-        for i in range(len(station_pos)):
-            p = self.add_node(f"s{i}", station_pos[i], *station_prop[i], is_station=True)
+        for i in range(topology.station_num):
+            p = self.add_node(f"s{i}", topology.station_pos[i], *topology.station_prop[i], is_station=True)
             #print(f"Center({p.id}, {p.pos}, Throughput: {p.throughput}, Delay: {p.delay}, Cost: {p.cost}), is_station: {p.is_station}")
         # Add centers as nodes
-        for i in range(len(center_pos)):
-            p = self.add_node(f"c{i}", center_pos[i], *center_prop[i])
+        for i in range(topology.center_num):
+            p = self.add_node(f"c{i}", topology.center_pos[i], *topology.center_prop[i])
             #print(f"Center({p.id}, {p.pos}, Throughput: {p.throughput}, Delay: {p.delay}, Cost: {p.cost}), is_station: {p.is_station}")
         # Add edges as routes
-        for edge in edges:
+        for edge in topology.edges:
             p = self.add_route(edge[0], edge[1], edge[2], edge[3])
             #print(f"Route({p.src}->{p.dst}, Time: {p.time}, Cost: {p.cost})")
-        # Add packets as packages
-        for packet in packets:
-            p = self.add_package(uuid.uuid4(), *packet)
-            print(f"Package {p.id} added, delay={p.delay}, src={p.src}, dst={p.dst}, done={p.done}, path={p.path}")
+        self.bind_observation()
+        self.release_packets()
+
+    def release_packets(self):
+        # Add the packets whose create time has been reached as packages
+        first = self.stream.released
+        for k, packet in enumerate(self.stream.release(self.TimeTick)):
+            p = self.add_package(uuid.uuid5(self.run_id, str(first + k)), *packet)
+            if VERBOSE:
+                print(f"Package {p.id} added, delay={p.delay}, src={p.src}, dst={p.dst}, done={p.done}")
+
     def reset(self):
-        print("Reseting......")
-        for node, route in zip(self.nodes.values(),self.routes.values()):
+        if VERBOSE:
+            print("Reseting......")
+        self.stream.rewind()  # first, a one-shot iterator raises before anything is cleared
+        for node in self.nodes.values():
             node.reset()
+        for route in self.routes.values():
             route.reset()
+        self.obs.fill(0)
+        self.dirty_routes.clear()
         self.packages = {}  # Dictionary of packages
+        self.delivered = deque()
         self.TimeTick = 0.0  # Current time tick
         self.done = False
-        self.moneycost=moneycost
-        self.timecost=timecost
-        # Add packets as packages
-        for packet in packets:
-            p = self.add_package(uuid.uuid4(), *packet)
-            print(f"Package {p.id} added, delay={p.delay}, src={p.src}, dst={p.dst}, done={p.done}, path={p.path}")
+        self.moneycost=self.moneycost_initial.copy()
+        self.timecost=self.timecost_initial.copy()
+        for table in self.forwarding.values():
+            table.invalidate()
+        self.release_packets()
+        self.restart_changes()
 
-        print(f"Env reset. TimeTick={self.TimeTick}")
+        if VERBOSE:
+            print(f"Env reset. TimeTick={self.TimeTick}")
         return self.get_load()
     
     def get_state(self):
@@ -397,7 +1202,7 @@ class LogisticsEnv:
         state = {
             'current_time_tick': self.TimeTick,
             'nodes': {node_id: {
-                'buffer': [(pkg.id, pkg.category) for _, pkg in node.buffer],
+                'buffer': [(pkg.id, pkg.category) for pkg in node.buffer],
                 'packages': [(pkg.id, pkg.category) for _, pkg in node.packages],
                 'dones': [(pkg.id, pkg.category) for pkg in node.dones]
             } for node_id, node in self.nodes.items()},
@@ -405,23 +1210,60 @@ class LogisticsEnv:
         }
         return state
 
+    def bind_observation(self):
+        """Allocate the observation buffer and bind every node/route to its slots.
+
+        Layout (np.int32, length 2*len(nodes) + len(routes)):
+          obs[2*i]     buffer count of node i      (i = node.index, insertion order of self.nodes)
+          obs[2*i+1]   processing count of node i
+          obs[2*N+r]   packages on route r         (r = route.index, insertion order of self.routes)
+        """
+        n_nodes = len(self.nodes)
+        self.obs = np.zeros(2 * n_nodes + len(self.routes), dtype=np.int32)
+        self.obs_view = self.obs.view()
+        self.obs_view.flags.writeable = False
+        for i, node in enumerate(self.nodes.values()):
+            node.index = i
+            node.obs = self.obs
+            node.obs_slot = 2 * i
+            node.sync_load()
+        self.route_list = list(self.routes.values())
+        for r, route in enumerate(self.route_list):
+            route.index = r
+            route.obs = self.obs
+            route.obs_slot = 2 * n_nodes + r
+            route.sync_load()
+
+    def route_at(self, key):
+        # Route from an index, a (src, dst) key or an 's1->c0' id
+        if isinstance(key, tuple):
+            return self.routes[key]
+        if isinstance(key, str):
+            return self.routes[tuple(key.split('->'))]
+        return self.route_list[key]
+
+    def flagged_routes(self, actions):
+        # Routes selected by the actions argument of step(), each at most once and
+        # in route index order whatever the form, so all forms give the same run
+        if isinstance(actions, (set, frozenset)):
+            routes = {route.index: route for route in map(self.route_at, actions)}
+            return [routes[r] for r in sorted(routes)]
+        # A mask or a dense list must cover every route; anything else (e.g. a list of
+        # indices or ids) would be misread as one, so it is refused instead
+        actions = np.asarray(actions)
+        if actions.shape != (len(self.route_list),):
+            raise ValueError(f"actions must be a set of routes or a mask of {len(self.route_list)} routes, "
+                             f"got shape {actions.shape}")
+        if actions.dtype != np.bool_:
+            if not np.isin(actions, (0, 1)).all():
+                raise ValueError("a dense actions list must hold only 0 and 1, pass a set for route indices or ids")
+            actions = actions == 1
+        return [self.route_list[r] for r in np.flatnonzero(actions)]
+
     def get_load(self):
-        # 创建一个状态表示，包括决策相关的信息
-        state = {
-            'nodes': {node_id: {
-                'buffer_count': len(node.buffer),
-                'packages_count': len(node.packages),
-                #'dones_count': len(node.dones)
-            } for node_id, node in self.nodes.items()},
-            'routes': {(src, dst): len(route.packages) for (src, dst), route in self.routes.items()}
-        }
-        # 转换状态为数值形式
-        converted_state = []
-        for node_id, node_info in state['nodes'].items():
-            converted_state.extend([node_info['buffer_count'], node_info['packages_count']])
-        for route_id, route_info in state['routes'].items():
-            converted_state.append(route_info)
-        return converted_state
+        # Read-only view of the observation buffer, updated in place as packages move.
+        # Copy it if you need to keep the values of a given step.
+        return self.obs_view
 
     def get_reward(self):
         reward = 0
@@ -434,302 +1276,509 @@ class LogisticsEnv:
                 reward -= 1
         return reward
 
+    def capture_state(self):
+        # Live (uncopied) references to everything step() mutates
+        return {
+            'TimeTick': self.TimeTick,
+            'done': self.done,
+            'moneycost': self.moneycost,
+            'timecost': self.timecost,
+            'stream': self.stream,
+            'packages': self.packages,
+            'delivered': self.delivered,
+            'nodes': {node_id: (node.buffer, node.packages, node.dones, node.history, node.package_order)
+                      for node_id, node in self.nodes.items()},
+            'routes': {route_id: (route.packages, route.history, route.package_order, route.fleet)
+                       for route_id, route in self.routes.items()},
+        }
+
+    def load_state(self, state):
+        # Adopt a state produced by fork_state(); the env takes ownership of it
+        self.TimeTick = state['TimeTick']
+        self.done = state['done']
+        self.moneycost = state['moneycost']
+        self.timecost = state['timecost']
+        for table in self.forwarding.values():
+            table.invalidate()
+        self.stream = state['stream']
+        self.packages = state['packages']
+        self.delivered = state['delivered']
+        for node_id, (buffer, processing, dones, history, order) in state['nodes'].items():
+            node = self.nodes[node_id]
+            node.buffer, node.packages, node.dones, node.history, node.package_order = buffer, processing, dones, history, order
+            node.sync_load()
+        for route_id, (on_route, history, order, fleet) in state['routes'].items():
+            route = self.routes[route_id]
+            route.packages, route.history, route.package_order, route.fleet = on_route, history, order, fleet
+            # the loaded matrices already reflect the congestion of the loaded queues
+            route.congested = route.load() > route.congestion_limit
+            route.sync_load()
+        self.dirty_routes.clear()
+        self.restart_changes()
+
+    def snapshot(self):
+        # Independent copy of the dynamic state, can be restored any number of times
+        return fork_state(self.capture_state())
+
+    def restore(self, snapshot):
+        self.load_state(fork_state(snapshot))
+
+    def clone(self):
+        # Fork the simulator: queues, packages and cost matrices are copied,
+        # static data (node/route properties, initial matrices, packets) is shared.
+        env = copy.copy(self)
+        env.nodes = {node_id: copy.copy(node) for node_id, node in self.nodes.items()}
+        env.routes = {route_id: copy.copy(route) for route_id, route in self.routes.items()}
+        env.vehicle_routes = [env.routes[(route.src, route.dst)] for route in self.vehicle_routes]
+        env.dirty_routes = {}
+        env.cost_listeners = []
+        env.checkpointer = None
+        env.changes = None
+        env.change_log = None
+        for node_or_route in itertools.chain(env.nodes.values(), env.routes.values()):
+            node_or_route.changes = None
+        env.profiler = StepStats() if self.profiler is not None else None
+        # a fork keeps the retention limits but never writes to the parent's store
+        env.retention = copy.copy(self.retention)
+        env.retention.store = None
+        for route in env.routes.values():
+            route.dirty = env.dirty_routes
+        env.bind_observation()
+        env.load_state(fork_state(self.capture_state()))
+        # same costs as the parent, the columns computed so far stay valid
+        env.forwarding = {express: table.copy() for express, table in self.forwarding.items()}
+        return env
+
+    def save(self, path, static=None):
+        # Write the complete dynamic state plus what is needed to rebuild the env to
+        # `path` (gzip-compressed if it ends in .gz). The current cost matrices are left
+        # out: between steps they are the initial ones, carried by the topology, with the
+        # congested routes doubled, and load() patches them back in. With `static`, a file
+        # written by save_static(), the topology and the packet source are not repeated
+        # here, only the stream position is stored and load() reads the rest from static.
+        state = dict(self.capture_state())
+        del state['moneycost'], state['timecost']
+        checkpoint = {
+            'version': 2,
+            'topology': self.topology if static is None else None,
+            'static': None if static is None else os.path.basename(static),
+            'congestion_limit': self.congestion_limit,
+            'queue_discipline': self.queue_discipline,
+            'retention': self.retention,
+            'vehicles': self.vehicle_specs,
+            'run_id': self.run_id,
+            'state': state,
+        }
+        if static is not None:
+            state['stream'] = self.stream.position()
+        write_pickle(checkpoint, path)
+
+    def save_static(self, path):
+        # What every checkpoint of a run shares: the topology and the packet source
+        # (a one-shot iterator cannot be saved, like in save())
+        write_pickle({'topology': self.topology, 'source': self.stream.__getstate__()['source']}, path)
+
+    @classmethod
+    def load(cls, path):
+        # Rebuild an env from a file written by save(); cost listeners are not saved.
+        # A static file is looked up next to path.
+        checkpoint = read_pickle(path)
+        state = checkpoint['state']
+        topology = checkpoint['topology']
+        if checkpoint.get('static') is not None:
+            static = read_pickle(os.path.join(os.path.dirname(path), checkpoint['static']))
+            topology = static['topology']
+            state['stream'] = PacketStream.resume(static['source'], state['stream'])
+        env = cls(topology, (), checkpoint['congestion_limit'],
+                  checkpoint['queue_discipline'], checkpoint['retention'], checkpoint['vehicles'])
+        env.run_id = checkpoint['run_id']
+        state['moneycost'] = env.moneycost_initial.copy()
+        state['timecost'] = env.timecost_initial.copy()
+        env.load_state(state)
+        for route in env.routes.values():
+            if route.congested:
+                i, j = route.cells
+                env.moneycost[i, j] = 2 * env.moneycost_initial[i, j]
+                env.timecost[i, j] = 2 * env.timecost_initial[i, j]
+        return env
+
+    def enable_checkpoints(self, directory, every=1.0, keep=None):
+        # Checkpoint now and then every `every` sim-hours, see Checkpointer
+        self.checkpointer = Checkpointer(directory, every, keep)
+        self.checkpointer.after_step(self)
+        return self.checkpointer
+
+    @classmethod
+    def seek(cls, directory, hour):
+        # Env at sim time `hour` of a checkpointed run: load the latest checkpoint
+        # at or before it and replay forward with the logged actions
+        target = tick_index(hour)
+        found = [path for tick, path in Checkpointer.checkpoints(directory) if tick <= target]
+        if not found:
+            raise ValueError(f"no checkpoint at or before hour {hour} in {directory}")
+        env = cls.load(found[-1])
+        actions = Checkpointer.read_actions(directory)
+        while not env.done and tick_index(env.TimeTick) < target:
+            env.step(set(actions.get(tick_index(env.TimeTick), ())))
+        return env
+
+    def enable_profiling(self, on=True):
+        # Time every phase of step(); when off, step() only tests one attribute per phase
+        if not on:
+            self.profiler = None
+        elif self.profiler is None:
+            self.profiler = StepStats()
+
+    def stats(self, reset=False):
+        # Per-phase counters of step() since profiling was enabled or last reset, None when off
+        if self.profiler is None:
+            return None
+        out = self.profiler.as_dict()
+        if reset:
+            self.profiler.reset()
+        return out
+
+    def track_changes(self, keep=1000):
+        # Record what every step touches; the last `keep` versions can be diffed against
+        self.changes = ChangeSet()
+        self.change_log = deque(maxlen=keep)  # (version, (nodes, routes, packages, removed))
+        for node_or_route in itertools.chain(self.nodes.values(), self.routes.values()):
+            node_or_route.changes = self.changes
+
+    def commit_changes(self):
+        if self.changes:
+            self.version += 1
+            self.change_log.append((self.version, self.changes.take()))
+
+    def restart_changes(self):
+        # The whole state was replaced (reset, load_state): earlier versions cannot be diffed against
+        if self.changes is not None:
+            self.changes.take()
+            self.change_log.clear()
+            self.version += 1
+
+    def diff_since(self, version=None):
+        """What changed since `version`, a value returned by an earlier call:
+
+          {'version': current version, 'time': TimeTick, 'full': bool,
+           'nodes': {node id: (buffer count, processing count, done count)},
+           'routes': {route id: packages on the route},
+           'packages': {package id: (location, status)},  status: buffer/processing/route/done
+           'removed': [ids of evicted packages]}
+
+        Only touched entries are listed, with their current values. 'full' is True and
+        everything is listed when version is None, unknown or older than the kept log;
+        the first call switches change tracking on (see track_changes()).
+        """
+        if self.changes is None:
+            self.track_changes()
+            version = None
+        self.commit_changes()
+        oldest = self.change_log[0][0] if self.change_log else self.version + 1
+        full = version is None or version > self.version or oldest > version + 1
+        if full:
+            nodes, routes, packages, removed = self.nodes.values(), self.routes.values(), self.packages.values(), ()
+        else:
+            node_ids, route_ids, package_ids, removed = set(), set(), set(), set()
+            for v, (n, r, p, e) in reversed(self.change_log):
+                if v <= version:
+                    break
+                node_ids |= n
+                route_ids |= r
+                package_ids |= p
+                removed |= e
+            nodes = [self.nodes[i] for i in node_ids]
+            routes = [self.route_at(i) for i in route_ids]
+            packages = [self.packages[i] for i in package_ids if i in self.packages]
+        return {
+            'version': self.version,
+            'time': self.TimeTick,
+            'full': full,
+            'nodes': {node.id: (len(node.buffer), len(node.packages), len(node.dones)) for node in nodes},
+            'routes': {route.id: route.load() for route in routes},
+            'packages': {p.id: (p.location, self.package_status(p)) for p in packages},
+            'removed': [i for i in removed if i not in self.packages],
+        }
+
+    @staticmethod
+    def package_status(package):
+        if package.done:
+            return 'done'
+        if '->' in package.location:
+            return 'route'
+        return 'buffer' if package.delay == float('inf') else 'processing'
+
     def add_node(self, id, pos, throughput, delay, cost, is_station=False):
-        self.nodes[id] = Node(id, pos, throughput, delay, cost, is_station)
+        self.nodes[id] = Node(id, pos, throughput, delay, cost, is_station, self.queue_discipline,
+                              self.retention.history_limit)
         return self.nodes[id]
 
     def add_route(self, src, dst, time, cost):
-        self.routes[(src, dst)] = Route(src, dst, time, cost)
-        return self.routes[(src, dst)]
+        if callable(self.vehicles):
+            spec = self.vehicles(src, dst)
+        else:
+            spec = (self.vehicles or {}).get((src, dst))
+        if spec:
+            route = VehicleRoute(src, dst, time, cost, history_limit=self.retention.history_limit, **spec)
+            self.vehicle_specs[(src, dst)] = spec
+            self.vehicle_routes.append(route)
+        else:
+            route = Route(src, dst, time, cost, self.retention.history_limit)
+        route.cells = (self.topology.index(src) + 1, self.topology.index(dst))
+        route.congestion_limit = self.congestion_limit
+        route.dirty = self.dirty_routes
+        self.routes[(src, dst)] = route
+        return route
+
+    def add_cost_listener(self, listener):
+        # listener(routes) is called after update_distance() patched the cost of those routes
+        self.cost_listeners.append(listener)
 
     def add_package(self, id, time_created, src, dst, category):
         package = Package(id, time_created, src, dst, category)
-        #print(f"Category: {category}")
-        # Calculate the initial optimal路径 based on the package's category
-        if category:
-            #print("find_shortest_time_path")
-            # 对于Express包裹，找到最短的总时间路径
-            optimal_path = self.find_shortest_time_path(src, dst)
-        else:
-            #print("find_lowest_cost_path")
-            # 对于Standard包裹，找到最低的总成本路径
-            optimal_path = self.find_lowest_cost_path(src, dst)
-        
-        package.path = optimal_path  # 将最优路径初始化为包裹的路径
-        assert optimal_path != [], f"Package: {package.id} EMPTY!!!INFO:{id, time_created, src, dst, category}"
+        if self.retention.history_limit is not None:
+            package.history = new_history(self.retention.history_limit)
+        # 路由由转发表逐跳决定, 这里只检查终点可达 (raises ValueError otherwise)
+        self.next_hop(src, package)
         self.packages[id] = package
-        self.nodes[src].add_package(package)  # 添加到优先队列中
+        self.nodes[src].add_package(package, self.TimeTick)  # 添加到优先队列中
         return package
+
+    def package_delivered(self, package):
+        # Apply the retention policy to a package that just reached its destination
+        retention = self.retention
+        if retention.summarize:
+            if retention.store is not None:
+                retention.store.append(package)
+            events = len(package.history)
+            package.history = [(package.time_arrived, package.dst,
+                                f"DELIVERED: {package.hops} hops, {events} events, "
+                                f"{package.time_arrived - package.time_created:.1f} h")]
+        if retention.evict_after is not None:
+            self.delivered.append(package)
+
+    def evict_packages(self):
+        # Forget the packages delivered more than evict_after sim-hours ago.
+        # Delivery and eviction both go in arrival order, so every eviction is a popleft.
+        retention = self.retention
+        if not self.delivered:
+            return 0
+        horizon = self.TimeTick - retention.evict_after
+        evicted = 0
+        while self.delivered and self.delivered[0].time_arrived <= horizon:
+            package = self.delivered.popleft()
+            del self.packages[package.id]
+            if self.changes is not None:
+                self.changes.removed.add(package.id)
+                self.changes.nodes.add(package.dst)
+            dones = self.nodes[package.dst].dones
+            if dones and dones[0] is package:
+                dones.popleft()
+            else:
+                dones.remove(package)
+            if retention.store is not None and not retention.summarize:  # summarize spilled it already
+                retention.store.append(package)
+            evicted += 1
+        if evicted and retention.store is not None:
+            retention.store.flush()
+        return evicted
+
     def update_distance(self):
-        for i in self.routes.values():
-        
-            if i.src[0]=='s':
-                a=int(i.src[1:])*2+2*parameters["center_num"]
-            if i.src[0]=='c':
-                a=int(i.src[1:])*2
-            if i.dst[0]=='s':
-                b=int(i.dst[1:])*2+2*parameters["center_num"]
-            if i.dst[0]=='c':
-                b=int(i.dst[1:])*2
-            if len(i.packages)>30:
-                self.moneycost[a+1][b]=2*self.moneycost[a+1][b]
-                self.moneycost[b+1][a]=2*self.moneycost[b+1][a]
-                self.timecost[a+1][b]=2*self.moneycost[a+1][b]
-                self.timecost[b+1][a]=2*self.moneycost[b+1][a]   ####极端负载下时间成本和金钱成本都大幅提高
+        # Patch only the routes whose load crossed congestion_limit since the last call,
+        # so the cost of a step depends on load changes, not on the size of the network
+        if not self.dirty_routes:
+            return []
+        changed = list(self.dirty_routes.values())
+        self.dirty_routes.clear()
+        for route in changed:
+            i, j = route.cells
+            if route.congested:
+                # 极端负载下时间成本和金钱成本都大幅提高
+                self.moneycost[i, j] = 2 * self.moneycost_initial[i, j]
+                self.timecost[i, j] = 2 * self.timecost_initial[i, j]
             else:
-                self.moneycost[a+1][b]=self.moneycost_initial[a+1][b]
-                self.moneycost[b+1][a]=self.moneycost_initial[b+1][a]
-                self.timecost[a+1][b]=self.moneycost_initial[a+1][b]
-                self.timecost[b+1][a]=self.moneycost_initial[b+1][a]
-        return 0
+                self.moneycost[i, j] = self.moneycost_initial[i, j]
+                self.timecost[i, j] = self.timecost_initial[i, j]
+        cells = [route.cells for route in changed]
+        for express, table in self.forwarding.items():
+            table.update(cells, self.timecost if express else self.moneycost)
+        for listener in self.cost_listeners:
+            listener(changed)
+        return changed
    
+    def next_hop(self, node_id, package):
+        # Node a package leaves node_id for: its detour if rerouted, else the routing table
+        if package.detour is not None:
+            return package.detour[node_id]
+        express = bool(package.category)
+        return self.forwarding[express].next_hop(node_id, package.dst, self.timecost if express else self.moneycost)
+
+    def table_path(self, src, dst, express):
+        # Node-id path from src to dst the routing tables give right now
+        table = self.forwarding[express]
+        matrix = self.timecost if express else self.moneycost
+        path = [src]
+        while path[-1] != dst:
+            path.append(table.next_hop(path[-1], dst, matrix))
+        return path
+
     def find_shortest_time_path(self, src, dst):
-        if src[0]=='s':
-            if len(src)==2:
-                a=int(src[1])*2+2*parameters["center_num"]
-            else:
-                a=int(src[1:])*2+2*parameters["center_num"]
-        else:
-            a=int(src[1])*2
-        if dst[0]=='s':
-            if len(dst)==2:
-                b=int(dst[1])*2+2*parameters["center_num"]
-            else:
-                b=int(dst[1:])*2+2*parameters["center_num"]
-        else:
-            b=int(dst[1])*2
-
-        n=len(self.timecost)#ordre du graphe
-        Delta=[np. Infinity]*n#étape 1
-        Chemins=[[]]*n# liste des listes des plus courts chemins
-        Delta[a]=0  #étape 1
-        Chemins[a]=[a] #plus court chemin de s0 à s0
-        for k in range(n-1): #étape 2
-            for i in range(n): #étape 3
-                for j in range(n): #étape 3
-                    if self.timecost[ i ][ j]!=0 and Delta[ i]+self.timecost[ i ][ j]<Delta[ j ]: #ét. 4
-                        Delta[ j]=Delta[ i]+self.timecost[ i ][ j ] #étape 4
-                        Chemins[ j]=Chemins[ i ]+[j ] #chemin plus court
-        d=Chemins
-        path=[]
-        for i in range(int((len(d[b])+1)/2)):
-            if d[b][2*i]>2*parameters["center_num"]-1:
-                path.append('s'+str(int((d[b][2*i]-2*parameters["center_num"])/2)))
-            else :
-                path.append('c'+str(int(d[b][2*i]/2))) 
-        return path 
-         
+        return self.table_path(src, dst, True)
+
     def find_lowest_cost_path(self, src, dst):
-        if src[0]=='s':
-            if len(src)==2:
-                a=int(src[1])*2+2*parameters["center_num"]
-            else:
-                a=int(src[1:])*2+2*parameters["center_num"]
-        else:
-            a=int(src[1])*2
-        if dst[0]=='s':
-            if len(dst)==2:
-                b=int(dst[1])*2+2*parameters["center_num"]
-            else:
-                b=int(dst[1:])*2+2*parameters["center_num"]
-        else:
-            b=int(dst[1])*2
-
-        n=len(self.moneycost)#ordre du graphe
-        Delta=[np. Infinity]*n#étape 1
-        Chemins=[[]]*n# liste des listes des plus courts chemins
-        Delta[a]=0  #étape 1
-        Chemins[a]=[a] #plus court chemin de s0 à s0
-        for k in range(n-1): #étape 2
-            for i in range(n): #étape 3
-                for j in range(n): #étape 3
-                    if self.moneycost[ i ][ j]!=0 and Delta[ i]+self.moneycost[ i ][ j]<Delta[ j ]: #ét. 4
-                        Delta[ j]=Delta[ i]+self.moneycost[ i ][ j ] #étape 4
-                        Chemins[ j]=Chemins[ i ]+[j ] #chemin plus court
-        d=Chemins
-        path=[]
-        for i in range(int((len(d[b])+1)/2)):
-            if d[b][2*i]>2*parameters["center_num"]-1:
-                path.append('s'+str(int((d[b][2*i]-2*parameters["center_num"])/2)))
-            else :
-                path.append('c'+str(int(d[b][2*i]/2))) 
-        return path
-    
-    def find_alternative_time_path(self, src, dst, avoid_node):
-        if src[0]=='s':
-            if len(src)==2:
-                a=int(src[1])*2+2*parameters["center_num"]
-            else:
-                a=int(src[1:])*2+2*parameters["center_num"]
-        else:
-            a=int(src[1])*2
-        if dst[0]=='s':
-            if len(dst)==2:
-                b=int(dst[1])*2+2*parameters["center_num"]
-            else:
-                b=int(dst[1:])*2+2*parameters["center_num"]
-        else:
-            b=int(dst[1])*2
-        M=np.copy(self.timecost)
-        if avoid_node[0]=='c':
-            if len(avoid_node)==2:
-                n=int(avoid_node[1])*2   
-            else:
-                n=int(avoid_node[1:])*2
-            for j in range(2*parameters["center_num"]+2*parameters["station_num"]):
-                M[n][j]=np.Infinity
-                M[j][n]=M[n][j]
-
-        if avoid_node[0]=='s':
-            for j in range(2*parameters["center_num"]+2*parameters["station_num"]):
-                if len(avoid_node)==2:
-                    m=int(avoid_node[1])*2+2*parameters["center_num"]   
-                else:
-                    m=int(avoid_node[1:])*2+2*parameters["center_num"]
-                M[m][j]=np.Infinity
-                M[j][m]=M[m][j]
-        n=len(M)#ordre du graphe
-        Delta=[np. Infinity]*n#étape 1
-        Chemins=[[]]*n# liste des listes des plus courts chemins
-        Delta[a]=0  #étape 1
-        Chemins[a]=[a] #plus court chemin de s0 à s0
-        for k in range(n-1): #étape 2
-            for i in range(n): #étape 3
-                for j in range(n): #étape 3
-                    if M[ i ][ j]!=0 and Delta[ i]+M[ i ][ j]<Delta[ j ]: #ét. 4
-                        Delta[ j]=Delta[ i]+M[ i ][ j ] #étape 4
-                        Chemins[ j]=Chemins[ i ]+[j ] #chemin plus court
-        d=Chemins
-        path=[]
+        return self.table_path(src, dst, False)
+
+    def masked_search(self, matrix, src, avoid_node):
+        # Single-source Bellman-Ford from src on a copy of matrix without avoid_node.
+        # Returns (Delta, pred) for every matrix index, so one search serves
+        # every destination of the packages being rerouted around avoid_node.
+        a=self.topology.index(src)
+        m=self.topology.index(avoid_node)
+        if is_sparse(matrix):
+            # Large networks: Dijkstra on the sparse graph, avoid_node's edges zeroed out (dropped)
+            from scipy.sparse import diags
+            from scipy.sparse.csgraph import dijkstra
+            keep=np.ones(matrix.shape[0])
+            keep[m]=0
+            graph=diags(keep) @ matrix.tocsr() @ diags(keep)
+            graph.eliminate_zeros()
+            Delta, pred=dijkstra(graph, indices=a, return_predecessors=True)
+            return Delta, np.where(pred>=0, pred, -1)
+        M=np.where(matrix!=0, matrix, np.inf)
+        M[m,:]=np.inf
+        M[:,m]=np.inf
+        n=len(M)
+        Delta=np.full(n, np.inf)
+        Delta[a]=0
+        pred=np.full(n, -1)
+        cols=np.arange(n)
+        for k in range(n-1):
+            cand=Delta[:,None]+M
+            best=cand.argmin(axis=0)
+            relaxed=cand[best,cols]
+            better=relaxed<Delta
+            if not better.any():
+                break
+            Delta[better]=relaxed[better]
+            pred[better]=best[better]
+        return Delta, pred
+
+    def path_from_search(self, search, dst):
+        # Node-id path to dst out of a masked_search() result, [] if unreachable
+        Delta, pred = search
+        b=self.topology.index(dst)
         if Delta[b]>100000:
-            path=[]
-        else:
-            for i in range(int((len(d[b])+1)/2)):
-                if d[b][2*i]>2*parameters["center_num"]-1:
-                    path.append('s'+str(int((d[b][2*i]-2*parameters["center_num"])/2)))
-                else :
-                    path.append('c'+str(int(d[b][2*i]/2))) 
+            return []
+        chain=[b]
+        while pred[chain[-1]]!=-1:
+            chain.append(pred[chain[-1]])
+        chain.reverse()
+        path=[self.topology.node_id(k) for k in chain[::2]]
         if len(path)<2:
             return []
-        else:
-            new_path = [path[0]] + self.find_shortest_time_path(path[1],path[-1])
-            return path #TODO new_path
+        return path
+
+    def find_alternative_time_path(self, src, dst, avoid_node):
+        return self.path_from_search(self.masked_search(self.timecost, src, avoid_node), dst)
 
     def find_alternative_cost_path(self, src, dst, avoid_node):
-        if src[0]=='s':
-            if len(src)==2:
-                a=int(src[1])*2+2*parameters["center_num"]
-            else:
-                a=int(src[1:])*2+2*parameters["center_num"]
-        else:
-            a=int(src[1])*2
-        if dst[0]=='s':
-            if len(dst)==2:
-                b=int(dst[1])*2+2*parameters["center_num"]
-            else:
-                b=int(dst[1:])*2+2*parameters["center_num"]
-        else:
-            b=int(dst[1])*2
-        M=np.copy(self.timecost)
-    
-        if avoid_node[0]=='c':
-            if len(avoid_node)==2:
-                m=int(avoid_node[1])*2   
-            else:
-                m=int(avoid_node[1:])*2
-            for j in range(2*parameters["center_num"]+2*parameters["station_num"]):
-                M[m][j]=np.Infinity
-                M[j][m]=M[m][j]
-
-        if avoid_node[0]=='s':
-            if len(avoid_node)==2:
-                n=int(avoid_node[1])*2+2*parameters["center_num"]   
-            else:
-                n=int(avoid_node[1:])*2+2*parameters["center_num"]
-            for j in range(2*parameters["center_num"]+2*parameters["station_num"]):
-                M[n][j]=np.Infinity
-                M[j][n]=M[n][j]
-    
-        n=len(M)#ordre du graphe
-        Delta=[np. Infinity]*n#étape 1
-        Chemins=[[]]*n# liste des listes des plus courts chemins
-        Delta[a]=0  #étape 1
-        Chemins[a]=[a] #plus court chemin de s0 à s0
-        for k in range(n-1): #étape 2
-            for i in range(n): #étape 3
-                for j in range(n): #étape 3
-                    if M[ i ][ j]!=0 and Delta[ i]+M[ i ][ j]<Delta[ j ]: #ét. 4
-                        Delta[ j]=Delta[ i]+M[ i ][ j ] #étape 4
-                        Chemins[ j]=Chemins[ i ]+[j ] #chemin plus court
-        d=Chemins
-        path=[]
-        if Delta[b]>100000:
-            path=[]
-        else:
-            for i in range(int((len(d[b])+1)/2)):
-                if d[b][2*i]>2*parameters["center_num"]-1:
-                    path.append('s'+str(int((d[b][2*i]-2*parameters["center_num"])/2)))
-                else :
-                    path.append('c'+str(int(d[b][2*i]/2))) 
-        if len(path)<2:
-            return []
-        else:
-            new_path = [path[0]] + self.find_shortest_time_path(path[1],path[-1])
-            return path #TODO new_path
+        return self.path_from_search(self.masked_search(self.moneycost, src, avoid_node), dst)
 
-    def change_route(self, route):#TODO 检查是否正确更改路径
+    def change_route(self, route):
+        # Reroute the packages about to leave route.src through route.dst. They all
+        # avoid the same node, so packages are grouped by (destination, category) and
+        # each objective needs one masked search from route.src, shared by its groups.
         src_node = self.nodes[route.src]
-        # 检查堆是否为空
-        if src_node.packages:
-            # 获取堆顶的包裹
-            for _, package in src_node.packages:
-                next_node_id = get_next_node(package.path,src_node.id)
-                if package.delay<=0.1 and next_node_id == route.dst and next_node_id != package.dst:
-                    print(f"有符合条件的包裹！{package}")
-                    print(type(next_node_id),next_node_id)
-                    if package.category:
-                        # For Express packages, find the shortest total time path
-                        new_path=self.find_alternative_time_path(src_node.id, package.dst, next_node_id)
-                    else:
-                        # For Standard packages, find the lowest total cost path
-                        new_path=self.find_alternative_cost_path(src_node.id, package.dst, next_node_id)
-                    if new_path == []: #如果有新路线，采用；如果没有，不变
-                        print(f"Alternative Route unavailable!")
-                    else:
-                        print(f"Route for Pack: {package.id} changed from {package.path} to {new_path}!")
-                        package.path = new_path
-                        
+        groups = {}
+        for _, package in src_node.packages:
+            next_node_id = self.next_hop(src_node.id, package)
+            if package.delay<=0.1 and next_node_id == route.dst and next_node_id != package.dst:
+                groups.setdefault((package.dst, bool(package.category)), []).append(package)
+        searches = {}
+        for (dst, express), members in groups.items():
+            if express not in searches:
+                # Express packages take the shortest total time, Standard the lowest total cost
+                matrix = self.timecost if express else self.moneycost
+                searches[express] = self.masked_search(matrix, src_node.id, route.dst)
+            new_path = self.path_from_search(searches[express], dst)
+            if new_path == []: #如果有新路线，采用；如果没有，不变
+                if VERBOSE:
+                    print(f"Alternative Route unavailable for {len(members)} packs to {dst}!")
+            else:
+                if VERBOSE:
+                    print(f"Route for {len(members)} packs to {dst} changed to {new_path}!")
+                # the group shares one detour, followed hop by hop up to the destination
+                detour = dict(zip(new_path, new_path[1:]))
+                for package in members:
+                    package.detour = detour
+
+    def finished(self):
+        # Every packet released and every package delivered
+        return self.stream.exhausted and all(package.done for package in self.packages.values())
+
     def step(self, actions=None): 
-        self.done = all(package.done for package in self.packages.values())
+        """Advance the simulation by one tick (0.1 h).
+
+        actions selects the routes on which change_route() fires, in one of these forms:
+          - a set of route indices (route.index), route keys ((src, dst)) or route ids ('s1->c0')
+          - a NumPy boolean mask of length len(self.routes)
+          - a dense list aligned to self.routes, where 1 flags the route
+        Only the flagged routes are touched. Returns (get_load(), get_reward()).
+        """
+        self.done = self.finished()
         if self.done == True:
-            print("All packs are done!")
+            if VERBOSE:
+                print("All packs are done!")
             return self.get_load(), self.get_reward()
         
-        if actions != None:
-            for route, action in zip(self.routes.keys(), actions):
-                if action==1:
-                    self.change_route(self.routes[route])
-                else:
-                    continue
-        
+        prof = self.profiler
+        if prof is not None:
+            prof.steps += 1
+            t = perf_counter()
+
+        if actions is not None:
+            flagged = self.flagged_routes(actions)
+            if self.checkpointer is not None:
+                self.checkpointer.record_actions(self, flagged)
+            for route in flagged:
+                self.change_route(route)
+            if prof is not None:
+                t = prof.add('actions', t, len(flagged))
+
         self.TimeTick += 0.1  # 更新时间
         # 更新所有包裹的延迟
         for package in self.packages.values():
             package.delay -= 0.1
-        
+        if prof is not None:
+            t = prof.add('delays', t, len(self.packages))
+            released = self.stream.released
+        self.release_packets()
+        if prof is not None:
+            t = prof.add('release', t, self.stream.released - released)
+
+        moved = 0
         for node in self.nodes.values():
             top_package = get_top_package(node)
             while (top_package != None and top_package.delay <= 0):
                 # 从Node中删除包裹
-                top_package = node.remove_package()
+                top_package = node.remove_package(self.TimeTick)
                 # 往Route中添加包裹
-                next_node_id = get_next_node(top_package.path, node.id)
+                next_node_id = self.next_hop(node.id, top_package)
+                top_package.hops += 1
                 route = self.routes[(node.id,next_node_id)]
-                route.add_package(top_package)
+                route.add_package(top_package, self.TimeTick)
                 top_package.history.append((self.TimeTick, node.id, f"SENT: From Node: {node.id} to Route: {route.id}"))
+                moved += 1
                 # 获取下一个包裹
                 top_package = get_top_package(node)
+        if prof is not None:
+            t = prof.add('departures', t, moved)
 
+        moved = 0
+        if self.vehicle_routes:
+            tick = tick_index(self.TimeTick)
+            for route in self.vehicle_routes:
+                route.advance(tick)
         for route in self.routes.values():
             top_package = get_top_package(route)
             while (top_package != None and top_package.delay <= 0):
@@ -737,15 +1786,32 @@ class LogisticsEnv:
                 top_package = route.remove_package()
                 # 往Node中添加包裹
                 next_node = self.nodes[route.dst]
-                next_node.add_package(top_package)
+                next_node.add_package(top_package, self.TimeTick)
                 top_package.history.append((self.TimeTick, route.id,f"ARRIVED: From Node: {route.dst} to Route: {route.id}", ))
                 if top_package.dst == route.dst:
                     top_package.time_arrived = self.TimeTick
+                    self.package_delivered(top_package)
+                moved += 1
                 # 获取下一个包裹
-                top_package = get_top_package(node)
-        
-        _ = self.update_distance() #TODO 更新函数
-        return self.get_load(), self.get_reward()
+                top_package = get_top_package(route)
+        if prof is not None:
+            t = prof.add('arrivals', t, moved)
+
+        evicted = self.evict_packages()
+        if prof is not None:
+            t = prof.add('evict', t, evicted)
+        changed = self.update_distance()
+        if prof is not None:
+            t = prof.add('update_distance', t, len(changed))
+        if self.checkpointer is not None:
+            self.checkpointer.after_step(self)
+        if self.changes is not None:
+            self.commit_changes()
+        if prof is None:
+            return self.get_load(), self.get_reward()
+        reward = self.get_reward()
+        prof.add('reward', t, len(self.packages))
+        return self.get_load(), reward
     
 def print_state(state):
     print("State:")
@@ -769,7 +1835,8 @@ def print_state(state):
 
 def test_classic():
     # 初始化环境, 打印初始状态
-    env = LogisticsEnv()
+    topology, packets = make_network()
+    env = LogisticsEnv(topology, packets)
     #print("Initial State:")
     #print_state(env.get_state())
     # 模拟
@@ -794,4 +1861,5 @@ def test_classic():
                 print(f"Route: {route.id}, History: {route.history}")
     print(f"Total Time: {env.TimeTick}, Total Cost: {total_reward}")
 # 运行测试
-test_classic()
+if __name__ == "__main__":
+    test_classic()
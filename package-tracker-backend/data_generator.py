@@ -3,10 +3,10 @@
 作者: 孙石，朱虹翱
 """
 
+import os
 import random
 import numpy as np
-import uuid
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from typing import List, Dict, Tuple, Any
 
 # 全局参数配置
@@ -16,11 +16,132 @@ parameters = {
     "packet_num": 100,
 }
 
+# 站点数达到该值（或 parameters["large"] 为 True）时按大规模方式生成：批量生成、MiniBatchKMeans、稀疏成本矩阵
+LARGE_STATION_NUM = 5000
+
+def route_arrays(center_pos, station_pos, station_labels,
+                 road_radius: float = 30) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    所有边的数组 (src, dst, time_cost, money_cost)，节点按位置编号：中心在前（c{i} -> i），
+    站点在后（s{j} -> center_num + j），同一对节点的两个方向相邻。
+    距离只计算一次：中心之间、中心与其簇内站点用广播，道路（距离小于 road_radius 的站点对）
+    由 k-d 树半径查询得到，不遍历所有站点对。
+    """
+    from scipy.spatial import cKDTree
+    centers = np.asarray(center_pos, dtype=float).reshape(-1, 2)
+    stations = np.asarray(station_pos, dtype=float).reshape(-1, 2)
+    labels = np.asarray(station_labels, dtype=np.int64)
+    center_num = len(centers)
+    # 航线：c{i} <-> c{j}，i < j
+    a, b = np.triu_indices(center_num, 1)
+    airline = np.sqrt(((centers[:, None] - centers[None]) ** 2).sum(-1))[a, b]
+    # 高速公路：c{label} <-> 簇内站点，按中心、站点排序
+    members = np.argsort(labels, kind="stable")
+    highway = np.sqrt(((centers[labels[members]] - stations[members]) ** 2).sum(-1))
+    # 道路：s{i} <-> s{j}，i > j，按 i、j 排序
+    pairs = cKDTree(stations).query_pairs(road_radius, output_type="ndarray") if len(stations) else np.empty((0, 2), int)
+    i, j = pairs.max(axis=1), pairs.min(axis=1)
+    road = np.sqrt(((stations[i] - stations[j]) ** 2).sum(-1))
+    keep = road < road_radius
+    order = np.lexsort((j[keep], i[keep]))
+    i, j, road = i[keep][order], j[keep][order], road[keep][order]
+
+    u = np.concatenate([a, labels[members], center_num + i])
+    v = np.concatenate([b, center_num + members, center_num + j])
+    dist = np.concatenate([airline, highway, road])
+    # 航线、高速公路、道路每单位距离的时间与金钱成本
+    time_rate = np.repeat([0.25, 0.6, 0.8], [len(a), len(members), len(i)])
+    money_rate = np.repeat([0.2, 0.12, 0.07], [len(a), len(members), len(i)])
+    src = np.stack([u, v], axis=1).ravel()
+    dst = np.stack([v, u], axis=1).ravel()
+    return src, dst, np.repeat(time_rate * dist, 2), np.repeat(money_rate * dist, 2)
+
+
+def bulk_uuid4(n: int) -> np.ndarray:
+    """
+    批量生成 n 个随机 UUID（版本 4），格式与 str(uuid.uuid4()) 相同，
+    返回 ASCII 字节串数组（'S36'，比 'U36' 省 3/4 内存），需要 str 时 .astype("U36")
+    """
+    raw = np.frombuffer(os.urandom(16 * n), dtype=np.uint8).reshape(n, 16).copy()
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40  # 版本 4
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80  # RFC 4122 变体
+    # 每个字节查表得到两个十六进制字符，再按 8-4-4-4-12 分组插入 '-'
+    hex_pairs = np.array([f"{b:02x}".encode() for b in range(256)], dtype="S2").view(np.uint16)
+    digits = hex_pairs[raw].view(np.uint8)
+    out = np.full((n, 36), ord("-"), dtype=np.uint8)
+    for k, (a, b) in enumerate(((0, 8), (8, 12), (12, 16), (16, 20), (20, 32))):
+        out[:, a + k:b + k] = digits[:, a:b]
+    return out.view("S36").ravel()
+
+
+def generate_packet_arrays(packet_num: int, station_num: int) -> Dict[str, np.ndarray]:
+    """
+    批量生成包裹，按 create_time 排序的列式数组：
+    id（UUID，见 bulk_uuid4）、create_time（小时）、src/dst（站点编号）、category（0 标准，1 快递）
+    所有包裹的起点、终点与类别一次抽样；终点与起点相同的包裹重新抽取终点，直到没有冲突
+    """
+    src_prob = np.random.random(station_num)
+    src_prob = src_prob / np.sum(src_prob)
+    dst_prob = np.random.random(station_num)
+    dst_prob = dst_prob / np.sum(dst_prob)
+    # Package categories are defined here: 0 for Regular, 1 for Express
+    speed_prob = [0.7, 0.3]
+    src = np.random.choice(station_num, size=packet_num, p=src_prob)
+    dst = np.random.choice(station_num, size=packet_num, p=dst_prob)
+    clash = np.flatnonzero(dst == src)
+    while len(clash):
+        dst[clash] = np.random.choice(station_num, size=len(clash), p=dst_prob)
+        clash = clash[dst[clash] == src[clash]]
+    category = np.random.choice(2, size=packet_num, p=speed_prob).astype(np.int8)
+    # Create time of the package, during 12 time ticks(hours)
+    create_time = np.random.random(packet_num) * 12
+    order = np.argsort(create_time)
+    return {
+        "id": bulk_uuid4(packet_num),
+        "create_time": create_time[order],
+        "src": src[order].astype(np.int32),
+        "dst": dst[order].astype(np.int32),
+        "category": category[order],
+    }
+
+
+def packet_tuples(arrays: Dict[str, np.ndarray]) -> List[Tuple[str, float, str, str, int]]:
+    """
+    列式包裹转换为 (packet_id, create_time, src, dst, category) 元组列表（原有格式）
+    """
+    return list(zip(
+        arrays["id"].astype("U36").tolist(),
+        arrays["create_time"].tolist(),
+        [f"s{k}" for k in arrays["src"].tolist()],
+        [f"s{k}" for k in arrays["dst"].tolist()],
+        arrays["category"].tolist(),
+    ))
+
+
+class PacketRows:
+    """
+    列式包裹的只读视图：可多次迭代、按块生成 packet_tuples() 的元组，不整体转换为列表
+    大规模模式下 data_gen() 的 "packets" 为该类型
+    """
+    chunk = 1 << 16  # 每次转换的包裹数
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.arrays = arrays
+
+    def __len__(self) -> int:
+        return len(self.arrays["create_time"])
+
+    def __iter__(self):
+        for start in range(0, len(self), self.chunk):
+            yield from packet_tuples({k: v[start:start + self.chunk] for k, v in self.arrays.items()})
+
+
 def data_gen() -> Dict[str, Any]:
     """
     生成站点、中心、边和包裹数据
     返回包含所有生成数据的字典
     """
+    large = parameters.get("large", parameters["station_num"] >= LARGE_STATION_NUM)
     # Generate Stations
     station_pos = []
     # properties are defined here: throughput/tick, time_delay, money_cost
@@ -28,20 +149,33 @@ def data_gen() -> Dict[str, Any]:
         (10, 2, 0.5), (15, 2, 0.6), (20, 1, 0.8), (25, 1, 0.9)]
     station_prop = []
     
-    for i in range(parameters["station_num"]):
-        # Map size is defined here, which is 100*100
-        station_pos.append((random.randint(0, 100), random.randint(0, 100)))
-        station_prop.append(
-            station_prop_candidates[random.randint(0, len(station_prop_candidates)-1)])
+    if large:
+        # 地图按站点数放大，保持每 100*100 约 25 个站点的密度（道路数与站点数成正比）
+        map_size = parameters.get("map_size", int(round(100 * np.sqrt(max(parameters["station_num"], 25) / 25))))
+        points = np.random.randint(0, map_size + 1, size=(parameters["station_num"], 2))
+        kinds = np.random.randint(0, len(station_prop_candidates), size=parameters["station_num"])
+        station_pos = list(map(tuple, points.tolist()))
+        station_prop = [station_prop_candidates[k] for k in kinds.tolist()]
+    else:
+        for i in range(parameters["station_num"]):
+            # Map size is defined here, which is 100*100
+            station_pos.append((random.randint(0, 100), random.randint(0, 100)))
+            station_prop.append(
+                station_prop_candidates[random.randint(0, len(station_prop_candidates)-1)])
+        points = station_pos
 
     # Generate Centers by clustering
-    kmeans = KMeans(n_clusters=parameters["center_num"], random_state=42, n_init=10)
-    kmeans.fit(station_pos)
-    station_labels = kmeans.predict(station_pos)
+    if large:
+        kmeans = MiniBatchKMeans(n_clusters=parameters["center_num"], random_state=42, batch_size=4096, n_init=3)
+    else:
+        kmeans = KMeans(n_clusters=parameters["center_num"], random_state=42, n_init=10)
+    kmeans.fit(points)
+    station_labels = kmeans.predict(points)
     center_pos = [(int(x[0]), int(x[1])) for x in kmeans.cluster_centers_]
     
+    occupied = set(station_pos)  # 哈希集合，重叠检查为 O(1)
     for i in range(len(center_pos)):
-        while center_pos[i] in station_pos:
+        while center_pos[i] in occupied:
             # move slightly if center is overlapped with station
             print("Warning: Center moved")
             center_pos[i] = (center_pos[i][0] + 1, center_pos[i][1] + 1)
@@ -55,125 +189,35 @@ def data_gen() -> Dict[str, Any]:
         center_prop.append(
             center_prop_candidates[random.randint(0, len(center_prop_candidates)-1)])
 
-    # Generate Edges
-    edges = []
-    
-    # 中心到中心的边（航线）
-    for i in range(parameters["center_num"]):
-        for j in range(parameters["center_num"]):
-            if j > i:
-                dist = np.linalg.norm(
-                    np.array(center_pos[i]) - np.array(center_pos[j]))
-                # src, dst, time_cost, money_cost
-                edges.append((f"c{i}", f"c{j}", 0.25 * dist, 0.2 * dist))
-                edges.append((f"c{j}", f"c{i}", 0.25 * dist, 0.2 * dist))
-
-    # 中心到站点的边（高速公路）
-    for i in range(parameters["center_num"]):
-        for j in range(parameters["station_num"]):
-            if station_labels[j] == i:
-                dist = np.linalg.norm(
-                    np.array(center_pos[i]) - np.array(station_pos[j]))
-                edges.append((f"c{i}", f"s{j}", 0.6 * dist, 0.12 * dist))
-                edges.append((f"s{j}", f"c{i}", 0.6 * dist, 0.12 * dist))
-
-    # 站点到站点的边（道路）
-    for i in range(parameters["station_num"]):
-        for j in range(parameters["station_num"]):
-            if i > j and (np.linalg.norm(np.array(station_pos[i]) - np.array(station_pos[j])) < 30):
-                dist = np.linalg.norm(
-                    np.array(station_pos[i]) - np.array(station_pos[j]))
-                edges.append((f"s{i}", f"s{j}", 0.8 * dist, 0.07*dist))
-                edges.append((f"s{j}", f"s{i}", 0.8 * dist, 0.07*dist))
-
-    # 构建成本矩阵
-    M = np.zeros((2*(parameters["center_num"]+parameters["station_num"]),
-                  2*(parameters["center_num"]+parameters["station_num"])))
-    for i in range(2*(parameters["center_num"]+parameters["station_num"])):
-        for j in range(2*(parameters["center_num"]+parameters["station_num"])):
-            M[i][j] = np.inf
-    
-    for i in range(parameters["center_num"]+parameters["station_num"]):
-        M[2*i][2*i+1] = 0.01
-
-    # 填充时间成本矩阵
-    for i in range(parameters["center_num"]):
-        for j in range(parameters["center_num"]):
-            if j > i:
-                M[2*i+1][2*j] = 0.25*np.linalg.norm(
-                    np.array(center_pos[i]) - np.array(center_pos[j]))
-                M[2*j+1][2*i] = M[2*i+1][2*j]
-
-    for i in range(parameters["center_num"]):
-        for j in range(parameters["station_num"]):
-            if station_labels[j] == i:
-                M[2*i+1][2*j+2*parameters["center_num"]] = 0.6*np.linalg.norm(
-                    np.array(center_pos[i]) - np.array(station_pos[j]))
-                M[2*j+2*parameters["center_num"]+1][2*i] = M[2*i+1][2*j+2*parameters["center_num"]]
-
-    for i in range(parameters["station_num"]):
-        for j in range(parameters["station_num"]):
-            if i > j and (np.linalg.norm(np.array(station_pos[i]) - np.array(station_pos[j])) < 30):
-                M[2*i+2*parameters["center_num"]+1][2*j+2*parameters["center_num"]] = 0.8*np.linalg.norm(
-                    np.array(station_pos[i]) - np.array(station_pos[j]))
-                M[2*j+2*parameters["center_num"]+1][2*i+2*parameters["center_num"]] = M[2*i+2*parameters["center_num"]+1][2*j+2*parameters["center_num"]]
-
-    # 构建金钱成本矩阵
-    N = np.zeros((2*(parameters["center_num"]+parameters["station_num"]),
-                  2*(parameters["center_num"]+parameters["station_num"])))
-    for i in range(2*(parameters["center_num"]+parameters["station_num"])):
-        for j in range(2*(parameters["center_num"]+parameters["station_num"])):
-            N[i][j] = np.inf
-
-    for i in range(parameters["center_num"]):
-        for j in range(parameters["center_num"]):
-            if j > i:
-                N[2*i+1][2*j] = 0.2*np.linalg.norm(
-                    np.array(center_pos[i]) - np.array(center_pos[j]))
-                N[2*j+1][2*i] = N[2*i+1][2*j]
-
-    for i in range(parameters["center_num"]):
-        for j in range(parameters["station_num"]):
-            if station_labels[j] == i:
-                N[2*i+1][2*j+2*parameters["center_num"]] = 0.12*np.linalg.norm(
-                    np.array(center_pos[i]) - np.array(station_pos[j]))
-                N[2*j+2*parameters["center_num"]+1][2*i] = N[2*i+1][2*j+2*parameters["center_num"]]
+    # Generate Edges：航线（中心-中心）、高速公路（中心-站点）、道路（站点-站点）
+    src_idx, dst_idx, time_cost, money_cost = route_arrays(center_pos, station_pos, station_labels)
+    names = [f"c{i}" for i in range(parameters["center_num"])] + [f"s{j}" for j in range(parameters["station_num"])]
+    # src, dst, time_cost, money_cost
+    edges = [(names[u], names[v], t, m)
+             for u, v, t, m in zip(src_idx.tolist(), dst_idx.tolist(), time_cost.tolist(), money_cost.tolist())]
 
-    for i in range(parameters["station_num"]):
-        for j in range(parameters["station_num"]):
-            if i > j and (np.linalg.norm(np.array(station_pos[i]) - np.array(station_pos[j])) < 30):
-                N[2*i+2*parameters["center_num"]+1][2*j+2*parameters["center_num"]] = 0.07*np.linalg.norm(
-                    np.array(station_pos[i]) - np.array(station_pos[j]))
-                N[2*j+2*parameters["center_num"]+1][2*i+2*parameters["center_num"]] = N[2*i+2*parameters["center_num"]+1][2*j+2*parameters["center_num"]]
+    # 构建成本矩阵：节点 k 占 2k(入)/2k+1(出)，时间矩阵的节点处理时间为 0.01，金钱矩阵为节点处理成本
+    size = 2 * (parameters["center_num"] + parameters["station_num"])
+    node_cost = np.array([prop[2] for prop in center_prop] + [prop[2] for prop in station_prop], dtype=float)
+    k = np.arange(size // 2)
+    if large:
+        # 稀疏 CSR 矩阵，未存储的单元格表示没有边（稠密矩阵中为 inf），内存与边数成正比
+        from scipy.sparse import csr_matrix
+        rows = np.concatenate([2 * k, 2 * src_idx + 1])
+        cols = np.concatenate([2 * k + 1, 2 * dst_idx])
+        M = csr_matrix((np.concatenate([np.full(len(k), 0.01), time_cost]), (rows, cols)), shape=(size, size))
+        N = csr_matrix((np.concatenate([node_cost, money_cost]), (rows, cols)), shape=(size, size))
+    else:
+        M = np.full((size, size), np.inf)
+        N = np.full((size, size), np.inf)
+        M[2 * k, 2 * k + 1] = 0.01
+        N[2 * k, 2 * k + 1] = node_cost
+        M[2 * src_idx + 1, 2 * dst_idx] = time_cost
+        N[2 * src_idx + 1, 2 * dst_idx] = money_cost
 
-    # 添加节点处理成本
-    for i in range(parameters["center_num"]):
-        N[2*i][2*i+1] = center_prop[i][2]
-    for i in range(parameters["station_num"]):
-        N[2*i+2*parameters["center_num"]][2*i+2*parameters["center_num"]+1] = station_prop[i][2]
-
-    # Generate Packets
-    packets = []
-    src_prob = np.random.random(parameters["station_num"])
-    src_prob = src_prob / np.sum(src_prob)
-    dst_prob = np.random.random(parameters["station_num"])
-    dst_prob = dst_prob / np.sum(dst_prob)
-    # Package categories are defined here: 0 for Regular, 1 for Express
-    speed_prob = [0.7, 0.3]
-    
-    for i in range(parameters["packet_num"]):
-        src = np.random.choice(parameters["station_num"], p=src_prob)
-        dst = np.random.choice(parameters["station_num"], p=dst_prob)
-        while dst == src:
-            dst = np.random.choice(parameters["station_num"], p=dst_prob)
-        category = np.random.choice(2, p=speed_prob)
-        # Create time of the package, during 12 time ticks(hours)
-        create_time = np.random.random() * 12
-        packet_id = str(uuid.uuid4())
-        packets.append((packet_id, create_time, f"s{src}", f"s{dst}", category))
-
-    # Sort packets by create time
-    packets.sort(key=lambda x: x[1])
+    # Generate Packets（列式数组；小规模另提供元组列表以兼容现有调用方，大规模按需生成元组）
+    packet_arrays = generate_packet_arrays(parameters["packet_num"], parameters["station_num"])
+    packets = PacketRows(packet_arrays) if large else packet_tuples(packet_arrays)
 
     return {
         "station_pos": station_pos,
@@ -182,6 +226,7 @@ def data_gen() -> Dict[str, Any]:
         "center_prop": center_prop,
         "edges": edges,
         "packets": packets,
+        "packet_arrays": packet_arrays,
         "station_labels": station_labels.tolist(),
         "time_cost_matrix": M,
         "money_cost_matrix": N,
@@ -260,6 +305,11 @@ def format_data_for_api(data: Dict[str, Any]) -> Dict[str, Any]:
         "edges": edges,
         "packets": packets,
         "parameters": data["parameters"],
-        "timeCostMatrix": data["time_cost_matrix"].tolist(),
-        "moneyCostMatrix": data["money_cost_matrix"].tolist()
-    }
\ No newline at end of file
+        "timeCostMatrix": _matrix_list(data["time_cost_matrix"]),
+        "moneyCostMatrix": _matrix_list(data["money_cost_matrix"])
+    }
+
+
+def _matrix_list(matrix):
+    # 大规模模式的稀疏矩阵不展开为 N×N 列表（边已在 edges 中给出），返回 None
+    return None if hasattr(matrix, "tocsr") else matrix.tolist()
\ No newline at end of file
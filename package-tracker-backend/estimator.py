@@ -0,0 +1,294 @@
+"""
+排队网络快速估算：不做仿真，直接计算稳态的利用率、队长与端到端时延
+
+把网络看作开放排队网络（Jackson 网络的近似）：
+  - 节点：throughput 个并行处理位、每个包裹处理 delay 小时，即 M/D/c 队列；
+    快递优先（非抢占式优先级，Cobham 公式），确定性服务时间按 Allen-Cunneen 修正（等待时间减半）。
+  - 路线：纯延迟（无限服务台），行驶时间按仿真器的 0.1 h tick 计。
+  - 路由：与仿真器相同，快递走总时间最短、标准走总成本最低的路径（静态，不考虑拥堵改道）。
+  - 到达率：数据库中观测到的 (src, dst, category) 需求（个/小时）。
+
+对每个目的地 d，逐跳路由给出转移矩阵 P_d，流量方程 λ_d = γ_d + P_dᵀ λ_d 与
+时延方程 T_d = w + P_d (time + T_d) 都以批量 np.linalg.solve 一次求解。
+
+用法：GET /api/analytics/estimate；与仿真器对比：python estimator.py --validate
+"""
+
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+TICK = 0.1  # 仿真器的时间步长（小时）
+PRIORITY_FACTOR = 0.5  # Allen-Cunneen：(ca² + cs²) / 2，泊松到达、确定性服务
+
+
+def _ticks(duration: float) -> int:
+    # 仿真器中持续 duration 小时的处理/行驶所占的 tick 数（与 step() 的逐步递减一致）
+    k = 0
+    while duration > 0:
+        duration -= TICK
+        k += 1
+    return k
+
+
+def _node_order(node_id: str) -> Tuple[int, int]:
+    # 与成本矩阵相同的顺序：中心在前，站点在后
+    return (0 if node_id.startswith("c") else 1, int(node_id[1:]))
+
+
+def erlang_c(servers: np.ndarray, load: np.ndarray) -> np.ndarray:
+    """M/M/c 中到达需等待的概率，servers=c，load=λ/μ（向量化的 Erlang B 递推）"""
+    servers = np.asarray(servers, dtype=int)
+    load = np.asarray(load, dtype=float)
+    b = np.ones_like(load)
+    out = np.zeros_like(load)
+    for k in range(1, int(servers.max(initial=0)) + 1):
+        b = load * b / (k + load * b)
+        out = np.where(servers == k, b, out)
+    rho = np.divide(load, servers, out=np.ones_like(load), where=servers > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        c = out / (1.0 - rho * (1.0 - out))
+    return np.where(rho < 1.0, c, 1.0)
+
+
+class NetworkModel:
+    def __init__(self, nodes: Sequence[Tuple[str, int, float, float]],
+                 edges: Sequence[Tuple[str, str, float, float]]):
+        """nodes: (id, throughput, delay, cost)；edges: (src, dst, time_cost, money_cost)"""
+        nodes = sorted(nodes, key=lambda n: _node_order(n[0]))
+        self.ids = [n[0] for n in nodes]
+        self.index = {node_id: k for k, node_id in enumerate(self.ids)}
+        self.servers = np.array([int(n[1]) for n in nodes])
+        self.node_delay = np.array([float(n[2]) for n in nodes])
+        self.node_cost = np.array([float(n[3]) for n in nodes])
+        self.service = np.array([_ticks(d) * TICK for d in self.node_delay])  # 实际处理时长
+        n = len(self.ids)
+        self.edges = [(self.index[s], self.index[d], float(t), float(m)) for s, d, t, m in edges
+                      if s in self.index and d in self.index]
+        self.time = np.full((n, n), np.inf)
+        self.money = np.full((n, n), np.inf)
+        self.travel = np.zeros((n, n))
+        for u, v, t, m in self.edges:
+            self.time[u, v] = t
+            self.money[u, v] = m
+            self.travel[u, v] = _ticks(t) * TICK
+        # next_hop[c][d, v]：类别 c 的包裹从 v 前往 d 的下一跳（-1 不可达）
+        self.next_hop = {1: self._routing(self.time, 0.01), 0: self._routing(self.money, self.node_cost)}
+
+    @classmethod
+    def from_db(cls, db) -> "NetworkModel":
+        from sqlalchemy import select
+        from orm_models import NodeORM, EdgeORM
+        nodes = [(n.id, n.throughput, n.delay, n.cost) for n in db.execute(select(NodeORM)).scalars()]
+        edges = [(e.src_id, e.dst_id, e.time_cost, e.money_cost) for e in db.execute(select(EdgeORM)).scalars()]
+        return cls(nodes, edges)
+
+    @classmethod
+    def from_system_data(cls, system_data: Dict[str, Any]) -> "NetworkModel":
+        # format_data_for_api() 的输出
+        nodes = [(n["id"], n["throughput"], n["delay"], n["cost"])
+                 for n in system_data["stations"] + system_data["centers"]]
+        edges = [(e["src"], e["dst"], e["timeCost"], e["moneyCost"]) for e in system_data["edges"]]
+        return cls(nodes, edges)
+
+    def _routing(self, route_cost: np.ndarray, node_cost) -> np.ndarray:
+        # 经过节点 v 的代价加在进入 v 的边上；终点的代价对所有路径相同，不影响选择
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import dijkstra
+        n = len(self.ids)
+        rows, cols = np.nonzero(np.isfinite(route_cost))
+        weight = route_cost[rows, cols] + np.broadcast_to(node_cost, (n,))[cols]
+        reverse = csr_matrix((weight, (cols, rows)), shape=(n, n))  # 反向图：从 d 出发即得各点的下一跳
+        _, pred = dijkstra(reverse, indices=np.arange(n), return_predecessors=True)
+        return np.where(pred >= 0, pred, -1)
+
+    def transitions(self, category: int) -> np.ndarray:
+        """P[d, v, u] = 1 当类别 category 的包裹在 v 前往 d 时下一跳为 u（终点行为 0）"""
+        nxt = self.next_hop[category]
+        n = len(self.ids)
+        P = np.zeros((n, n, n))
+        d, v = np.nonzero(nxt >= 0)
+        P[d, v, nxt[d, v]] = 1.0
+        return P
+
+    def estimate(self, demand: np.ndarray) -> Dict[str, Any]:
+        """demand[c, s, d]：类别 c 从 s 到 d 的到达率（个/小时），索引同 self.ids"""
+        n = len(self.ids)
+        eye = np.eye(n)
+        flows, routes = {}, np.zeros((n, n))
+        processed = np.zeros((2, n))
+        P = {c: self.transitions(c) for c in (0, 1)}
+        for c in (0, 1):
+            gamma = demand[c].T  # [d, s]
+            # λ_d = γ_d + P_dᵀ λ_d，所有目的地一起求解
+            lam = np.linalg.solve(eye[None] - P[c].transpose(0, 2, 1), gamma[..., None])[..., 0]
+            flows[c] = lam
+            # 到达终点的包裹不再处理
+            processed[c] = lam.sum(axis=0) - np.diag(lam)
+            routes += np.einsum("dv,dvu->vu", lam, P[c])
+
+        # 节点：M/D/c，快递非抢占优先
+        total = processed.sum(axis=0)
+        offered = total * self.service
+        servers = np.maximum(self.servers, 1)
+        rho = offered / servers
+        rho_express = processed[1] * self.service / servers
+        base = PRIORITY_FACTOR * erlang_c(servers, offered) * self.service / servers
+        with np.errstate(divide="ignore", invalid="ignore"):
+            wait_express = np.where(rho_express < 1, base / (1 - rho_express), np.inf)
+            wait_standard = np.where(rho < 1, base / ((1 - rho_express) * (1 - rho)), np.inf)
+        wait_express = np.where(total > 0, wait_express, 0.0)
+        wait_standard = np.where(total > 0, wait_standard, 0.0)
+        waits = {1: wait_express, 0: wait_standard}
+
+        # 端到端时延：T_d = w + P_d (travel + T_d)，T_d[d] = 0；另加放入网络前等待的半个 tick
+        # 饱和节点的等待为 inf，不能直接代入求解（inf - inf 会让整个 T_d 变成 NaN）：
+        # 先以有限值求解，再把路径上经过饱和节点的 (v, d) 置为 inf。
+        # 经过的饱和节点数满足同样的方程 S_d = sat + P_d S_d（终点不处理，不计入）。
+        latency = {}
+        for c in (0, 1):
+            saturated = ~np.isfinite(waits[c])
+            b = (np.where(saturated, 0.0, waits[c]) + self.service)[None, :] + (P[c] * self.travel[None]).sum(axis=2)
+            b[np.arange(n), np.arange(n)] = 0.0
+            hits = np.broadcast_to(saturated.astype(float), (n, n)).copy()
+            hits[np.arange(n), np.arange(n)] = 0.0
+            T, S = np.moveaxis(np.linalg.solve(eye[None] - P[c], np.stack([b, hits], axis=-1)), -1, 0)  # [d, v]
+            T[(self.next_hop[c] < 0) | (S > 0.5)] = np.inf
+            T[np.arange(n), np.arange(n)] = 0.0
+            latency[c] = T.T + TICK / 2  # [s, d]
+
+        queue_express = processed[1] * wait_express
+        queue_standard = processed[0] * wait_standard
+        return {
+            "processed": processed, "utilization": rho,
+            "wait": waits, "queue": {1: queue_express, 0: queue_standard},
+            "in_service": offered, "route_flow": routes, "on_route": routes * self.travel,
+            "latency": latency,
+        }
+
+
+def observed_demand_matrix(db, model: NetworkModel, scale: float = 1.0) -> Tuple[np.ndarray, float]:
+    """数据库中包裹的 (category, src, dst) 到达率，按 create_time 的时间跨度折算为每小时"""
+    from sqlalchemy import func, select
+    from orm_models import PackageORM
+    n = len(model.ids)
+    demand = np.zeros((2, n, n))
+    t0, t1 = db.execute(select(func.min(PackageORM.create_time), func.max(PackageORM.create_time))).one()
+    rows = db.execute(
+        select(PackageORM.category, PackageORM.src, PackageORM.dst, func.count())
+        .group_by(PackageORM.category, PackageORM.src, PackageORM.dst)
+    ).all()
+    for category, src, dst, count in rows:
+        if src in model.index and dst in model.index and src != dst:
+            demand[int(bool(category)), model.index[src], model.index[dst]] += count
+    span = max(float(t1 - t0), 1.0) if t0 is not None else 1.0
+    return demand * (scale / span), span
+
+
+def _finite(x) -> Optional[float]:
+    return float(x) if np.isfinite(x) else None
+
+
+def report(model: NetworkModel, demand: np.ndarray, result: Dict[str, Any], congestion_limit: float = 30,
+           pairs: Optional[List[Tuple[int, int, int]]] = None) -> Dict[str, Any]:
+    """估算结果转换为 API 输出；pairs 缺省为有需求的 (category, src, dst)"""
+    ids = model.ids
+    if pairs is None:
+        pairs = list(zip(*np.nonzero(demand)))
+    nodes = []
+    for k, node_id in enumerate(ids):
+        nodes.append({
+            "id": node_id,
+            "arrivalRate": float(result["processed"][:, k].sum()),
+            "utilization": float(result["utilization"][k]),
+            "saturated": bool(result["utilization"][k] >= 1),
+            "waitExpress": _finite(result["wait"][1][k]),
+            "waitStandard": _finite(result["wait"][0][k]),
+            "queueLength": _finite(result["queue"][0][k] + result["queue"][1][k]),
+            "inService": float(result["in_service"][k]),
+        })
+    routes = []
+    for u, v, _, _ in model.edges:
+        on_route = float(result["on_route"][u, v])
+        routes.append({"src": ids[u], "dst": ids[v], "flow": float(result["route_flow"][u, v]),
+                       "onRoute": on_route, "congested": on_route > congestion_limit})
+    latency = [{"src": ids[s], "dst": ids[d], "category": int(c), "rate": float(demand[c, s, d]),
+                "expected": _finite(result["latency"][c][s, d])} for c, s, d in pairs]
+    return {"nodes": nodes, "routes": routes, "latency": latency}
+
+
+def validate(model: NetworkModel, demand: np.ndarray, hours: float = 200.0, warmup: float = 24.0,
+             seed: int = 0, sim=None) -> Dict[str, Any]:
+    """用相同网络与泊松需求运行仿真器，比较各类别的平均时延（只统计预热之后创建的包裹）"""
+    if sim is None:
+        import live_sim
+        sim = live_sim.load_simulator()
+    n = len(model.ids)
+    # 与仿真器相同布局的成本矩阵：节点 k 为 2k(in)/2k+1(out)
+    timecost = np.full((2 * n, 2 * n), np.inf)
+    moneycost = np.full((2 * n, 2 * n), np.inf)
+    timecost[2 * np.arange(n), 2 * np.arange(n) + 1] = 0.01
+    moneycost[2 * np.arange(n), 2 * np.arange(n) + 1] = model.node_cost
+    for u, v, t, m in model.edges:
+        timecost[2 * u + 1, 2 * v] = t
+        moneycost[2 * u + 1, 2 * v] = m
+    centers = [k for k, i in enumerate(model.ids) if i.startswith("c")]
+    stations = [k for k, i in enumerate(model.ids) if i.startswith("s")]
+    props = lambda ks: [(int(model.servers[k]), float(model.node_delay[k]), float(model.node_cost[k])) for k in ks]
+    edges = [(model.ids[u], model.ids[v], t, m) for u, v, t, m in model.edges]
+    topology = sim.Topology([(0, 0)] * len(stations), props(stations), [(0, 0)] * len(centers), props(centers),
+                            edges, timecost, moneycost)
+
+    rng = np.random.default_rng(seed)
+    rates = demand.ravel()
+    count = rng.poisson(rates.sum() * hours)
+    cells = rng.choice(rates.size, count, p=rates / rates.sum())
+    c, s, d = np.unravel_index(cells, demand.shape)
+    times = np.sort(rng.random(count) * hours)
+    packets = [(float(t), model.ids[a], model.ids[b], int(k)) for t, a, b, k in zip(times, s, d, c)]
+    env = sim.LogisticsEnv(topology, packets, congestion_limit=float("inf"))
+    while not env.done:
+        env.step()
+
+    result = model.estimate(demand)
+    out = {}
+    for k, name in ((0, "standard"), (1, "express")):
+        observed, expected = [], []
+        for p in env.packages.values():
+            if int(bool(p.category)) == k and p.time_created >= warmup:
+                observed.append(p.time_arrived - p.time_created)
+                expected.append(result["latency"][k][model.index[p.src], model.index[p.dst]])
+        out[name] = {"packages": len(observed), "simulated": float(np.mean(observed)),
+                     "estimated": float(np.mean(expected))}
+    return out
+
+
+if __name__ == "__main__":
+    import argparse
+    import contextlib
+    import io
+    from data_generator import data_gen, format_data_for_api
+
+    parser = argparse.ArgumentParser(description="Compare the queueing estimate with the simulator")
+    parser.add_argument("--validate", action="store_true")
+    parser.add_argument("--rate", type=float, default=20.0, help="packages per hour")
+    parser.add_argument("--hours", type=float, default=200.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        raw = data_gen()
+    model = NetworkModel.from_system_data(format_data_for_api(raw))
+    demand = np.zeros((2, len(model.ids), len(model.ids)))
+    for _, _, src, dst, category in raw["packets"]:
+        demand[int(category), model.index[src], model.index[dst]] += 1
+    demand *= args.rate / demand.sum()
+    t = time.perf_counter()
+    result = model.estimate(demand)
+    print(f"estimate: {1000 * (time.perf_counter() - t):.1f} ms, "
+          f"max utilization {result['utilization'].max():.2f}")
+    if args.validate:
+        for name, row in validate(model, demand, args.hours, seed=args.seed).items():
+            print(f"{name}: {row['packages']} packages, simulated {row['simulated']:.2f} h, "
+                  f"estimated {row['estimated']:.2f} h")
@@ -0,0 +1,205 @@
+"""
+仿真器 -> 数据库的批量事件通道
+
+EventExporter 在内存中缓冲仿真事件，由一个写线程以批量 executemany、
+每批一个事务的方式写入 history_events（及 packages 的状态）。生产者
+（仿真线程）只把批次放入有界队列；数据库跟不上时队列满，submit() 阻塞，
+仿真随之放慢（背压），内存不会无限增长。
+
+两种用法：
+  - 作为 RetentionPolicy 的 store：LogisticsEnv 在包裹送达/移除时调用
+    append(package)，完整历史被转换为事件行（需要完整历史，不能设 history_limit）：
+        exporter = EventExporter()
+        env = LogisticsEnv(topology, packets, retention=RetentionPolicy(summarize=True, store=exporter))
+        ...
+        exporter.close()
+  - 增量写入（live_sim）：submit(rows=..., stays=..., statuses=...) 按提交顺序执行。
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam
+
+from db import engine as default_engine
+from orm_models import PackageORM, HistoryEventORM
+
+logger = logging.getLogger(__name__)
+
+CREATED_ACTION = "Colis créé"
+ARRIVED_ACTION = "Arrivé"
+DELIVERED_ACTION = "Livré"
+
+
+def history_rows(package) -> List[Dict[str, Any]]:
+    """把仿真器 Package 的历史转换为 history_events 行。
+
+    每到达一个节点一行（起点为创建事件），stay_duration 为到达与下一次从该节点
+    出发（SENT）之间的时间，尚未离开的节点为 NULL。
+    """
+    package_id = str(package.id)
+    rows = [{"package_id": package_id, "timestamp": round(float(package.time_created), 4),
+             "location": package.src, "action": CREATED_ACTION, "stay_duration": None}]
+    for t, location, event in package.history:
+        if event.startswith("SENT"):
+            rows[-1]["stay_duration"] = round(float(t) - rows[-1]["timestamp"], 4)
+        elif event.startswith("ARRIVED"):
+            node = location.split("->", 1)[1]  # ARRIVED 记录在路线上
+            rows.append({"package_id": package_id, "timestamp": round(float(t), 4), "location": node,
+                         "action": DELIVERED_ACTION if node == package.dst else ARRIVED_ACTION,
+                         "stay_duration": None})
+    return rows
+
+
+class EventExporter:
+    def __init__(self, engine=None, batch_size: int = 5000, max_batches: int = 8, retries: int = 3,
+                 flush_interval: float = 1.0):
+        """
+        batch_size: append() 累积这么多行后交给写线程
+        flush_interval: flush() 只在距上次交付超过这么多秒时交付不满一批的行
+        max_batches: 等待写入的批次上限，超过后生产者阻塞（背压）
+        retries: 写入失败（如 SQLite 被锁）时的重试次数，之后丢弃该批并记录日志
+        """
+        self.engine = engine if engine is not None else default_engine
+        self.batch_size = batch_size
+        self.retries = retries
+        self.queue: "queue.Queue" = queue.Queue(maxsize=max_batches)
+        self.buffer: List[Dict[str, Any]] = []
+        self.flush_interval = flush_interval
+        self.last_handoff = time.monotonic()
+        self.lock = threading.Lock()  # 保护 buffer，append() 可能来自多个线程
+        self.rows_written = 0
+        self.batches_written = 0
+        self.batches_failed = 0
+        self.rows_dropped = 0
+        self.stalled_seconds = 0.0  # 生产者因队列满而等待的总时间
+        self.closed = False
+        self.thread = threading.Thread(target=self._writer, name="event-bridge", daemon=True)
+        self.thread.start()
+
+    # ---- 生产者 ----
+
+    def append(self, package) -> None:
+        """RetentionPolicy store 接口：一个送达/被移除的包裹"""
+        self.add_rows(history_rows(package))
+
+    def add_rows(self, rows: Iterable[Dict[str, Any]]) -> None:
+        with self.lock:
+            self.buffer.extend(rows)
+            if len(self.buffer) < self.batch_size:
+                return
+            rows, self.buffer = self.buffer, []
+        self.submit(rows=rows)
+
+    def flush(self, force: bool = False) -> None:
+        """把缓冲的行交给写线程（不等待写入完成）。
+        LogisticsEnv 每次移除包裹后都会调用，不满一批时只按 flush_interval 交付，避免大量小事务。
+        """
+        with self.lock:
+            if not force and time.monotonic() - self.last_handoff < self.flush_interval:
+                return
+            rows, self.buffer = self.buffer, []
+        if rows:
+            self.submit(rows=rows)
+
+    def submit(self, rows: Optional[List[Dict[str, Any]]] = None, stays: Optional[List[Dict[str, Any]]] = None,
+               statuses: Optional[List[Dict[str, Any]]] = None) -> None:
+        """一个批次，在一个事务内依次执行：
+          stays:    {"pid", "stay"}，回填该包裹 stay_duration 为 NULL 的事件
+          rows:     history_events 新行
+          statuses: {"pid", "new_status", "loc"}，更新包裹状态与当前位置
+        队列满时阻塞，直到写线程赶上。
+        """
+        if self.closed:
+            raise RuntimeError("exporter is closed")
+        if not (rows or stays or statuses):
+            return
+        batch = (stays or [], rows or [], statuses or [])
+        self.last_handoff = time.monotonic()
+        try:
+            self.queue.put_nowait(batch)
+        except queue.Full:
+            t = time.perf_counter()
+            self.queue.put(batch)
+            self.stalled_seconds += time.perf_counter() - t
+
+    def join(self) -> None:
+        """写入所有已提交的事件后返回"""
+        self.flush(force=True)
+        self.queue.join()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.join()
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queuedBatches": self.queue.qsize(),
+            "rowsWritten": self.rows_written,
+            "batchesWritten": self.batches_written,
+            "batchesFailed": self.batches_failed,
+            "rowsDropped": self.rows_dropped,
+            "stalledSeconds": round(self.stalled_seconds, 3),
+        }
+
+    # ---- 写线程 ----
+
+    def _writer(self) -> None:
+        while True:
+            batch = self.queue.get()
+            try:
+                if batch is None:
+                    return
+                for attempt in range(self.retries + 1):
+                    try:
+                        self._write(*batch)
+                        break
+                    except Exception:
+                        if attempt == self.retries:
+                            self._drop(*batch)
+                        else:
+                            time.sleep(0.1 * 2 ** attempt)
+            finally:
+                self.queue.task_done()
+
+    def _drop(self, stays, rows, statuses) -> None:
+        # 重试用尽：记录被丢弃批次的内容，这些包裹在数据库中的历史不完整
+        self.batches_failed += 1
+        self.rows_dropped += len(rows)
+        package_ids = sorted({r["package_id"] for r in rows} | {s["pid"] for s in stays} | {s["pid"] for s in statuses})
+        logger.exception(
+            f"Dropped a batch after {self.retries + 1} attempts: {len(rows)} events, {len(stays)} stay updates, "
+            f"{len(statuses)} status updates, {len(package_ids)} packages "
+            f"({', '.join(package_ids[:5])}{', ...' if len(package_ids) > 5 else ''})"
+        )
+
+    def _write(self, stays, rows, statuses) -> None:
+        events = HistoryEventORM.__table__
+        packages = PackageORM.__table__
+        with self.engine.begin() as conn:
+            if stays:
+                # 先回填再插入本批的新事件：每个包裹同一时刻只有一条 NULL 事件
+                conn.execute(
+                    events.update()
+                    .where(events.c.package_id == bindparam("pid"), events.c.stay_duration.is_(None))
+                    .values(stay_duration=bindparam("stay")),
+                    stays,
+                )
+            if rows:
+                conn.execute(events.insert(), rows)
+            if statuses:
+                conn.execute(
+                    packages.update()
+                    .where(packages.c.id == bindparam("pid"))
+                    .values(status=bindparam("new_status"), current_location=bindparam("loc")),
+                    statuses,
+                )
+        self.rows_written += len(rows)
+        self.batches_written += 1
@@ -0,0 +1,278 @@
+"""
+实时仿真：在后端后台运行仓库根目录 main.py 中的 LogisticsEnv
+
+一个 asyncio 后台任务按 speed（每真实秒推进的仿真小时数）推进仿真时钟，
+1/3600 即真实时间。每一步都在唯一的工作线程中执行，事件循环只负责定时，
+因此仿真不会阻塞请求处理。
+
+包裹（启动时数据库中的包裹、/api/packages/schedule 新建的包裹）在仿真时钟
+到达其 create_time 时进入网络。仿真中的到达/送达写入 history_events，
+离开节点时回填上一条事件的 stay_duration，停留时长因此反映真实的排队与处理。
+事件在内存中累积，按批交给 event_bridge.EventExporter 写入数据库；数据库跟不上时
+仿真线程在交付时阻塞，仿真时钟随之放慢（见 lagTicks）。
+
+环境变量：
+    LIVE_SIM=0            关闭实时仿真（回退到按最优路径随机生成历史）
+    LIVE_SIM_SPEED        每真实秒推进的仿真小时数，默认 0.1（1 tick/秒）
+    LOGISTICS_SIM_PATH    仿真器 main.py（或其所在目录）的路径，默认为后端的上级目录
+"""
+
+import asyncio
+import heapq
+import importlib.util
+import logging
+import os
+import queue
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import delete, select, update
+
+from db import SessionLocal
+from event_bridge import ARRIVED_ACTION, CREATED_ACTION, DELIVERED_ACTION, EventExporter
+from orm_models import PackageORM, HistoryEventORM
+
+logger = logging.getLogger(__name__)
+
+TICK_HOURS = 0.1  # LogisticsEnv.step() 推进 0.1 仿真小时
+
+
+def load_simulator(path: Optional[str] = None):
+    """以模块名 logistics_sim 导入仿真器（后端自身已有 main 模块），找不到时返回 None"""
+    if "logistics_sim" in sys.modules:
+        return sys.modules["logistics_sim"]
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    candidates = [path, os.environ.get("LOGISTICS_SIM_PATH"), os.path.dirname(backend_dir)]
+    for candidate in candidates:
+        if not candidate:
+            continue
+        if os.path.isdir(candidate):
+            candidate = os.path.join(candidate, "main.py")
+        if not os.path.isfile(candidate) or os.path.dirname(os.path.abspath(candidate)) == backend_dir:
+            continue
+        spec = importlib.util.spec_from_file_location("logistics_sim", candidate)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["logistics_sim"] = module
+        try:
+            spec.loader.exec_module(module)
+        except Exception:
+            del sys.modules["logistics_sim"]
+            logger.exception(f"Failed to import simulator from {candidate}")
+            return None
+        module.VERBOSE = False
+        return module
+    return None
+
+
+def enabled() -> bool:
+    return os.environ.get("LIVE_SIM", "1") != "0" and load_simulator() is not None
+
+
+def build_topology(sim, raw_data: Dict[str, Any]):
+    """由后端 data_gen() 的输出构建仿真器的 Topology（矩阵布局相同：中心在前，站点在后）"""
+    matrices = [raw_data["time_cost_matrix"], raw_data["money_cost_matrix"]]
+    # 大规模网络的稀疏矩阵原样传入，仿真器直接支持
+    matrices = [m if sim.is_sparse(m) else np.array(m, dtype=float) for m in matrices]
+    return sim.Topology(
+        raw_data["station_pos"], raw_data["station_prop"],
+        raw_data["center_pos"], raw_data["center_prop"], raw_data["edges"], *matrices,
+    )
+
+
+class LiveSimulator:
+    """后台驱动的 LogisticsEnv，只在 self.executor 的唯一线程中访问 env"""
+
+    def __init__(self, raw_data: Dict[str, Any], speed: Optional[float] = None,
+                 batch_size: int = 500, flush_interval: float = 1.0, max_ticks_per_call: int = 50):
+        sim = load_simulator()
+        if sim is None:
+            raise RuntimeError("simulator main.py not found, set LOGISTICS_SIM_PATH")
+
+        class LiveEnv(sim.LogisticsEnv):
+            def finished(self):
+                # 时钟一直走：随时可能有新包裹
+                return False
+
+        # 送达 1 仿真小时后从内存中移除，节点/路线只保留最近的记录，长时间运行内存不增长（记录已在数据库中）
+        retention = sim.RetentionPolicy(history_limit=64, summarize=True, evict_after=1.0)
+        self.env = LiveEnv(build_topology(sim, raw_data), retention=retention)
+        self.env.track_changes()
+        self.version = self.env.diff_since()["version"]
+        self.speed = float(speed if speed is not None else os.environ.get("LIVE_SIM_SPEED", 0.1))
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_ticks_per_call = max_ticks_per_call
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="live-sim")
+        self.task: Optional[asyncio.Task] = None
+
+        self.inbox: "queue.SimpleQueue" = queue.SimpleQueue()  # 请求线程 -> 仿真线程
+        self.pending: List[tuple] = []  # (create_time, id, src, dst, category) 堆，等待时钟到达
+        self.where: Dict[str, str] = {}  # 包裹 id -> 所在节点/路线
+        self.since: Dict[str, float] = {}  # 包裹 id -> 到达当前节点的时间
+        # 待写入数据库的批次
+        self.rows: List[Dict[str, Any]] = []
+        self.open_rows: Dict[str, Dict[str, Any]] = {}  # 尚未写入、stay_duration 未定的事件
+        self.stays: List[Dict[str, Any]] = []
+        self.statuses: Dict[str, tuple] = {}
+        self.last_flush = time.monotonic()
+        self.exporter = EventExporter()
+        self.lag_ticks = 0
+
+    # ---- 请求线程调用 ----
+
+    def schedule(self, package_id: str, create_time: float, src: str, dst: str, category: int) -> None:
+        """新包裹交给仿真（线程安全，下一次推进时生效）"""
+        self.inbox.put((float(create_time), package_id, src, dst, int(category)))
+
+    def status(self) -> Dict[str, Any]:
+        env = self.env
+        return {
+            "running": self.task is not None and not self.task.done(),
+            "simTime": round(env.TimeTick, 4),
+            "speed": self.speed,
+            "inNetwork": len(self.where),
+            "pending": len(self.pending) + self.inbox.qsize(),
+            "eventsWritten": self.exporter.rows_written,
+            "lagTicks": self.lag_ticks,
+            "bridge": self.exporter.stats(),
+        }
+
+    # ---- 仿真线程 ----
+
+    def adopt_packages(self) -> None:
+        """接管数据库中已有的包裹：时钟从 0 开始，重建它们的历史"""
+        with SessionLocal() as db:
+            db.execute(delete(HistoryEventORM).where(HistoryEventORM.action != CREATED_ACTION))
+            db.execute(update(HistoryEventORM).values(stay_duration=None))
+            db.execute(update(PackageORM).values(status="created", current_location=PackageORM.src))
+            db.commit()
+            for pkg in db.execute(select(PackageORM)).scalars():
+                heapq.heappush(self.pending, (float(pkg.create_time), pkg.id, pkg.src, pkg.dst, int(pkg.category)))
+        self.release()
+        self.collect()
+
+    def release(self) -> None:
+        # 收取新包裹，时钟已到达 create_time 的进入网络
+        while True:
+            try:
+                heapq.heappush(self.pending, self.inbox.get_nowait())
+            except queue.Empty:
+                break
+        env = self.env
+        while self.pending and self.pending[0][0] <= env.TimeTick + 1e-9:
+            create_time, package_id, src, dst, category = heapq.heappop(self.pending)
+            try:
+                env.add_package(package_id, create_time, src, dst, category)
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Package {package_id} ({src}->{dst}) not simulated: {e}")
+                continue
+            # "Colis créé" 事件已由调用方写入，离开起点时回填其停留时长
+            self.where[package_id] = src
+            self.since[package_id] = create_time
+
+    def collect(self) -> None:
+        """把自上次以来位置变化的包裹转换为事件"""
+        diff = self.env.diff_since(self.version)
+        self.version = diff["version"]
+        now = round(diff["time"], 4)
+        for package_id, (location, state) in diff["packages"].items():
+            previous = self.where.get(package_id)
+            if previous == location or previous is None:
+                continue  # 节点内排队 -> 处理，或刚进入网络
+            self.where[package_id] = location
+            if "->" in location:
+                self.close_stay(package_id, now)
+                self.statuses[package_id] = ("in_transit", previous)
+                continue
+            delivered = state == "done"
+            row = {
+                "package_id": package_id, "timestamp": now, "location": location,
+                "action": DELIVERED_ACTION if delivered else ARRIVED_ACTION, "stay_duration": None,
+            }
+            self.rows.append(row)
+            self.open_rows[package_id] = row
+            self.since[package_id] = now
+            self.statuses[package_id] = ("delivered" if delivered else "in_transit", location)
+        for package_id in diff["removed"]:
+            self.where.pop(package_id, None)
+            self.since.pop(package_id, None)
+            self.open_rows.pop(package_id, None)
+
+    def close_stay(self, package_id: str, now: float) -> None:
+        stay = round(now - self.since.get(package_id, now), 4)
+        row = self.open_rows.pop(package_id, None)
+        if row is not None:
+            row["stay_duration"] = stay  # 还在本批次中，直接填写
+        else:
+            self.stays.append({"pid": package_id, "stay": stay})
+
+    def fork(self):
+        """(仿真时间, 状态快照, 尚未进入网络的包裹)，供 what-if 仿真从当前状态出发"""
+        self.release()
+        arrivals = sorted(self.pending)
+        return self.env.TimeTick, self.env.snapshot(), [(t, src, dst, category) for t, _, src, dst, category in arrivals]
+
+    def advance(self, ticks: int) -> None:
+        for _ in range(ticks):
+            self.env.step()
+            self.release()
+            self.collect()
+        pending = len(self.rows) + len(self.stays) + len(self.statuses)
+        if pending >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """把累积的事件作为一个批次交给写线程（回填停留时长、新事件、包裹状态）"""
+        rows, stays, statuses = self.rows, self.stays, self.statuses
+        self.rows, self.stays, self.statuses = [], [], {}
+        self.open_rows = {}  # 交付后只能通过 UPDATE 回填
+        self.last_flush = time.monotonic()
+        self.exporter.submit(
+            rows=rows, stays=stays,
+            statuses=[{"pid": pid, "new_status": s, "loc": loc} for pid, (s, loc) in statuses.items()],
+        )
+
+    # ---- 事件循环 ----
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        seconds_per_tick = TICK_HOURS / self.speed
+        due = loop.time()
+        while True:
+            ticks = max(1, int((loop.time() - due) / seconds_per_tick) + 1)
+            if ticks > self.max_ticks_per_call:
+                # 跟不上：仿真时钟放慢，而不是无限积压
+                self.lag_ticks += ticks - self.max_ticks_per_call
+                ticks = self.max_ticks_per_call
+                due = loop.time()
+            try:
+                await loop.run_in_executor(self.executor, self.advance, ticks)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Live simulation step failed")
+            due += ticks * seconds_per_tick
+            await asyncio.sleep(max(0.0, due - loop.time()))
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.adopt_packages)
+        self.task = asyncio.create_task(self.run())
+        logger.info(f"Live simulation started at {self.speed} sim-hours per second")
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        # 等待进行中的一步结束，再写入剩余事件
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.flush)
+        self.executor.shutdown(wait=True)
+        await asyncio.to_thread(self.exporter.close)
@@ -17,7 +17,8 @@ from data_generator import data_gen, format_data_for_api, parameters
 from path_calculator import PathCalculator
 from models import (
     SystemData, PathRequest, PathResult, PackageSearchRequest,
-    PackageUpdateRequest, PackageScheduleRequest, PackageBatchRequest, SystemStats, Package, PathInfo
+    PackageUpdateRequest, PackageScheduleRequest, PackageBatchRequest, SystemStats, Package, PathInfo,
+    WhatIfRequest
 )
 from db import SessionLocal, init_db
 from orm_models import (
@@ -27,6 +28,10 @@ from orm_models import (
 from db import engine
 from sqlalchemy import text, func
 import random
+import time
+import live_sim
+import whatif
+import estimator
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -52,6 +57,9 @@ app.add_middleware(
 current_system_data = None
 path_calculator = None
 current_snapshot_id = None
+current_raw_data = None
+live_simulator = None  # live_sim.LiveSimulator，LIVE_SIM=0 或找不到仿真器时为 None
+whatif_runner = whatif.WhatIfRunner()
 
 
 @contextmanager
@@ -83,26 +91,45 @@ def orm_package_to_dict(p: PackageORM) -> Dict[str, Any]:
         ],
     }
 
+def _path_calculator(raw_data):
+    """稠密成本矩阵时创建路径计算器；大规模模式的稀疏矩阵不做 Bellman-Ford，返回 None"""
+    matrices = (raw_data["time_cost_matrix"], raw_data["money_cost_matrix"])
+    if any(hasattr(m, "tocsr") for m in matrices):
+        return None
+    return PathCalculator(*(np.array(m) for m in matrices))
+
+def _matrix_checksum(matrix) -> str:
+    """成本矩阵的 md5；稀疏矩阵按 CSR 的 data/indices/indptr 计算"""
+    import hashlib
+    if hasattr(matrix, "tocsr"):
+        csr = matrix.tocsr()
+        parts = (csr.data, csr.indices, csr.indptr)
+    else:
+        parts = (np.array(matrix),)
+    digest = hashlib.md5()
+    for part in parts:
+        digest.update(np.ascontiguousarray(part).tobytes())
+    return digest.hexdigest()
+
 def initialize_system():
     """初始化系统数据、路径计算器，并持久化拓扑与快照"""
-    global current_system_data, path_calculator, current_snapshot_id
+    global current_system_data, path_calculator, current_snapshot_id, current_raw_data
     try:
         raw_data = data_gen()
+        current_raw_data = raw_data
         current_system_data = format_data_for_api(raw_data)
 
-        # 创建路径计算器
-        time_cost_matrix = np.array(raw_data["time_cost_matrix"])
-        money_cost_matrix = np.array(raw_data["money_cost_matrix"])
-        path_calculator = PathCalculator(time_cost_matrix, money_cost_matrix)
+        # 创建路径计算器（大规模模式下为 None）
+        path_calculator = _path_calculator(raw_data)
 
         # 写入或复用数据库拓扑与包裹
         init_db()
         from sqlalchemy import select
-        import json, hashlib
+        import json
         with get_db() as db:
             # 创建系统快照
-            time_checksum = hashlib.md5(time_cost_matrix.tobytes()).hexdigest()
-            money_checksum = hashlib.md5(money_cost_matrix.tobytes()).hexdigest()
+            time_checksum = _matrix_checksum(raw_data["time_cost_matrix"])
+            money_checksum = _matrix_checksum(raw_data["money_cost_matrix"])
             snapshot = SystemSnapshotORM(
                 station_num=parameters["station_num"],
                 center_num=parameters["center_num"],
@@ -122,6 +149,9 @@ def initialize_system():
                     cols = [r[1] for r in conn.execute(text("PRAGMA table_info('history_events')")).fetchall()]
                     if 'stay_duration' not in cols:
                         conn.execute(text("ALTER TABLE history_events ADD COLUMN stay_duration REAL"))
+                    # 按包裹回填 stay_duration（event_bridge）需要该索引，旧库中补建
+                    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_history_events_package_id ON history_events (package_id)"))
+                    conn.commit()
             except Exception:
                 # 非关键，继续初始化
                 pass
@@ -160,6 +190,7 @@ def initialize_system():
             if not pkg_exists:
                 packages = []
                 histories = []
+                live = live_sim.enabled()
                 for packet in current_system_data["packets"]:
                     # persist package
                     packages.append(PackageORM(
@@ -167,6 +198,13 @@ def initialize_system():
                         dst=packet["dst"], category=packet["category"], status=packet["status"],
                         current_location=packet["currentLocation"],
                     ))
+                    if live:
+                        # 之后的历史由实时仿真写入（见 live_sim.py）
+                        histories.append(HistoryEventORM(
+                            package_id=packet["id"], timestamp=float(packet["createTime"]),
+                            location=packet["src"], action="Colis créé", stay_duration=None
+                        ))
+                        continue
 
                     # 生成更完整的历史事件：基于路径计算器推断经过的节点、每段旅行时间与停留时间
                     try:
@@ -243,6 +281,36 @@ async def startup_event():
     success = initialize_system()
     if not success:
         logger.error("Failed to initialize system on startup")
+        return
+    await start_live_simulation()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop_live_simulation()
+    whatif_runner.close()
+
+
+async def start_live_simulation():
+    """在后台启动实时仿真（接管数据库中的包裹），不可用时保持原有行为"""
+    global live_simulator
+    if current_raw_data is None or not live_sim.enabled():
+        logger.info("Live simulation disabled")
+        return
+    try:
+        live_simulator = live_sim.LiveSimulator(current_raw_data)
+        await live_simulator.start()
+    except Exception as e:
+        logger.error(f"Failed to start live simulation: {e}")
+        logger.error(traceback.format_exc())
+        live_simulator = None
+
+
+async def stop_live_simulation():
+    global live_simulator
+    if live_simulator is not None:
+        await live_simulator.stop()
+        live_simulator = None
 
 @app.get("/", tags=["系统"])
 async def root():
@@ -259,7 +327,7 @@ async def health_check():
     """健康检查端点"""
     try:
         # 检查系统是否初始化
-        if current_system_data is None or path_calculator is None:
+        if current_system_data is None:
             return JSONResponse(
                 status_code=503,
                 content={"status": "unhealthy", "message": "System not initialized"}
@@ -271,7 +339,7 @@ async def health_check():
             "timestamp": "2025-09-29",
             "components": {
                 "system_data": "ok" if current_system_data is not None else "error",
-                "path_calculator": "ok" if path_calculator is not None else "error"
+                "path_calculator": "ok" if path_calculator is not None else "disabled"
             }
         }
     except Exception as e:
@@ -342,18 +410,18 @@ async def get_system_stats():
 @app.post("/api/system/regenerate", tags=["系统"])
 async def regenerate_system():
     """重新生成系统数据（新快照），保留已有节点/边，更新包裹与快照"""
-    global current_system_data, path_calculator, current_snapshot_id
+    global current_system_data, path_calculator, current_snapshot_id, current_raw_data
+    # 旧网络上的仿真不能再写入即将删除的包裹
+    await stop_live_simulation()
     try:
         raw_data = data_gen()
+        current_raw_data = raw_data
         current_system_data = format_data_for_api(raw_data)
-        path_calculator = PathCalculator(
-            np.array(raw_data["time_cost_matrix"]),
-            np.array(raw_data["money_cost_matrix"]),
-        )
+        path_calculator = _path_calculator(raw_data)
 
         init_db()
         from sqlalchemy import select, delete
-        import json, hashlib
+        import json
         with get_db() as db:
             # 旧快照标记不再 active
             if current_snapshot_id is not None:
@@ -362,8 +430,8 @@ async def regenerate_system():
                     snap.active = False
 
             # 新快照
-            time_checksum = hashlib.md5(np.array(raw_data["time_cost_matrix"]).tobytes()).hexdigest()
-            money_checksum = hashlib.md5(np.array(raw_data["money_cost_matrix"]).tobytes()).hexdigest()
+            time_checksum = _matrix_checksum(raw_data["time_cost_matrix"])
+            money_checksum = _matrix_checksum(raw_data["money_cost_matrix"])
             new_snap = SystemSnapshotORM(
                 station_num=parameters["station_num"],
                 center_num=parameters["center_num"],
@@ -383,12 +451,20 @@ async def regenerate_system():
 
             packages = []
             histories = []
+            live = live_sim.enabled()
             for packet in current_system_data["packets"]:
                 packages.append(PackageORM(
                     id=packet["id"], create_time=packet["createTime"], src=packet["src"],
                     dst=packet["dst"], category=packet["category"], status=packet["status"],
                     current_location=packet["currentLocation"],
                 ))
+                if live:
+                    # 之后的历史由实时仿真写入（见 live_sim.py）
+                    histories.append(HistoryEventORM(
+                        package_id=packet["id"], timestamp=float(packet["createTime"]),
+                        location=packet["src"], action="Colis créé", stay_duration=None
+                    ))
+                    continue
 
                 # 为每个包裹生成基于路径的历史事件（到达时间 + 停留）
                 try:
@@ -445,6 +521,7 @@ async def regenerate_system():
                 # 非关键失败：记录并继续
                 logger.exception('Failed to update package current_location from histories')
 
+        await start_live_simulation()
         return {"message": "系统数据已重新生成", "snapshotId": current_snapshot_id}
     except Exception as e:
         logger.error(f"Error regenerating system: {e}")
@@ -933,6 +1010,9 @@ async def schedule_package(req: PackageScheduleRequest):
     import uuid, time
     packet_id = str(uuid.uuid4())
     create_time = float(req.sendTime)
+    if live_simulator is not None:
+        # 实时仿真不会回到过去：早于当前仿真时钟的包裹按当前时刻创建，数据库与仿真保持一致
+        create_time = max(create_time, float(live_simulator.env.TimeTick))
 
     from sqlalchemy import select
     with get_db() as db:
@@ -954,10 +1034,13 @@ async def schedule_package(req: PackageScheduleRequest):
                 timestamp=create_time,
                 location=req.src,
                 action="Colis créé",
-                stay_duration=float(random.uniform(0.05, 0.5)),
+                # 实时仿真在包裹离开起点时回填
+                stay_duration=None if live_simulator is not None else float(random.uniform(0.05, 0.5)),
             )
         )
         db.commit()
+        if live_simulator is not None:
+            live_simulator.schedule(packet_id, create_time, req.src, req.dst, req.category)
         # 转换返回
         d = orm_package_to_dict(pkg)
         try:
@@ -970,6 +1053,72 @@ async def schedule_package(req: PackageScheduleRequest):
         return d
 
 
+@app.get("/api/simulate/live", tags=["系统"])
+async def get_live_simulation():
+    """实时仿真状态：仿真时钟、速度、网络中的包裹数、已写入的事件数"""
+    if live_simulator is None:
+        return {"running": False}
+    return live_simulator.status()
+
+
+@app.post("/api/simulate/whatif", tags=["系统"])
+async def simulate_whatif(req: WhatIfRequest):
+    """What-if 仿真：从当前包裹状态出发运行 runs 份扰动副本，返回各类别送达时间与成本的分布"""
+    if current_raw_data is None:
+        raise HTTPException(status_code=500, detail="系统未初始化")
+    if live_sim.load_simulator() is None:
+        raise HTTPException(status_code=503, detail="仿真器不可用")
+    node_ids = {n["id"] for n in current_system_data["stations"] + current_system_data["centers"]}
+    for closure in req.closures:
+        if closure.node not in node_ids:
+            raise HTTPException(status_code=400, detail=f"未知节点: {closure.node}")
+    for surge in req.surges:
+        unknown = set(surge.stations or ()) - {s["id"] for s in current_system_data["stations"]}
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"未知站点: {sorted(unknown)}")
+
+    simulator, raw_data = live_simulator, current_raw_data
+
+    def load_base():
+        # 在工作线程中调用：实时仿真的当前状态，或数据库中的包裹
+        if simulator is not None:
+            return whatif.live_base(simulator)
+        return whatif.db_base(raw_data)
+
+    return await whatif_runner.estimate(req.model_dump(), current_snapshot_id, load_base)
+
+
+@app.get("/api/analytics/estimate", tags=["系统"])
+async def estimate_network(
+    scale: float = Query(1.0, gt=0, description="观测需求的倍数"),
+    rate: Optional[float] = Query(None, gt=0, description="总到达率（个/小时），缺省为观测值 × scale"),
+    src: Optional[str] = Query(None, description="只返回该起点的时延"),
+    dst: Optional[str] = Query(None, description="只返回该终点的时延"),
+    category: Optional[int] = Query(None, description="只返回该类别的时延 (0=标准, 1=快递)"),
+    congestion_limit: float = Query(30, description="路线上包裹数超过该值视为拥堵"),
+):
+    """排队网络估算：不运行仿真，返回节点利用率/队长、路线流量与各 (起点, 终点, 类别) 的期望送达时间"""
+    t = time.perf_counter()
+    with get_db() as db:
+        model = estimator.NetworkModel.from_db(db)
+        if not model.ids:
+            raise HTTPException(status_code=500, detail="系统未初始化")
+        demand, span = estimator.observed_demand_matrix(db, model, scale)
+    for node_id in (src, dst):
+        if node_id is not None and node_id not in model.index:
+            raise HTTPException(status_code=400, detail=f"未知节点: {node_id}")
+    if rate is not None and demand.sum() > 0:
+        demand *= rate / demand.sum()
+    result = model.estimate(demand)
+    pairs = [(c, s, d) for c, s, d in zip(*np.nonzero(demand))
+             if (src is None or model.ids[s] == src) and (dst is None or model.ids[d] == dst)
+             and (category is None or c == category)]
+    out = estimator.report(model, demand, result, congestion_limit, pairs)
+    out["totalRate"] = float(demand.sum())
+    out["observedHours"] = span
+    out["elapsedMs"] = round(1000 * (time.perf_counter() - t), 2)
+    return out
+
 @app.post("/api/packages/batch", tags=["包裹"])
 async def get_packages_batch(req: PackageBatchRequest):
     """批量获取多个包裹，按传入顺序返回。"""
@@ -2,7 +2,7 @@
 FastAPI数据模型定义
 """
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 
@@ -97,6 +97,29 @@ class PackageScheduleRequest(BaseModel):
     category: int = 0  # 0 标准 1 快递
     sendTime: float = 0.0  # 仿真时间(小时), 默认为0
 
+class Closure(BaseModel):
+    """节点关闭：从 start 小时后起关闭 duration 小时（相对当前仿真时间）"""
+    node: str
+    start: float = Field(0.0, ge=0)
+    duration: float = Field(..., gt=0)
+
+class Surge(BaseModel):
+    """需求激增：窗口内需求乘以 factor，stations 为空表示所有站点"""
+    factor: float = Field(2.0, ge=1)
+    start: float = Field(0.0, ge=0)
+    duration: float = Field(..., gt=0)
+    stations: Optional[List[str]] = None
+
+class WhatIfRequest(BaseModel):
+    """What-if 仿真请求"""
+    closures: List[Closure] = []
+    surges: List[Surge] = []
+    runs: int = Field(20, ge=1, le=200)  # 蒙特卡洛副本数
+    horizon: float = Field(24.0, gt=0, le=168)  # 仿真小时数
+    jitter: float = Field(0.1, ge=0, le=1)  # 路线行驶时间的对数正态扰动
+    seed: int = 0
+    baseline: bool = True  # 同时运行无情景的基线（相同随机数）
+
 class PackageBatchRequest(BaseModel):
     """批量查询包裹请求"""
     ids: List[str]
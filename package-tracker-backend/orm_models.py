@@ -29,7 +29,7 @@ class HistoryEventORM(Base):
     __tablename__ = "history_events"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    package_id: Mapped[str] = mapped_column(String, ForeignKey("packages.id", ondelete="CASCADE"))
+    package_id: Mapped[str] = mapped_column(String, ForeignKey("packages.id", ondelete="CASCADE"), index=True)
     timestamp: Mapped[float] = mapped_column(Float, index=True)
     location: Mapped[str] = mapped_column(String, index=True)
     action: Mapped[str] = mapped_column(Text)
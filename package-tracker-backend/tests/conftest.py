@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 追加而非插入：顶层的 main 仍指向仿真器，后端模块按名字导入
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,51 @@
+import contextlib
+import io
+
+import numpy as np
+
+import data_generator
+import live_sim
+from data_generator import PacketRows, data_gen, format_data_for_api, packet_tuples
+
+
+def _generate(monkeypatch, large):
+    monkeypatch.setitem(data_generator.parameters, "large", large)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return data_gen()
+
+
+def test_format_data_for_api_dense(monkeypatch):
+    raw = _generate(monkeypatch, False)
+    data = format_data_for_api(raw)
+    assert np.array_equal(np.array(data["timeCostMatrix"]), raw["time_cost_matrix"])
+    assert len(data["edges"]) == len(raw["edges"])
+
+
+def test_format_data_for_api_sparse(monkeypatch):
+    raw = _generate(monkeypatch, True)
+    assert hasattr(raw["time_cost_matrix"], "tocsr")
+    data = format_data_for_api(raw)
+    # 稀疏矩阵不展开；边与包裹照常输出
+    assert data["timeCostMatrix"] is None and data["moneyCostMatrix"] is None
+    assert len(data["edges"]) == len(raw["edges"])
+    assert len(data["packets"]) == data_generator.parameters["packet_num"]
+
+
+def test_large_packets_are_lazy_rows(monkeypatch):
+    raw = _generate(monkeypatch, True)
+    assert isinstance(raw["packets"], PacketRows)
+    monkeypatch.setattr(PacketRows, "chunk", 7)
+    expected = packet_tuples(raw["packet_arrays"])
+    assert list(raw["packets"]) == expected
+    assert list(raw["packets"]) == expected  # 可重复迭代
+
+
+def test_route_arrays_match_the_simulator():
+    sim = live_sim.load_simulator()
+    rng = np.random.default_rng(0)
+    stations = [tuple(p) for p in rng.integers(0, 101, size=(200, 2)).tolist()]
+    centers = [tuple(p) for p in rng.integers(0, 101, size=(6, 2)).tolist()]
+    labels = rng.integers(0, 6, size=200)
+    ours = data_generator.route_arrays(centers, stations, labels)
+    theirs = sim.route_arrays(centers, stations, labels)
+    assert all(np.array_equal(a, b) for a, b in zip(ours, theirs))
@@ -0,0 +1,43 @@
+import numpy as np
+
+from estimator import NetworkModel
+
+
+def _model():
+    # s1 -> c1 -> s2 经过中心；s3 -> s4 直达，与 c1 无关
+    nodes = [("s1", 10, 0.1, 1.0), ("s2", 10, 0.1, 1.0), ("s3", 10, 0.1, 1.0), ("s4", 10, 0.1, 1.0),
+             ("c1", 1, 1.0, 1.0)]
+    edges = [("s1", "c1", 1.0, 1.0), ("c1", "s2", 1.0, 1.0), ("s3", "s4", 1.0, 1.0)]
+    return NetworkModel(nodes, edges)
+
+
+def test_saturated_node_only_blocks_paths_through_it():
+    model = _model()
+    i = model.index
+    demand = np.zeros((2, 5, 5))
+    demand[0, i["s1"], i["s2"]] = 2.0  # c1 的标准负载 rho = 2
+    demand[0, i["s3"], i["s4"]] = 1.0
+    demand[1, i["s3"], i["s4"]] = 0.5
+    result = model.estimate(demand)
+
+    assert result["utilization"][i["c1"]] >= 1
+    standard, express = result["latency"][0], result["latency"][1]
+    assert not np.isnan(standard).any() and not np.isnan(express).any()
+    assert standard[i["s1"], i["s2"]] == np.inf
+    assert standard[i["c1"], i["s2"]] == np.inf
+    # 从饱和节点出发之前的一跳不受影响：s1 -> c1 只在 s1 处理
+    assert np.isfinite(standard[i["s1"], i["c1"]])
+    assert np.isfinite(standard[i["s3"], i["s4"]])
+    assert np.isfinite(express[i["s3"], i["s4"]])
+    assert standard[i["s2"], i["s1"]] == np.inf  # 不可达
+
+
+def test_unsaturated_latency_matches_path_sum():
+    model = _model()
+    i = model.index
+    demand = np.zeros((2, 5, 5))
+    demand[0, i["s3"], i["s4"]] = 1.0
+    result = model.estimate(demand)
+    wait = result["wait"][0][i["s3"]]
+    expected = wait + model.service[i["s3"]] + model.travel[i["s3"], i["s4"]] + 0.05
+    assert np.isclose(result["latency"][0][i["s3"], i["s4"]], expected)
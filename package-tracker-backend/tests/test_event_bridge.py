@@ -0,0 +1,102 @@
+import contextlib
+import io
+import logging
+import random
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, select
+
+import live_sim
+import orm_models  # noqa: F401 表定义
+from db import Base
+from event_bridge import ARRIVED_ACTION, CREATED_ACTION, DELIVERED_ACTION, EventExporter, history_rows
+from orm_models import HistoryEventORM, PackageORM
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'events.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+def _run(sim, retention=None):
+    # 小网络上运行到所有包裹送达
+    sim.VERBOSE = False
+    random.seed(0)
+    np.random.seed(0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        topology, packets = sim.make_network(dict(sim.parameters, packet_num=200))
+    env = sim.LogisticsEnv(topology, packets, retention=retention)
+    while not env.done:
+        env.step()
+    return env
+
+
+def _events(engine):
+    events = HistoryEventORM.__table__
+    with engine.connect() as conn:
+        rows = conn.execute(select(events.c.package_id, events.c.timestamp, events.c.location,
+                                   events.c.action, events.c.stay_duration)).all()
+    return sorted(tuple(r) for r in rows)
+
+
+def test_history_rows_follow_the_route():
+    env = _run(live_sim.load_simulator())
+    for package in env.packages.values():
+        rows = history_rows(package)
+        assert rows[0]["action"] == CREATED_ACTION and rows[0]["location"] == package.src
+        assert rows[-1]["action"] == DELIVERED_ACTION and rows[-1]["location"] == package.dst
+        assert all(r["action"] == ARRIVED_ACTION for r in rows[1:-1])
+        assert len(rows) == package.hops + 1
+        # 除终点外每个节点都有停留时间
+        assert all(r["stay_duration"] is not None for r in rows[:-1]) and rows[-1]["stay_duration"] is None
+        assert [r["timestamp"] for r in rows] == sorted(r["timestamp"] for r in rows)
+
+
+def test_exporter_writes_every_delivered_package(engine):
+    sim = live_sim.load_simulator()
+    expected = sorted((r["package_id"], r["timestamp"], r["location"], r["action"], r["stay_duration"])
+                      for p in _run(sim).packages.values() for r in history_rows(p))
+    exporter = EventExporter(engine, batch_size=100, flush_interval=0.0)
+    _run(sim, sim.RetentionPolicy(summarize=True, store=exporter))
+    exporter.close()
+    # 包裹 id 在两次运行中不同，按内容比较
+    strip = lambda rows: sorted(r[1:] for r in rows)
+    assert strip(_events(engine)) == strip(expected)
+    assert exporter.rows_written == len(expected)
+    assert exporter.batches_written > 1 and exporter.batches_failed == 0
+
+
+def test_submit_backfills_stays_and_statuses(engine):
+    with engine.begin() as conn:
+        conn.execute(PackageORM.__table__.insert(), [{"id": "p1", "create_time": 0.0, "src": "s1", "dst": "s2",
+                                                      "category": 0, "status": "created", "current_location": "s1"}])
+    exporter = EventExporter(engine, batch_size=10)
+    exporter.submit(rows=[{"package_id": "p1", "timestamp": 0.0, "location": "s1", "action": CREATED_ACTION,
+                           "stay_duration": None}])
+    exporter.submit(stays=[{"pid": "p1", "stay": 1.5}],
+                    rows=[{"package_id": "p1", "timestamp": 2.0, "location": "c0", "action": ARRIVED_ACTION,
+                           "stay_duration": None}],
+                    statuses=[{"pid": "p1", "new_status": "in_transit", "loc": "c0"}])
+    exporter.close()
+    assert _events(engine) == [("p1", 0.0, "s1", CREATED_ACTION, 1.5), ("p1", 2.0, "c0", ARRIVED_ACTION, None)]
+    with engine.connect() as conn:
+        assert tuple(conn.execute(select(PackageORM.status, PackageORM.current_location)).one()) == ("in_transit", "c0")
+
+
+def test_dropped_batch_is_logged(tmp_path, caplog):
+    engine = create_engine(f"sqlite:///{tmp_path / 'empty.db'}")  # 没有建表，写入必然失败
+    exporter = EventExporter(engine, retries=1)
+    rows = [{"package_id": f"p{k}", "timestamp": 0.0, "location": "s1", "action": CREATED_ACTION,
+             "stay_duration": None} for k in range(7)]
+    with caplog.at_level(logging.ERROR, logger="event_bridge"):
+        exporter.submit(rows=rows, stays=[{"pid": "p0", "stay": 1.0}])
+        exporter.close()
+    assert exporter.batches_failed == 1 and exporter.rows_dropped == 7
+    assert exporter.stats()["rowsDropped"] == 7
+    message = " ".join(r.getMessage() for r in caplog.records)
+    assert "7 events" in message and "1 stay updates" in message and "7 packages" in message
+    engine.dispose()
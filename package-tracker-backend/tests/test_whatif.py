@@ -0,0 +1,26 @@
+import contextlib
+import io
+import pickle
+
+import data_generator
+import live_sim
+import whatif
+from data_generator import data_gen
+
+
+def test_run_copy_closure_on_sparse_matrices(monkeypatch):
+    monkeypatch.setitem(data_generator.parameters, "large", True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        raw = data_gen()
+    sim = live_sim.load_simulator()
+    topology = live_sim.build_topology(sim, raw)
+    assert sim.is_sparse(topology.timecost)
+    known = sorted((float(p[1]), p[2], p[3], int(p[4])) for p in raw["packets"])[:50]
+    demand = {"rate": 5.0, "src": {"s1": 1}, "dst": {"s2": 1}, "express": 0.5}
+    scenario = {"closures": [{"node": "c1", "start": 0.0, "duration": 2.0}], "surges": [],
+                "horizon": 4.0, "jitter": 0.0}
+    before = topology.timecost.copy()
+    result = whatif.run_copy(pickle.dumps((topology, None, known)), scenario, demand, 0, True)
+    assert set(result) == set(whatif.CATEGORIES)
+    # 关闭结束后代价恢复；副本修改的是反序列化后的矩阵
+    assert (topology.timecost != before).nnz == 0
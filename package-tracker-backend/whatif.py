@@ -0,0 +1,273 @@
+"""
+What-if 仿真：节点关闭、需求激增时送达时间与成本的蒙特卡洛估计
+
+从当前包裹状态（实时仿真的快照；未运行实时仿真时为数据库中的包裹）出发，
+在进程池中运行 N 份带扰动的仿真副本：每份副本重新抽样背景需求（按观测到的
+需求泊松到达），并给每条路线的行驶时间乘以一个对数正态因子。基线副本使用
+相同的随机数但不施加情景，两者之差只来自情景本身。
+
+关闭的节点不处理包裹（吞吐为 0，到达的包裹排队等待），路由代价加上一个
+很大的惩罚，因此只有别无他路时才会经过它。成本按节点/路线的基础价格计算。
+
+结果按情景哈希缓存：同一网络上、计算开始后 max_age 秒（真实时间，WHATIF_CACHE_SECONDS，
+默认 60）内，相同的请求直接返回缓存（并发的相同请求共享同一次计算）。按仿真时钟计龄不可行：
+默认速度下半个仿真小时只有 5 秒，与一次计算的耗时相当。
+"""
+
+import asyncio
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import pickle
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+
+import live_sim
+from db import SessionLocal
+from orm_models import PackageORM
+
+CLOSED_PENALTY = 1e6  # 加在关闭节点 in->out 代价上（有限值：路由表的边集合不变）
+CATEGORIES = {0: "standard", 1: "express"}
+
+
+def scenario_hash(scenario: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(scenario, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def observed_demand() -> Dict[str, Any]:
+    """数据库中包裹的到达率（个/小时）与 src/dst/类别分布"""
+    with SessionLocal() as db:
+        n, t0, t1 = db.execute(
+            select(func.count(), func.min(PackageORM.create_time), func.max(PackageORM.create_time))
+        ).one()
+        src = dict(db.execute(select(PackageORM.src, func.count()).group_by(PackageORM.src)).all())
+        dst = dict(db.execute(select(PackageORM.dst, func.count()).group_by(PackageORM.dst)).all())
+        express = db.execute(select(func.count()).where(PackageORM.category == 1)).scalar()
+    if not n:
+        return {"rate": 0.0, "src": {}, "dst": {}, "express": 0.0}
+    span = max(float(t1 - t0), 1.0)
+    return {"rate": n / span, "src": src, "dst": dst, "express": express / n}
+
+
+def sample_arrivals(rng, demand: Dict[str, Any], start: float, end: float, factor: float = 1.0,
+                    stations: Optional[List[str]] = None) -> List[tuple]:
+    """[start, end) 内的泊松到达 (create_time, src, dst, category)，stations 限定起点"""
+    src_ids = list(demand["src"])
+    weights = np.array([demand["src"][s] for s in src_ids], dtype=float)
+    if stations is not None:
+        keep = [i for i, s in enumerate(src_ids) if s in stations]
+        share = weights[keep].sum() / weights.sum() if weights.sum() else 0.0
+        src_ids, weights = [src_ids[i] for i in keep], weights[keep]
+        if not src_ids:  # 没有观测到的需求，均匀分布在这些站点上
+            src_ids, weights, share = list(stations), np.ones(len(stations)), len(stations) / max(len(demand["src"]), 1)
+        rate = demand["rate"] * share
+    else:
+        rate = demand["rate"]
+    dst_ids = list(demand["dst"])
+    n = rng.poisson(rate * factor * max(end - start, 0.0)) if src_ids and len(dst_ids) > 1 else 0
+    if n == 0:
+        return []
+    dst_p = np.array([demand["dst"][d] for d in dst_ids], dtype=float)
+    dst_p /= dst_p.sum()
+    src_ids, dst_ids = np.array(src_ids), np.array(dst_ids)
+    src = src_ids[rng.choice(len(src_ids), n, p=weights / weights.sum())]
+    dst = dst_ids[rng.choice(len(dst_ids), n, p=dst_p)]
+    same = src == dst
+    while same.any():
+        dst[same] = dst_ids[rng.choice(len(dst_ids), int(same.sum()), p=dst_p)]
+        same = src == dst
+    times = start + rng.random(n) * (end - start)
+    express = rng.random(n) < demand["express"]
+    return [(float(t), str(s), str(d), int(c)) for t, s, d, c in zip(times, src, dst, express)]
+
+
+def _init_worker(sim_path: str) -> None:
+    live_sim.load_simulator(sim_path)
+
+
+def _package_cost(env, package) -> float:
+    cost = 0.0
+    for _, location, event in package.history:
+        if event.startswith("PROCESSING"):
+            cost += env.nodes[location].cost
+        elif event.startswith("ARRIVED"):
+            cost += env.route_at(location).cost
+    return cost
+
+
+def run_copy(payload: bytes, scenario: Dict[str, Any], demand: Dict[str, Any], seed: int,
+             apply_scenario: bool) -> Dict[int, Dict[str, Any]]:
+    """一份仿真副本（在工作进程中运行），返回每个类别的送达时间、成本与未送达数"""
+    sim = live_sim.load_simulator()
+    topology, state, known = pickle.loads(payload)
+    start = state["TimeTick"] if state is not None else 0.0
+    end = start + scenario["horizon"]
+
+    # 背景需求与行驶时间扰动只依赖 seed，基线与情景副本相同
+    arrivals = list(known) + sample_arrivals(np.random.default_rng([seed, 0]), demand, start, end)
+    closures = []
+    if apply_scenario:
+        rng = np.random.default_rng([seed, 1])
+        for surge in scenario["surges"]:
+            t = start + surge["start"]
+            arrivals += sample_arrivals(rng, demand, t, min(t + surge["duration"], end),
+                                        surge["factor"] - 1.0, surge["stations"])
+        for closure in scenario["closures"]:
+            t = start + closure["start"]
+            closures += [(t, 1, closure["node"]), (t + closure["duration"], -1, closure["node"])]
+    arrivals.sort()
+    closures.sort(key=lambda c: (c[0], -c[1]))
+
+    env = sim.LogisticsEnv(topology)
+    if state is not None:
+        env.load_state(state)
+        env.delivered.clear()  # 实时仿真等待移除的包裹；这里不移除（开始前已送达的不计入结果）
+    env.stream = sim.PacketStream(arrivals)
+    rng = np.random.default_rng([seed, 2])
+    for route in env.routes.values():
+        route.time *= float(rng.lognormal(0.0, scenario["jitter"])) if scenario["jitter"] else 1.0
+
+    closed = {}  # 节点 -> (关闭层数, 原吞吐)
+    while env.TimeTick < end - 1e-9 and not env.finished():
+        while closures and closures[0][0] <= env.TimeTick + 1e-9:
+            _, change, node_id = closures.pop(0)
+            node = env.nodes[node_id]
+            k = env.topology.index(node_id)
+            depth, throughput = closed.get(node_id, (0, node.throughput))
+            depth += change
+            if change > 0 and depth == 1:
+                node.throughput = 0
+                env.timecost[k, k + 1] += CLOSED_PENALTY
+                env.moneycost[k, k + 1] += CLOSED_PENALTY
+            elif change < 0 and depth == 0:
+                node.throughput = throughput
+                env.timecost[k, k + 1] -= CLOSED_PENALTY
+                env.moneycost[k, k + 1] -= CLOSED_PENALTY
+                node.process_packages(env.TimeTick)
+            closed[node_id] = (depth, throughput)
+            for table in env.forwarding.values():
+                table.invalidate()
+        env.step()
+
+    out = {c: {"times": [], "costs": [], "undelivered": 0} for c in CATEGORIES}
+    for package in env.packages.values():
+        stats = out[int(bool(package.category))]
+        if not package.done:
+            stats["undelivered"] += 1
+        elif package.time_arrived > start + 1e-9:  # 开始前已送达的不计
+            stats["times"].append(package.time_arrived - package.time_created)
+            stats["costs"].append(_package_cost(env, package))
+    return out
+
+
+def _distribution(values: List[float], run_means: List[float]) -> Dict[str, Any]:
+    if not values:
+        return {"mean": None, "p50": None, "p90": None, "p95": None, "runMeans": run_means}
+    p50, p90, p95 = np.percentile(values, [50, 90, 95])
+    return {"mean": float(np.mean(values)), "p50": float(p50), "p90": float(p90), "p95": float(p95),
+            "runMeans": run_means}
+
+
+def summarize(results: List[Dict[int, Dict[str, Any]]]) -> Dict[str, Any]:
+    """把各副本的结果合并为每个类别的分布（百分位数基于所有副本的全部包裹）"""
+    summary = {}
+    for c, name in CATEGORIES.items():
+        runs = [r[c] for r in results]
+        times = [t for r in runs for t in r["times"]]
+        costs = [x for r in runs for x in r["costs"]]
+        summary[name] = {
+            "delivered": float(np.mean([len(r["times"]) for r in runs])),
+            "undelivered": float(np.mean([r["undelivered"] for r in runs])),
+            "deliveryTime": _distribution(times, [float(np.mean(r["times"])) if r["times"] else None for r in runs]),
+            "cost": _distribution(costs, [float(np.mean(r["costs"])) if r["costs"] else None for r in runs]),
+        }
+    return summary
+
+
+async def live_base(simulator) -> Tuple[float, bytes]:
+    """实时仿真的当前状态（在仿真线程中取快照）"""
+    loop = asyncio.get_running_loop()
+    start, state, known = await loop.run_in_executor(simulator.executor, simulator.fork)
+    topology = simulator.env.topology
+    return start, await asyncio.to_thread(pickle.dumps, (topology, state, known), pickle.HIGHEST_PROTOCOL)
+
+
+async def db_base(raw_data: Dict[str, Any]) -> Tuple[float, bytes]:
+    """未运行实时仿真时：时钟为 0，数据库中的包裹按 create_time 进入网络"""
+    def build():
+        sim = live_sim.load_simulator()
+        with SessionLocal() as db:
+            rows = db.execute(select(PackageORM.create_time, PackageORM.src, PackageORM.dst, PackageORM.category)).all()
+        known = sorted((float(t), src, dst, int(c)) for t, src, dst, c in rows)
+        topology = live_sim.build_topology(sim, raw_data)
+        return pickle.dumps((topology, None, known), pickle.HIGHEST_PROTOCOL)
+    return 0.0, await asyncio.to_thread(build)
+
+
+class WhatIfRunner:
+    def __init__(self, workers: Optional[int] = None, cache_size: int = 64, max_age: Optional[float] = None):
+        self.workers = workers or int(os.environ.get("WHATIF_WORKERS", 0)) or os.cpu_count() or 1
+        self.cache_size = cache_size
+        self.max_age = max_age if max_age is not None else float(os.environ.get("WHATIF_CACHE_SECONDS", 60))  # 秒
+        self.cache: "OrderedDict[str, tuple]" = OrderedDict()  # hash -> (网络, 开始计算的 monotonic 时间, task)
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    def executor(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            sim = live_sim.load_simulator()
+            if sim is None:
+                raise RuntimeError("simulator main.py not found, set LOGISTICS_SIM_PATH")
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=mp.get_context("spawn"),
+                initializer=_init_worker, initargs=(sim.__file__,),
+            )
+        return self.pool
+
+    async def estimate(self, scenario: Dict[str, Any], network: Any,
+                       load_base: Callable[[], Awaitable[Tuple[float, bytes]]]) -> Dict[str, Any]:
+        key = scenario_hash(scenario)
+        entry = self.cache.get(key)
+        now = time.monotonic()
+        cached = entry is not None and entry[0] == network and now - entry[1] <= self.max_age
+        if cached:
+            self.cache.move_to_end(key)
+            task = entry[2]
+        else:
+            task = asyncio.ensure_future(self._compute(scenario, load_base))
+            self.cache[key] = (network, now, task)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        try:
+            result = await asyncio.shield(task)
+        except Exception:
+            if self.cache.get(key, (None, None, None))[2] is task:
+                del self.cache[key]
+            raise
+        return {"scenarioHash": key, "cached": cached, **result}
+
+    async def _compute(self, scenario: Dict[str, Any],
+                       load_base: Callable[[], Awaitable[Tuple[float, bytes]]]) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        (start, payload), demand = await asyncio.gather(load_base(), asyncio.to_thread(observed_demand))
+        pool = self.executor()
+        seeds = [scenario["seed"] * 100003 + i for i in range(scenario["runs"])]
+        jobs = [loop.run_in_executor(pool, run_copy, payload, scenario, demand, s, True) for s in seeds]
+        if scenario["baseline"]:
+            jobs += [loop.run_in_executor(pool, run_copy, payload, scenario, demand, s, False) for s in seeds]
+        results = await asyncio.gather(*jobs)
+        out = {"startTime": round(start, 4), "runs": scenario["runs"], "horizon": scenario["horizon"],
+               "byCategory": summarize(results[:len(seeds)])}
+        if scenario["baseline"]:
+            out["baseline"] = summarize(results[len(seeds):])
+        return out
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
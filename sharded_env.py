@@ -0,0 +1,332 @@
+"""
+ShardedLogisticsEnv: one network simulated by several processes.
+
+data_gen clusters stations around centers (KMeans), a center and its stations
+form a region. Regions are spread over shards, one process each. A shard steps
+its own nodes and the routes ending in them. A package taking a route into
+another shard travels as a message: the sending shard sets it aside at
+departure, the receiving shard puts it on the route with the delay it has left.
+
+Shards run `window` ticks between synchronisations, window being the shortest
+travel time of a route between shards, so every message reaches its shard
+before it is due (conservative time windows). Besides airlines, roads between
+nearby stations of different regions also cross shards; regions joined by a
+route too short for a one-tick window are kept in the same shard.
+
+Packages always spend the exact travel time on every route. Congestion flips
+are exchanged at every synchronisation, so a shard sees the congestion of the
+other shards' routes up to one window late and routing decisions can differ
+from those of a single LogisticsEnv.
+"""
+
+import contextlib
+import multiprocessing as mp
+import os
+
+import numpy as np
+
+import main
+from main import LogisticsEnv, Route, VehicleRoute, travel_ticks
+
+
+def regions(topology):
+    # node id -> region, the index of the center owning the node (see data_gen)
+    region = {f"c{i}": i for i in range(topology.center_num)}
+    for src, dst, _, _ in topology.edges:
+        if src.startswith("c") and dst.startswith("s"):
+            region[dst] = int(src[1:])
+    for j in range(topology.station_num):
+        region.setdefault(f"s{j}", 0)  # a station without a highway
+    return region
+
+
+def partition(topology, shards):
+    """Assign every node to a shard, returns ({node id: shard}, number of shards).
+
+    Regions are never split. Regions joined by a zero-tick route are merged, then
+    the groups are spread over the shards, largest first onto the least loaded.
+    """
+    region = regions(topology)
+    parent = list(range(max(topology.center_num, 1)))
+
+    def find(r):
+        while parent[r] != r:
+            parent[r] = parent[parent[r]]
+            r = parent[r]
+        return r
+
+    for src, dst, time, _ in topology.edges:
+        a, b = find(region[src]), find(region[dst])
+        if a != b and travel_ticks(time) < 1:
+            parent[a] = b
+    groups = {}
+    for node_id, r in region.items():
+        groups.setdefault(find(r), []).append(node_id)
+    shards = max(1, min(shards, len(groups)))
+    load = [0] * shards
+    owner = {}
+    for members in sorted(groups.values(), key=len, reverse=True):
+        k = load.index(min(load))
+        load[k] += len(members)
+        for node_id in members:
+            owner[node_id] = k
+    return owner, shards
+
+
+class OutboxRoute(Route):
+    # A route into another shard: departing packages are set aside for the
+    # receiving shard instead of being queued, see ShardEnv.take_outbox()
+    def __init__(self, route):
+        self.__dict__.update(route.__dict__)
+        self.outbox = []
+
+    def add_package(self, package, now=0.0):
+        self.history.append(package.id)
+        package.location = self.id
+        package.delay = self.time
+        self.outbox.append(package)
+
+
+class ShardEnv(LogisticsEnv):
+    """The part of the network simulated by one shard.
+
+    Observation layout and route indices are those of the full network, entries
+    of other shards stay 0, so the observations of all shards add up to the
+    observation of the whole network.
+    """
+    def __init__(self, topology, packets, owner, shard, **kwargs):
+        super().__init__(topology, packets, **kwargs)
+        self.owner = owner
+        self.shard = shard
+        self.outboxes = []
+        for key, route in self.routes.items():
+            src, dst = key
+            if owner[src] == shard and owner[dst] != shard:
+                if isinstance(route, VehicleRoute):
+                    route.outbox = []  # vehicles leave from here and travel in the other shard
+                else:
+                    self.routes[key] = OutboxRoute(route)
+                self.outboxes.append(self.routes[key])
+        self.bind_observation()
+        # step() only walks what this shard simulates; route_list keeps every route
+        self.nodes = {node_id: node for node_id, node in self.nodes.items() if owner[node_id] == shard}
+        self.routes = {key: route for key, route in self.routes.items()
+                       if owner[key[0]] == shard or owner[key[1]] == shard}
+        self.vehicle_routes = [route for route in self.vehicle_routes if (route.src, route.dst) in self.routes]
+        self.flips = {}
+        self.add_cost_listener(self.collect_flips)
+
+    def finished(self):
+        # The coordinator decides when the whole network is done
+        return False
+
+    def idle(self):
+        return self.stream.exhausted and all(package.done for package in self.packages.values()) \
+            and not any(route.outbox for route in self.outboxes)
+
+    def collect_flips(self, routes):
+        # Congestion flips of the routes this shard queues, to be sent to the others
+        for route in routes:
+            if self.owner[route.dst] == self.shard:
+                self.flips[route.index] = route.congested
+
+    def take_flips(self):
+        flips = list(self.flips.items())
+        self.flips = {}
+        return flips
+
+    def apply_flips(self, flips):
+        # Congestion of routes queued by other shards, patched into the cost matrices
+        for r, congested in flips:
+            route = self.route_list[r]
+            if route.congested != congested:
+                route.congested = congested
+                self.dirty_routes[(route.src, route.dst)] = route
+        self.update_distance()
+
+    def take_outbox(self):
+        # {shard: [(route index, package or vehicle)]} of what left this shard, in departure order
+        out = {}
+        for route in self.outboxes:
+            for item in route.outbox:
+                for package in (item[2] if isinstance(route, VehicleRoute) else (item,)):
+                    del self.packages[package.id]
+                out.setdefault(self.owner[route.dst], []).append((route.index, item))
+            route.outbox = []
+        return out
+
+    def receive(self, messages):
+        # Put packages sent by other shards on their route, keeping the delay they have left
+        for r, item in messages:
+            route = self.route_list[r]
+            if isinstance(route, VehicleRoute):
+                for package in item[2]:
+                    self.packages[package.id] = package
+                route.receive(item)
+                continue
+            delay = item.delay
+            self.packages[item.id] = item
+            route.add_package(item)
+            item.delay = delay
+
+
+def _shard_worker(conn, topology, packets, owner, shard, env_kwargs, quiet):
+    if quiet:
+        main.VERBOSE = False
+    out = open(os.devnull, "w") if quiet else None
+    with contextlib.redirect_stdout(out) if quiet else contextlib.nullcontext():
+        env = ShardEnv(topology, packets, owner, shard, **env_kwargs)
+        conn.send(env.get_load().copy())
+
+        while True:
+            cmd, arg = conn.recv()
+            if cmd == "window":
+                steps, actions, flips, inbox = arg
+                env.apply_flips(flips)
+                env.receive(inbox)
+                reward = 0.0
+                for i in range(steps):
+                    _, r = env.step(actions if i == 0 else None)
+                    reward += r
+                conn.send({
+                    "obs": env.get_load().copy(),
+                    "reward": reward,
+                    "time": env.TimeTick,
+                    "outbox": env.take_outbox(),
+                    "flips": env.take_flips(),
+                    "idle": env.idle(),
+                })
+            elif cmd == "packages":
+                conn.send(env.packages)
+            elif cmd == "close":
+                conn.send("ok")
+                break
+
+    if out is not None:
+        out.close()
+    conn.close()
+
+
+class ShardedLogisticsEnv:
+    def __init__(self, topology, packets=(), shards=None, max_window=50, start_method=None,
+                 quiet=True, **env_kwargs):
+        """
+        topology: network to simulate (see main.make_network)
+        packets: (create_time, src, dst, category) sorted by create time, split by source shard
+        shards: number of shard processes, defaults to cpu_count (at most one per region)
+        max_window: upper bound of the synchronisation window, in ticks
+        quiet: silence the simulator's prints inside the workers
+        env_kwargs: passed on to every LogisticsEnv (congestion_limit, queue_discipline, ...)
+        """
+        self.topology = topology
+        self.owner, self.num_shards = partition(topology, shards or os.cpu_count() or 1)
+        cross = [travel_ticks(time) for src, dst, time, _ in topology.edges
+                 if self.owner[src] != self.owner[dst]]
+        self.window = max(1, min(cross + [max_window]))
+        self.route_index = {(src, dst): r for r, (src, dst, _, _) in enumerate(topology.edges)}
+        self.route_shard = [self.owner[src] for src, _, _, _ in topology.edges]
+
+        per_shard = [[] for _ in range(self.num_shards)]
+        for packet in packets:
+            per_shard[self.owner[packet[1]]].append(packet)
+
+        ctx = mp.get_context(start_method)
+        self._conns = []
+        self._procs = []
+        for k in range(self.num_shards):
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(
+                target=_shard_worker,
+                args=(child_conn, topology, per_shard[k], self.owner, k, env_kwargs, quiet),
+                daemon=True,
+            )
+            proc.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._procs.append(proc)
+        self.obs = sum(conn.recv() for conn in self._conns)
+        self.inboxes = [[] for _ in range(self.num_shards)]
+        self.flips = []
+        self.TimeTick = 0.0
+        self.done = False
+        self.closed = False
+
+    def route_indices(self, actions):
+        # Flagged route indices out of any actions form accepted by LogisticsEnv.step()
+        if isinstance(actions, (set, frozenset)):
+            indices = set()
+            for key in actions:
+                if isinstance(key, str):
+                    key = tuple(key.split('->'))
+                indices.add(self.route_index[key] if isinstance(key, tuple) else int(key))
+            return sorted(indices)
+        actions = np.asarray(actions)
+        if actions.dtype != np.bool_:
+            actions = actions == 1
+        return np.flatnonzero(actions).tolist()
+
+    def step(self, actions=None):
+        """Advance every shard by one window (self.window ticks).
+
+        actions: as in LogisticsEnv.step(), applied at the first tick of the window
+        by the shard holding the source node of each flagged route.
+        Returns (obs, reward summed over the ticks of the window). done is only checked
+        at the end of a window, so TimeTick can pass the last delivery by up to a window.
+        """
+        if self.done:
+            return self.obs, 0.0
+        per_shard = [set() for _ in range(self.num_shards)]
+        if actions is not None:
+            for r in self.route_indices(actions):
+                per_shard[self.route_shard[r]].add(r)
+        for k, conn in enumerate(self._conns):
+            conn.send(("window", (self.window, per_shard[k], self.flips, self.inboxes[k])))
+        reports = [conn.recv() for conn in self._conns]
+
+        self.inboxes = [[] for _ in range(self.num_shards)]
+        self.flips = []
+        for report in reports:
+            for k, messages in report["outbox"].items():
+                self.inboxes[k].extend(messages)
+            self.flips.extend(report["flips"])
+        self.obs = sum(report["obs"] for report in reports)
+        self.TimeTick = reports[0]["time"]
+        self.done = all(report["idle"] for report in reports) and not any(self.inboxes)
+        return self.obs, sum(report["reward"] for report in reports)
+
+    def run(self, until=None):
+        # Step windows until every package is delivered or the clock reaches `until` hours
+        total = 0.0
+        while not self.done and (until is None or self.TimeTick < until):
+            total += self.step()[1]
+        return total
+
+    def gather_packages(self):
+        # {id: Package} of every shard; packages in flight between shards are in self.inboxes
+        packages = {}
+        for conn in self._conns:
+            conn.send(("packages", None))
+        for conn in self._conns:
+            packages.update(conn.recv())
+        for inbox in self.inboxes:
+            for _, item in inbox:
+                for package in (item[2] if isinstance(item, tuple) else (item,)):
+                    packages[package.id] = package
+        return packages
+
+    def close(self):
+        if self.closed:
+            return
+        for conn in self._conns:
+            conn.send(("close", None))
+        for conn in self._conns:
+            conn.recv()
+        for proc in self._procs:
+            proc.join()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,201 @@
+"""
+Parameter sweeps of LogisticsEnv over a process pool.
+
+Every (configuration, seed) pair is one run. Runs are fanned out over worker
+processes and a summary line is appended to the results file as each one
+finishes, JSONL or CSV depending on the extension:
+
+    python sweep.py --grid station_num=25,50 center_num=5 packet_num=1000 congestion_limit=10,30 \
+                    --seeds 0 1 2 --out sweep.jsonl
+    python sweep.py --configs configs.json --seeds 0 1 --out sweep.csv --workers 8
+
+Rerunning the same command resumes: runs that already have a result in the
+output file are skipped, failed runs are tried again.
+"""
+
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import multiprocessing as mp
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+# Keys a configuration may set: data_gen parameters plus LogisticsEnv options
+CONFIG_KEYS = ("station_num", "center_num", "packet_num", "congestion_limit")
+
+COLUMNS = [
+    "key", "seed", "station_num", "center_num", "packet_num", "congestion_limit",
+    "finished", "steps", "makespan", "delivered",
+    "mean_delivery_express", "p95_delivery_express", "mean_delivery_standard", "p95_delivery_standard",
+    "total_reward", "money_cost", "peak_node_queue", "peak_route_load", "wall_seconds", "error",
+]
+
+
+def run_key(cfg, seed):
+    return json.dumps({**cfg, "seed": seed}, sort_keys=True)
+
+
+def delivery_stats(times):
+    if not times:
+        return None, None
+    return float(np.mean(times)), float(np.percentile(times, 95))
+
+
+def run_config(cfg, seed, max_steps):
+    import main
+    main.VERBOSE = False
+    random.seed(seed)
+    np.random.seed(seed)
+    t0 = time.perf_counter()
+    params = dict(main.parameters, **{k: cfg[k] for k in ("station_num", "center_num") if k in cfg})
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        topology, _ = main.make_network(dict(params, packet_num=0))
+        packets = main.generate_packet_arrays(cfg.get("packet_num", params["packet_num"]), params["station_num"], seed=seed)
+        env = main.LogisticsEnv(topology, packets, congestion_limit=cfg.get("congestion_limit", 30))
+
+        n_nodes = len(env.nodes)
+        total_reward = 0.0
+        peak_node = peak_route = 0
+        steps = 0
+        while not env.done and steps < max_steps:
+            load, reward = env.step()
+            total_reward += reward
+            steps += 1
+            peak_node = max(peak_node, int(load[:2 * n_nodes:2].max(initial=0)))
+            peak_route = max(peak_route, int(load[2 * n_nodes:].max(initial=0)))
+
+    by_class = {0: [], 1: []}
+    for p in env.packages.values():
+        if p.done:
+            by_class[int(bool(p.category))].append(p.time_arrived - p.time_created)
+    # money spent: every route taken and every node that processed a package
+    money = sum(len(route.history) * route.cost for route in env.routes.values())
+    money += sum((len(node.history) - len(node.dones)) * node.cost for node in env.nodes.values())
+    mean_x, p95_x = delivery_stats(by_class[1])
+    mean_s, p95_s = delivery_stats(by_class[0])
+    return {
+        "finished": bool(env.done),
+        "steps": steps,
+        "makespan": env.TimeTick,
+        "delivered": len(by_class[0]) + len(by_class[1]),
+        "mean_delivery_express": mean_x,
+        "p95_delivery_express": p95_x,
+        "mean_delivery_standard": mean_s,
+        "p95_delivery_standard": p95_s,
+        "total_reward": total_reward,
+        "money_cost": float(money),
+        "peak_node_queue": peak_node,
+        "peak_route_load": peak_route,
+        "wall_seconds": time.perf_counter() - t0,
+    }
+
+
+def _run(cfg, seed, max_steps):
+    # Worker entry point: never raises, so one bad configuration does not stop the sweep
+    row = {"key": run_key(cfg, seed), "seed": seed, **cfg}
+    try:
+        row.update(run_config(cfg, seed, max_steps))
+    except Exception as exc:
+        row["error"] = f"{type(exc).__name__}: {exc}"
+    return row
+
+
+def parse_grid(items):
+    # ["station_num=25,50", "center_num=5"] -> list of configurations (cartesian product)
+    axes = {}
+    for item in items:
+        key, _, values = item.partition("=")
+        if key not in CONFIG_KEYS:
+            raise SystemExit(f"unknown parameter {key!r}, expected one of {', '.join(CONFIG_KEYS)}")
+        axes[key] = [int(v) for v in values.split(",")]
+    return [dict(zip(axes, combo)) for combo in itertools.product(*axes.values())]
+
+
+def load_configs(path):
+    with open(path, encoding="utf-8") as f:
+        configs = json.load(f)
+    for cfg in configs:
+        unknown = set(cfg) - set(CONFIG_KEYS)
+        if unknown:
+            raise SystemExit(f"unknown parameters {sorted(unknown)} in {path}")
+    return configs
+
+
+def finished_keys(path):
+    # Keys of the runs that already have a result, failed runs excluded
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path, encoding="utf-8", newline="") as f:
+        rows = csv.DictReader(f) if path.endswith(".csv") else (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            if not row.get("error"):
+                done.add(row["key"])
+    return done
+
+
+class ResultWriter:
+    # Appends one row per finished run and flushes it, so an interrupted sweep keeps every result
+    def __init__(self, path):
+        self.csv = path.endswith(".csv")
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "a", encoding="utf-8", newline="")
+        if self.csv:
+            self.writer = csv.DictWriter(self.file, fieldnames=COLUMNS, extrasaction="ignore")
+            if new:
+                self.writer.writeheader()
+
+    def write(self, row):
+        if self.csv:
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def sweep(configs, seeds, out, workers=None, max_steps=10**6):
+    runs = [(cfg, seed) for cfg in configs for seed in seeds]
+    done = finished_keys(out)
+    todo = [(cfg, seed) for cfg, seed in runs if run_key(cfg, seed) not in done]
+    print(f"{len(runs)} runs, {len(runs) - len(todo)} already in {out}, {len(todo)} to go")
+    if not todo:
+        return
+    writer = ResultWriter(out)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+            futures = [pool.submit(_run, cfg, seed, max_steps) for cfg, seed in todo]
+            for n, future in enumerate(as_completed(futures), 1):
+                row = future.result()
+                writer.write(row)
+                status = row.get("error") or f"makespan {row['makespan']:.1f} h, {row['wall_seconds']:.1f} s"
+                print(f"[{n}/{len(todo)}] {row['key']}: {status}")
+    finally:
+        writer.close()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Parallel parameter sweep of LogisticsEnv")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--grid", nargs="+", metavar="KEY=V1,V2", help=f"keys: {', '.join(CONFIG_KEYS)}")
+    group.add_argument("--configs", help="JSON file with a list of configurations")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--out", default="sweep.jsonl", help="results file, .jsonl or .csv")
+    parser.add_argument("--workers", type=int, default=None, help="processes, defaults to cpu_count")
+    parser.add_argument("--max-steps", type=int, default=10**6)
+    args = parser.parse_args()
+
+    configs = parse_grid(args.grid) if args.grid else load_configs(args.configs)
+    sweep(configs, args.seeds, args.out, args.workers, args.max_steps)
+
+
+if __name__ == "__main__":
+    main_cli()
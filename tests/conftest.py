@@ -0,0 +1,38 @@
+import contextlib
+import io
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def network():
+    # Small seeded network, returns (topology, packets)
+    main.VERBOSE = False
+    random.seed(0)
+    np.random.seed(0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return main.make_network(dict(main.parameters, packet_num=300))
+
+
+def run_to_end(env, max_steps=2000):
+    # Step to the end, returns the sorted (packet, arrival time, reward, hops) of every
+    # package; ids are left out, they differ between environments
+    steps = 0
+    while not env.done and steps < max_steps:
+        env.step()
+        steps += 1
+    return sorted(((p.time_created, p.src, p.dst, p.category), p.time_arrived, p.reward, p.hops)
+                  for p in env.packages.values())
+
+
+@pytest.fixture
+def run():
+    return run_to_end
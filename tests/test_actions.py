@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import main
+
+
+def flagged(env, step):
+    # Route indices flagged at a step: every route leaving a node that holds packages,
+    # every other step, so change_route() really reroutes some of them
+    if step % 2:
+        return []
+    return [route.index for route in env.route_list if env.nodes[route.src].packages]
+
+
+def forms(env, indices):
+    route_ids = [f"{env.route_list[r].src}->{env.route_list[r].dst}" for r in indices]
+    mask = np.zeros(len(env.route_list), dtype=bool)
+    mask[indices] = True
+    return {
+        "indices": set(indices),
+        "keys": {(env.route_list[r].src, env.route_list[r].dst) for r in indices},
+        "ids": set(route_ids),
+        "mask": mask,
+        "dense": mask.astype(int).tolist(),
+    }
+
+
+@pytest.mark.parametrize("form", ["indices", "keys", "ids", "mask", "dense"])
+def test_every_action_form_gives_the_same_run(network, run, form):
+    topology, packets = network
+    runs = {}
+    for name in ("indices", form):
+        env = main.LogisticsEnv(topology, packets, congestion_limit=5)
+        for step in range(200):
+            env.step(forms(env, flagged(env, step))[name])
+        runs[name] = run(env)
+    assert runs[form] == runs["indices"]
+
+
+@pytest.mark.parametrize("actions", [[3, 5], np.array([3, 5]), ["s1->c0"], [0, 1, 2]])
+def test_lists_that_are_not_masks_are_refused(network, actions):
+    topology, packets = network
+    env = main.LogisticsEnv(topology, packets)
+    with pytest.raises(ValueError):
+        env.step(actions)
+
+
+def test_dense_list_with_other_values_is_refused(network):
+    topology, packets = network
+    env = main.LogisticsEnv(topology, packets)
+    dense = [0] * len(env.route_list)
+    dense[2] = 3
+    with pytest.raises(ValueError):
+        env.step(dense)
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pytest
+
+import main
+
+
+def actions_at(step, env):
+    # Some reroutes, so seek() has logged actions to replay
+    return {route.index for route in env.routes.values() if route.index % 7 == step % 7} if step % 5 == 0 else set()
+
+
+@pytest.fixture
+def recorded(network, tmp_path):
+    topology, _ = network
+    env = main.LogisticsEnv(topology, main.generate_packet_arrays(800, topology.station_num, seed=5),
+                            congestion_limit=5)
+    env.enable_checkpoints(str(tmp_path), every=1.0)
+    loads = {}
+    for step in range(65):
+        env.step(actions_at(step, env))
+        loads[main.tick_index(env.TimeTick)] = (env.get_load().copy(), env.timecost.copy())
+    env.checkpointer.close()
+    return str(tmp_path), loads
+
+
+def test_static_data_is_written_once(recorded):
+    directory, _ = recorded
+    checkpoints = main.Checkpointer.checkpoints(directory)
+    assert len(checkpoints) >= 6
+    assert os.path.exists(os.path.join(directory, "static.pkl"))
+    for _, path in checkpoints:
+        checkpoint = main.read_pickle(path)
+        assert checkpoint['topology'] is None and checkpoint['static'] == "static.pkl"
+        assert set(checkpoint['state']['stream']) == {'released', 'last_time'}
+
+
+@pytest.mark.parametrize("tick", [10, 23, 40, 65])
+def test_seek_replays_the_run(recorded, tick):
+    directory, loads = recorded
+    env = main.LogisticsEnv.seek(directory, tick / 10)
+    assert main.tick_index(env.TimeTick) == tick
+    load, timecost = loads[tick]
+    assert np.array_equal(env.get_load(), load)
+    assert np.array_equal(env.timecost, timecost)
+
+
+def test_saved_env_continues_like_the_original(network, run, tmp_path):
+    topology, _ = network
+    env = main.LogisticsEnv(topology, main.generate_packet_arrays(500, topology.station_num, seed=6))
+    for _ in range(30):
+        env.step()
+    path = str(tmp_path / "one.pkl.gz")
+    env.save(path)
+    assert run(main.LogisticsEnv.load(path)) == run(env)
+
+
+def test_clone_and_snapshot_of_a_demand_stream(network, run):
+    # A one-shot iterator cannot be pickled, but forking it must still work
+    topology, _ = network
+    env = main.LogisticsEnv(topology, main.demand_stream(topology.station_num, 50, seed=1, until=20))
+    for _ in range(30):
+        env.step()
+    clone = env.clone()
+    snapshot = env.snapshot()
+    expected = run(env)
+    assert run(clone) == expected
+    env.restore(snapshot)
+    assert run(env) == expected
+
+
+def test_write_pickle_keeps_the_open_error(tmp_path):
+    path = str(tmp_path / "missing" / "ckpt.pkl")
+    with pytest.raises(FileNotFoundError) as err:
+        main.write_pickle({}, path)
+    assert err.value.__context__ is None
+    assert not os.path.exists(path + ".tmp")
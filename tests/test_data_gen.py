@@ -0,0 +1,73 @@
+import contextlib
+import io
+import random
+
+import numpy as np
+import pytest
+
+import main
+
+
+def loop_reference(center_pos, station_pos, station_labels, center_prop, station_prop):
+    # Edges and cost matrices built pair by pair, as data_gen() did before route_arrays()
+    cn, sn = len(center_pos), len(station_pos)
+    dist = lambda p, q: np.linalg.norm(np.array(p) - np.array(q))
+    edges = []
+    for i in range(cn):
+        for j in range(cn):
+            if j > i:
+                d = dist(center_pos[i], center_pos[j])
+                edges.append((f"c{i}", f"c{j}", 0.25 * d, 0.2 * d))
+                edges.append((f"c{j}", f"c{i}", 0.25 * d, 0.2 * d))
+    for i in range(cn):
+        for j in range(sn):
+            if station_labels[j] == i:
+                d = dist(center_pos[i], station_pos[j])
+                edges.append((f"c{i}", f"s{j}", 0.6 * d, 0.12 * d))
+                edges.append((f"s{j}", f"c{i}", 0.6 * d, 0.12 * d))
+    for i in range(sn):
+        for j in range(sn):
+            if i > j and dist(station_pos[i], station_pos[j]) < 30:
+                d = dist(station_pos[i], station_pos[j])
+                edges.append((f"s{i}", f"s{j}", 0.8 * d, 0.07 * d))
+                edges.append((f"s{j}", f"s{i}", 0.8 * d, 0.07 * d))
+    size = 2 * (cn + sn)
+    position = lambda node: 2 * int(node[1:]) + (0 if node[0] == "c" else 2 * cn)
+    M = np.full((size, size), np.inf)
+    N = np.full((size, size), np.inf)
+    for k, prop in enumerate(list(center_prop) + list(station_prop)):
+        M[2 * k][2 * k + 1] = 0.01
+        N[2 * k][2 * k + 1] = prop[2]
+    for src, dst, t, m in edges:
+        M[position(src) + 1][position(dst)] = t
+        N[position(src) + 1][position(dst)] = m
+    return edges, M, N
+
+
+@pytest.mark.parametrize("seed, station_num, center_num", [(0, 25, 5), (1, 60, 6), (2, 120, 8)])
+def test_routes_match_the_pairwise_loops(seed, station_num, center_num):
+    random.seed(seed)
+    np.random.seed(seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = main.data_gen(dict(main.parameters, station_num=station_num, center_num=center_num, packet_num=0))
+    labels = [0] * station_num
+    for src, dst, _, _ in data["edges"]:
+        if src[0] == "c" and dst[0] == "s":
+            labels[int(dst[1:])] = int(src[1:])
+    edges, M, N = loop_reference(data["center_pos"], data["station_pos"], labels,
+                                 data["center_prop"], data["station_prop"])
+    assert data["edges"] == edges
+    assert np.array_equal(data["time cost"], M)
+    assert np.array_equal(data["money cost"], N)
+
+
+def test_large_matrices_store_the_same_routes():
+    random.seed(3)
+    np.random.seed(3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = main.data_gen(dict(main.parameters, station_num=80, center_num=5, packet_num=0, large=True))
+    M = data["time cost"].tocsr()
+    index = lambda node: 2 * int(node[1:]) + (0 if node[0] == "c" else 10)
+    assert M.nnz == len(data["edges"]) + 85
+    for src, dst, t, _ in data["edges"]:
+        assert M[index(src) + 1, index(dst)] == t
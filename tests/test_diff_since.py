@@ -0,0 +1,55 @@
+import main
+
+
+def full_state(env):
+    diff = {'version': None, 'full': True, 'removed': []}
+    diff['nodes'] = {node.id: (len(node.buffer), len(node.packages), len(node.dones)) for node in env.nodes.values()}
+    diff['routes'] = {route.id: route.load() for route in env.routes.values()}
+    diff['packages'] = {p.id: (p.location, env.package_status(p)) for p in env.packages.values()}
+    return diff
+
+
+def apply(mirror, diff):
+    if diff['full']:
+        mirror = {'nodes': {}, 'routes': {}, 'packages': {}}
+    for key in ('nodes', 'routes', 'packages'):
+        mirror[key].update(diff[key])
+    for package_id in diff['removed']:
+        mirror['packages'].pop(package_id, None)
+    return mirror
+
+
+def test_mirror_follows_the_env(network):
+    topology, packets = network
+    # delivered packages are evicted after an hour, and only 5 versions are kept,
+    # so a client polling late gets a full state instead of a diff
+    env = main.LogisticsEnv(topology, packets, retention=main.RetentionPolicy(evict_after=1.0))
+    env.track_changes(keep=5)
+    diff = env.diff_since()
+    assert diff['full']
+    mirror = apply(None, diff)
+    version = diff['version']
+    removed = fulls = partial = 0
+    snapshot = None
+    for step in range(400):
+        env.step()
+        if step == 100:
+            snapshot = env.snapshot()
+        if step == 150:
+            env.restore(snapshot)  # earlier versions cannot be diffed against after this
+        if step % 9 in (0, 1, 3) or step % 50 == 7:
+            late = step % 50 == 7 and step > 0
+            if late:
+                for _ in range(7):
+                    env.step()
+            diff = env.diff_since(version)
+            removed += len(diff['removed'])
+            fulls += diff['full']
+            partial += not diff['full']
+            mirror = apply(mirror, diff)
+            version = diff['version']
+            expected = full_state(env)
+            assert mirror == {key: expected[key] for key in ('nodes', 'routes', 'packages')}
+    assert removed  # evicted packages reached the mirror as removals
+    assert fulls >= 2  # late polls and the restore gave full states
+    assert partial > fulls
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+import main
+
+
+def test_packet_arrays_match_tuples():
+    arrays = main.generate_packet_arrays(1000, 25, seed=3)
+    assert main.generate_packets(1000, 25, seed=3) == arrays.tuples()
+    assert list(arrays) == arrays.tuples()
+    assert arrays[5] == arrays.tuples()[5]
+    assert arrays[-1] == arrays.tuples()[-1]
+
+
+def test_packet_arrays_slice():
+    arrays = main.generate_packet_arrays(200, 25, seed=3)
+    part = arrays[10:50:2]
+    assert isinstance(part, main.PacketArrays)
+    assert part.tuples() == arrays.tuples()[10:50:2]
+    assert np.shares_memory(part.create_time, arrays.create_time)
+
+
+def test_env_runs_the_same_from_arrays_and_tuples(network, run):
+    topology, _ = network
+    arrays = main.generate_packet_arrays(300, topology.station_num, seed=1)
+    expected = run(main.LogisticsEnv(topology, arrays.tuples()))
+    assert run(main.LogisticsEnv(topology, arrays)) == expected
+
+
+def test_large_data_gen_keeps_arrays():
+    data = main.data_gen(dict(main.parameters, packet_num=50, large=True))
+    assert isinstance(data["packets"], main.PacketArrays)
+    assert len(data["packets"]) == 50
+    small = main.data_gen(dict(main.parameters, packet_num=50))
+    assert isinstance(small["packets"], list)
+
+
+@pytest.mark.parametrize("k", [0, 299])
+def test_env_reset_replays_arrays(network, run, k):
+    topology, _ = network
+    arrays = main.generate_packet_arrays(300, topology.station_num, seed=2)
+    env = main.LogisticsEnv(topology, arrays)
+    first = run(env)
+    env.reset()
+    assert run(env) == first
+    assert arrays[k] in [(p.time_created, p.src, p.dst, p.category) for p in env.packages.values()]
@@ -0,0 +1,76 @@
+import functools
+import random
+
+import pytest
+
+import main
+
+
+def packages(n, seed=0):
+    rng = random.Random(seed)
+    return [main.Package(k, rng.uniform(0, 12), "s0", "s1", rng.randrange(2)) for k in range(n)]
+
+
+def served(discipline, waiting):
+    # Order in which a node processing one package at a time serves `waiting`
+    node = main.Node("c0", (0, 0), throughput=1, delay=1, cost=0.5, discipline=discipline)
+    for package in waiting:
+        node.buffer.push(package)
+    order = []
+    node.process_packages()
+    while node.packages:
+        package = node.packages[0][1]
+        order.append(package)
+        package.delay = 0
+        node.remove_package()
+    return order
+
+
+def test_two_class_serves_express_first():
+    waiting = packages(50)
+    order = served(main.TwoClassQueue, waiting)
+    express = [p for p in waiting if p.category]
+    standard = [p for p in waiting if not p.category]
+    assert express and standard
+    assert order == express + standard  # FIFO within each class
+
+
+def test_edf_serves_by_deadline():
+    sla = {0: 10.0, 1: 2.0}
+    waiting = packages(50, seed=1)
+    order = served(functools.partial(main.EDFQueue, sla=sla), waiting)
+    due = [p.time_created + sla[p.category] for p in order]
+    assert len(order) == len(waiting) and due == sorted(due)
+    # a late Standard package can go before an early Express one
+    assert any(a.category == 0 and b.category == 1 for a, b in zip(order, order[1:]))
+
+
+def test_edf_ties_are_fifo():
+    waiting = [main.Package(k, 1.0, "s0", "s1", 1) for k in range(10)]
+    assert served(main.EDFQueue, waiting) == waiting
+
+
+@pytest.mark.parametrize("discipline", [main.TwoClassQueue, main.EDFQueue])
+def test_remap_keeps_the_order(discipline):
+    waiting = packages(30, seed=2)
+    queue = discipline()
+    for package in waiting:
+        queue.push(package)
+    copies = {p.id: main.Package(p.id, p.time_created, p.src, p.dst, p.category) for p in waiting}
+    remapped = queue.remap(copies)
+    assert [p.id for p in iter(remapped)] == [p.id for p in iter(queue)]
+    assert all(p is copies[p.id] for p in remapped)
+    assert [remapped.pop().id for _ in range(len(waiting))] == [queue.pop().id for _ in range(len(waiting))]
+
+
+def test_express_waits_less_with_two_classes_than_with_edf(network, run):
+    # On a busy network express packages gain from their priority
+    topology, _ = network
+    arrays = main.generate_packet_arrays(3000, topology.station_num, seed=7)
+    delay = {}
+    for name, discipline in (("two", main.TwoClassQueue),
+                             ("edf", functools.partial(main.EDFQueue, sla={0: 1.0, 1: 1.0}))):
+        result = run(main.LogisticsEnv(topology, arrays, queue_discipline=discipline), max_steps=5000)
+        express = [arrived - packet[0] for packet, arrived, _, _ in result if packet[3]]
+        delay[name] = sum(express) / len(express)
+    assert delay["two"] < delay["edf"]
@@ -0,0 +1,58 @@
+import main
+
+
+def histories(env):
+    return [p.history for p in env.packages.values()] + [n.history for n in env.nodes.values()] + \
+           [r.history for r in env.routes.values()]
+
+
+def stored(env):
+    return {r['id']: r for r in env.retention.store.query()}
+
+
+def test_history_is_capped(network, run):
+    topology, packets = network
+    env = main.LogisticsEnv(topology, packets)
+    run(env)
+    assert max(map(len, histories(env))) > 3
+    env = main.LogisticsEnv(topology, packets, retention=main.RetentionPolicy(history_limit=3))
+    run(env)
+    assert max(map(len, histories(env))) == 3
+
+
+def test_evicted_packages_go_to_the_store(network, run, tmp_path):
+    topology, packets = network
+    full = main.LogisticsEnv(topology, packets)
+    run(full)
+    env = main.LogisticsEnv(topology, packets, retention=main.RetentionPolicy(
+        history_limit=4, evict_after=0.5, store=main.HistoryStore(str(tmp_path / "history.jsonl"))))
+    run(env)
+    records = stored(env)
+    assert records and len(records) + len(env.packages) == len(packets)
+    assert records.keys().isdisjoint(str(i) for i in env.packages)
+    held = {(p.time_created, p.src, p.dst): p for p in full.packages.values()}
+    for r in records.values():
+        # the record keeps the last history_limit events of the package
+        package = held[(r['time_created'], r['src'], r['dst'])]
+        assert r['time_arrived'] == package.time_arrived and r['hops'] == package.hops
+        assert [tuple(e) for e in r['history']] == [tuple(e) for e in package.history[-4:]]
+
+
+def test_store_survives_save_and_load(network, run, tmp_path):
+    topology, packets = network
+    path = str(tmp_path / "history.jsonl")
+    env = main.LogisticsEnv(topology, packets, retention=main.RetentionPolicy(
+        evict_after=0.5, store=main.HistoryStore(path)))
+    while not stored(env):
+        env.step()
+    before = stored(env)
+    env.save(str(tmp_path / "env.pkl"))
+    env.retention.store.close()
+
+    loaded = main.LogisticsEnv.load(str(tmp_path / "env.pkl"))
+    assert loaded.retention.store.path == path and loaded.retention.evict_after == 0.5
+    assert all(loaded.retention.store.get(i) == r for i, r in before.items())
+    run(loaded)
+    after = stored(loaded)
+    assert before.keys() < after.keys()
+    assert len(after) + len(loaded.packages) == len(packets)
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+import main
+
+
+def path_cost(env, path, matrix):
+    # Processing at every node but the destination plus the routes between them
+    index = env.topology.index
+    return sum(matrix[index(a), index(a) + 1] + matrix[index(a) + 1, index(b)] for a, b in zip(path, path[1:]))
+
+
+def full_invalidate(self, cells, matrix):
+    self.invalidate()
+
+
+@pytest.fixture
+def congested(network):
+    topology, _ = network
+    return main.LogisticsEnv(topology, main.generate_packet_arrays(2000, topology.station_num, seed=4),
+                             congestion_limit=3)
+
+
+def test_table_paths_stay_shortest_under_congestion(congested):
+    env = congested
+    stations = [f"s{k}" for k in range(env.topology.station_num)]
+    congested = 0
+    for step in range(300):
+        env.step()
+        if step % 25:
+            continue
+        congested += sum(route.congested for route in env.routes.values())
+        for express in (True, False):
+            matrix = env.timecost if express else env.moneycost
+            fresh = main.RoutingTable(env.topology)
+            for dst in stations[::3]:
+                fresh.column(dst, matrix)
+                for src in stations[1::4]:
+                    if src == dst:
+                        continue
+                    path = env.table_path(src, dst, express)
+                    best = fresh.dists[dst][env.topology.index(src) // 2]
+                    assert path_cost(env, path, matrix) == pytest.approx(best)
+    assert congested
+
+
+def test_targeted_update_runs_like_full_invalidation(network, run, monkeypatch):
+    topology, _ = network
+    arrays = main.generate_packet_arrays(2000, topology.station_num, seed=4)
+    targeted = run(main.LogisticsEnv(topology, arrays, congestion_limit=3))
+    monkeypatch.setattr(main.RoutingTable, "update", full_invalidate)
+    assert run(main.LogisticsEnv(topology, arrays, congestion_limit=3)) == targeted
+
+
+def test_alternative_path_avoids_node(network):
+    topology, _ = network
+    env = main.LogisticsEnv(topology)
+    src, dst = "s0", "s7"
+    path = env.find_shortest_time_path(src, dst)
+    for avoid in path[1:-1]:
+        alt = env.find_alternative_time_path(src, dst, avoid)
+        if alt:
+            assert avoid not in alt and alt[0] == src and alt[-1] == dst
+            assert path_cost(env, alt, env.timecost) >= path_cost(env, path, env.timecost) - 1e-9
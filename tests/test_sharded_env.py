@@ -0,0 +1,43 @@
+import contextlib
+import io
+import random
+
+import numpy as np
+import pytest
+
+import main
+from sharded_env import ShardedLogisticsEnv
+
+
+def delivered(packages):
+    return sorted((p.time_created, p.src, p.dst, p.category, round(p.time_arrived, 6), p.hops)
+                  for p in packages.values())
+
+
+@pytest.fixture(scope="module")
+def regions():
+    # Several regions so that the shards really exchange packages
+    main.VERBOSE = False
+    random.seed(1)
+    np.random.seed(1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return main.make_network(dict(main.parameters, station_num=40, center_num=4, packet_num=400))
+
+
+@pytest.mark.parametrize("shards", [2, 3])
+def test_shards_deliver_like_a_single_env(regions, shards):
+    # Without congestion there are no flips to exchange, so the routes and the
+    # arrival times must be exactly those of one LogisticsEnv
+    topology, packets = regions
+    env = main.LogisticsEnv(topology, packets, congestion_limit=float("inf"))
+    while not env.done:
+        env.step()
+    with ShardedLogisticsEnv(topology, packets, shards=shards, congestion_limit=float("inf")) as sharded:
+        assert sharded.num_shards > 1
+        sharded.run()
+        packages = sharded.gather_packages()
+        owner = sharded.owner
+    assert any(owner[p.src] != owner[p.dst] for p in packages.values())
+    assert len(packages) == len(env.packages)
+    assert all(p.done for p in packages.values())
+    assert delivered(packages) == delivered(env.packages)
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+import main
+from vec_env import VecLogisticsEnv
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_shared_observations_match_single_envs(network, processes):
+    topology, _ = network
+    seeds = [3, 8]
+    singles = [main.LogisticsEnv(topology, main.generate_packet_arrays(200, topology.station_num, seed=seed))
+               for seed in seeds]
+    rng = np.random.default_rng(0)
+    with VecLogisticsEnv(topology, 2, seeds=seeds, packet_num=200, processes=processes,
+                         start_method="spawn") as vec:
+        assert np.array_equal(vec.obs, np.stack([env.get_load() for env in singles]))
+        for step in range(80):
+            actions = (rng.random((2, vec.num_routes)) < 0.05).astype(np.int8) if step % 3 == 0 else None
+            obs, rewards, dones = vec.step(actions)
+            for k, env in enumerate(singles):
+                load, reward = env.step(None if actions is None else actions[k] == 1)
+                assert np.array_equal(obs[k], load)
+                assert rewards[k] == reward and dones[k] == env.done
+        # a reset environment starts over, the other one keeps going
+        obs = vec.reset([1])
+        assert np.array_equal(obs[1], singles[1].reset())
+        assert np.array_equal(obs[0], singles[0].get_load())
@@ -0,0 +1,72 @@
+import pytest
+
+import main
+
+
+def airlines(capacity=4, **kwargs):
+    # Vehicles on the routes between centers, packages elsewhere
+    spec = dict(capacity=capacity, **kwargs)
+    return lambda src, dst: spec if src[0] == dst[0] == "c" else None
+
+
+@pytest.fixture
+def departures(monkeypatch):
+    # (route, tick, [(tick docked, package)]) of every vehicle leaving
+    log = []
+    depart = main.VehicleRoute.depart
+
+    def record(route, tick):
+        log.append((route, tick, list(route.fleet.dock)[:route.capacity]))
+        depart(route, tick)
+
+    monkeypatch.setattr(main.VehicleRoute, "depart", record)
+    return log
+
+
+def test_vehicles_leave_on_the_headway(network, run, departures):
+    topology, packets = network
+    env = main.LogisticsEnv(topology, packets, vehicles=airlines(capacity=4, headway=1.0, offset=0.5))
+    assert env.vehicle_routes
+    result = run(env)
+    assert departures and all(arrived < float("inf") for _, arrived, _, _ in result)
+    slots = set()
+    for route, tick, batch in departures:
+        assert 1 <= len(batch) <= route.capacity
+        assert (tick - route.offset) % route.headway == 0
+        assert (route.id, tick) not in slots  # one vehicle per slot
+        slots.add((route.id, tick))
+
+
+def test_vehicles_leave_full_or_after_max_wait(network, run, departures):
+    topology, packets = network
+    env = main.LogisticsEnv(topology, packets, vehicles=airlines(capacity=6, fill=3, max_wait=2.0))
+    run(env)
+    assert departures
+    for route, tick, batch in departures:
+        assert 1 <= len(batch) <= 3
+        # a vehicle leaves at the latest max_wait after its first package docked
+        assert tick - batch[0][0] <= route.max_wait
+        assert len(batch) == 3 or tick - batch[0][0] == route.max_wait
+
+
+@pytest.mark.parametrize("how", ["clone", "restore", "load"])
+def test_forked_vehicle_env_runs_the_same(network, run, tmp_path, how):
+    topology, packets = network
+    env = main.LogisticsEnv(topology, packets, vehicles=airlines(capacity=4, headway=1.0))
+    # fork while vehicles are loading and travelling
+    busy = lambda: sum(bool(route.fleet.dock) + bool(route.fleet.vehicles) for route in env.vehicle_routes)
+    while busy() < 2 and not env.done:
+        env.step()
+    assert busy() >= 2
+    if how == "clone":
+        other = env.clone()
+    elif how == "restore":
+        snapshot = env.snapshot()
+        other = env.clone()
+        for _ in range(10):
+            other.step()
+        other.restore(snapshot)
+    else:
+        env.save(str(tmp_path / "vehicles.pkl"))
+        other = main.LogisticsEnv.load(str(tmp_path / "vehicles.pkl"))
+    assert run(other) == run(env)
@@ -0,0 +1,173 @@
+"""
+VecLogisticsEnv: K independent LogisticsEnv instances stepped in a process pool.
+
+Every environment shares the same network (a Topology) but has its
+own seed and therefore its own packets. Workers write observations, rewards
+and done flags straight into shared-memory NumPy arrays, and actions are read
+from a shared [K, R] array, so one step() only sends a short command to each
+worker instead of pickling observations back and forth.
+"""
+
+import contextlib
+import multiprocessing as mp
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import main
+from main import LogisticsEnv, generate_packet_arrays, parameters
+
+
+def _attach(name, shape, dtype):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _vec_worker(conn, env_ids, seeds, topology, packet_num, layout, quiet):
+    # layout: {array name: (shm name, shape, dtype)}
+    shms = []
+    arrays = {}
+    for key, (name, shape, dtype) in layout.items():
+        shm, arr = _attach(name, shape, dtype)
+        shms.append(shm)
+        arrays[key] = arr
+    obs, rewards, dones, actions = arrays["obs"], arrays["rewards"], arrays["dones"], arrays["actions"]
+
+    if quiet:
+        main.VERBOSE = False
+    out = open(os.devnull, "w") if quiet else None
+    with contextlib.redirect_stdout(out) if quiet else contextlib.nullcontext():
+        envs = {}
+        for k, seed in zip(env_ids, seeds):
+            envs[k] = LogisticsEnv(topology, generate_packet_arrays(packet_num, topology.station_num, seed=seed))
+            obs[k] = envs[k].get_load()
+        conn.send("ready")
+
+        while True:
+            cmd, arg = conn.recv()
+            if cmd == "step":
+                for k, env in envs.items():
+                    load, reward = env.step(actions[k] == 1)
+                    obs[k] = load
+                    rewards[k] = reward
+                    dones[k] = env.done
+            elif cmd == "reset":
+                for k in arg:
+                    if k in envs:
+                        obs[k] = envs[k].reset()
+                        rewards[k] = 0.0
+                        dones[k] = False
+            conn.send("ok")
+            if cmd == "close":
+                break
+
+    if out is not None:
+        out.close()
+    for shm in shms:
+        shm.close()
+    conn.close()
+
+
+class VecLogisticsEnv:
+    def __init__(self, topology, num_envs, seeds=None, packet_num=None, processes=None,
+                 start_method=None, quiet=True):
+        """
+        topology: network shared by every environment (see main.make_network)
+        num_envs: number of independent environments (K)
+        seeds: one seed per environment, defaults to range(K)
+        packet_num: packets per environment, defaults to parameters["packet_num"]
+        processes: size of the process pool, defaults to min(K, cpu_count)
+        quiet: silence the simulator's prints inside the workers
+        """
+        if seeds is None:
+            seeds = list(range(num_envs))
+        if len(seeds) != num_envs:
+            raise ValueError("one seed per environment is required")
+        if packet_num is None:
+            packet_num = parameters["packet_num"]
+
+        self.num_envs = num_envs
+        self.num_routes = len(topology.edges)
+        num_nodes = topology.station_num + topology.center_num
+        self.obs_size = 2 * num_nodes + self.num_routes
+
+        specs = {
+            "obs": ((num_envs, self.obs_size), np.int32),
+            "rewards": ((num_envs,), np.float64),
+            "dones": ((num_envs,), np.bool_),
+            "actions": ((num_envs, self.num_routes), np.int8),
+        }
+        self._shms = []
+        layout = {}
+        for key, (shape, dtype) in specs.items():
+            nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            self._shms.append(shm)
+            arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            arr.fill(0)
+            setattr(self, key, arr)
+            layout[key] = (shm.name, shape, dtype)
+
+        processes = min(num_envs, processes or os.cpu_count() or 1)
+        ctx = mp.get_context(start_method)
+        self._conns = []
+        self._procs = []
+        for w in range(processes):
+            env_ids = list(range(w, num_envs, processes))
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(
+                target=_vec_worker,
+                args=(child_conn, env_ids, [seeds[k] for k in env_ids], topology, packet_num, layout, quiet),
+                daemon=True,
+            )
+            proc.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._procs.append(proc)
+        for conn in self._conns:
+            conn.recv()
+        self.closed = False
+
+    def _broadcast(self, cmd, arg=None):
+        for conn in self._conns:
+            conn.send((cmd, arg))
+        for conn in self._conns:
+            conn.recv()
+
+    def reset(self, indices=None):
+        # Resets the given environments (all by default) and returns the observation array
+        if indices is None:
+            indices = range(self.num_envs)
+        self._broadcast("reset", list(indices))
+        return self.obs
+
+    def step(self, actions=None):
+        """
+        actions: [K, R] array of 0/1 (1 triggers change_route on that route), or None.
+        Returns (obs[K, D], rewards[K], dones[K]); the arrays live in shared memory and
+        are overwritten by the next call, copy them if they must be kept.
+        """
+        if actions is None:
+            self.actions.fill(0)
+        else:
+            self.actions[:] = actions
+        self._broadcast("step")
+        return self.obs, self.rewards, self.dones
+
+    def close(self):
+        if self.closed:
+            return
+        self._broadcast("close")
+        for proc in self._procs:
+            proc.join()
+        for shm in self._shms:
+            shm.close()
+            shm.unlink()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()